@@ -0,0 +1,96 @@
+"""
+🧭 Script para pré-calcular os vizinhos mais próximos de cada filme (item-item)
+
+Gera, ao lado de cache/embeddings.npy:
+    neighbors_idx.npy   int32[N, K]    linhas dos K filmes mais similares (melhor primeiro)
+    neighbors_sims.npy  float16[N, K]  similaridade de cosseno desses vizinhos
+    neighbors.json      fingerprint do embeddings.npy usado (tabela antiga é ignorada)
+
+O catálogo só muda quando populate_tmdb.py / regenerate_embeddings.py correm,
+por isso EXECUTAR ESTE SCRIPT DEPOIS de export_cache.py ou regenerate_embeddings.py.
+O SistemaRecomendacaoSimilaridade carrega a tabela sozinho e passa a servir
+candidatos com lookups O(ratings × K).
+
+Uso:
+    python build_neighbors.py [K]     (K padrão: 100)
+"""
+import os
+import sys
+import time
+import numpy as np
+from cache_store import (
+    EMBEDDINGS_CACHE_PATH, NEIGHBOR_IDX_PATH, NEIGHBOR_SIMS_PATH,
+    embeddings_fingerprint, load_embeddings, save_neighbors
+)
+
+DEFAULT_K = 100
+BLOCK_SIZE = 1024
+
+
+def compute_neighbors(embeddings: np.ndarray, k: int = DEFAULT_K, block_size: int = BLOCK_SIZE):
+    """
+    Top-k vizinhos de cada linha (excluindo a própria) por blocos de produto matricial.
+    Retorna (idx int32[N, k], sims float16[N, k]).
+    """
+    n = len(embeddings)
+    k = min(k, n - 1)
+
+    normas = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = np.divide(
+        embeddings, normas,
+        out=np.zeros(embeddings.shape, dtype=np.float32),
+        where=normas > 0
+    ).astype(np.float32, copy=False)
+
+    idx = np.empty((n, k), dtype=np.int32)
+    sims = np.empty((n, k), dtype=np.float16)
+
+    for inicio in range(0, n, block_size):
+        fim = min(inicio + block_size, n)
+        bloco = unit[inicio:fim] @ unit.T
+
+        # O próprio filme não é vizinho de si mesmo
+        linhas = np.arange(fim - inicio)
+        bloco[linhas, linhas + inicio] = -np.inf
+
+        parcial = np.argpartition(-bloco, k - 1, axis=1)[:, :k]
+        parcial_sims = np.take_along_axis(bloco, parcial, axis=1)
+        ordem = np.argsort(-parcial_sims, axis=1, kind='stable')
+
+        idx[inicio:fim] = np.take_along_axis(parcial, ordem, axis=1)
+        sims[inicio:fim] = np.take_along_axis(parcial_sims, ordem, axis=1)
+
+        print(f"   📄 {fim}/{n} filmes")
+
+    return idx, sims
+
+
+def main():
+    k = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_K
+
+    print("=" * 60)
+    print(f"🧭 PRÉ-CALCULAR TOP-{k} VIZINHOS POR FILME")
+    print("=" * 60)
+
+    if not os.path.exists(EMBEDDINGS_CACHE_PATH):
+        print("❌ Cache não encontrado! Execute: python export_cache.py")
+        return
+
+    # Fingerprint antes de ler: se o ficheiro mudar durante o cálculo, a tabela fica marcada como antiga
+    fingerprint = embeddings_fingerprint()
+    embeddings = load_embeddings()
+    print(f"✅ Embeddings: {embeddings.shape}")
+
+    start = time.time()
+    idx, sims = compute_neighbors(embeddings, k)
+
+    save_neighbors(idx, sims, fingerprint)
+
+    size_mb = (idx.nbytes + sims.nbytes) / (1024 * 1024)
+    print(f"\n✅ Tabela de vizinhos guardada ({size_mb:.1f} MB, {time.time() - start:.1f}s)")
+    print(f"   {NEIGHBOR_IDX_PATH}")
+    print(f"   {NEIGHBOR_SIMS_PATH}")
+
+
+if __name__ == "__main__":
+    main()
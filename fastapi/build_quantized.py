@@ -0,0 +1,68 @@
+"""
+🗜️ Script para gerar a cópia int8 dos embeddings
+
+Gera, ao lado de cache/embeddings.npy:
+    embeddings_int8.npy   int8[N, D]  linhas normalizadas quantizadas
+    quantization.npz      escala por dimensão e impressão digital do embeddings.npy
+
+A busca local (VECTOR_SEARCH=local + LOCAL_QUANTIZATION=int8) faz a seleção
+grossa nesta cópia (4x menor) e só re-ordena os melhores candidatos com os
+vetores float32. O ficheiro é aberto com mmap, por isso todos os workers
+partilham as mesmas páginas. Poupa memória, não tempo: a busca não fica mais
+rápida que a exata.
+
+EXECUTAR ESTE SCRIPT DEPOIS de export_cache.py ou regenerate_embeddings.py.
+
+Uso:
+    python build_quantized.py
+"""
+import os
+import time
+import numpy as np
+from cache_store import (
+    EMBEDDINGS_CACHE_PATH, QUANTIZED_EMBEDDINGS_PATH, QUANTIZATION_PATH, embeddings_fingerprint, load_embeddings
+)
+from vector_index import QUANTIZATION_BLOCK, quantize_embeddings
+
+
+def inverse_norms(embeddings: np.ndarray, block_size: int = QUANTIZATION_BLOCK) -> np.ndarray:
+    """1 / norma de cada linha (0 para linhas sem embedding), por blocos"""
+    inv_norms = np.zeros(len(embeddings), dtype=np.float32)
+    for inicio in range(0, len(embeddings), block_size):
+        bloco = embeddings[inicio:inicio + block_size]
+        normas = np.sqrt(np.einsum('ij,ij->i', bloco, bloco))
+        np.divide(1.0, normas, out=inv_norms[inicio:inicio + block_size], where=normas > 0)
+    return inv_norms
+
+
+def main():
+    print("=" * 60)
+    print("🗜️ EMBEDDINGS QUANTIZADOS (INT8)")
+    print("=" * 60)
+
+    if not os.path.exists(EMBEDDINGS_CACHE_PATH):
+        print("❌ Cache não encontrado! Execute: python export_cache.py")
+        return
+
+    fingerprint = embeddings_fingerprint()
+    embeddings = load_embeddings()
+    print(f"✅ Embeddings: {embeddings.shape}")
+
+    start = time.time()
+    # Escrito num ficheiro temporário e trocado de uma vez: workers em execução continuam com o antigo
+    tmp_path = QUANTIZED_EMBEDDINGS_PATH + ".tmp"
+    compact = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.int8, shape=embeddings.shape)
+    _, scale = quantize_embeddings(embeddings, inverse_norms(embeddings), out=compact)
+    compact.flush()
+    del compact
+    os.replace(tmp_path, QUANTIZED_EMBEDDINGS_PATH)
+    np.savez(QUANTIZATION_PATH, scale=scale, embeddings=fingerprint)
+
+    size_mb = os.path.getsize(QUANTIZED_EMBEDDINGS_PATH) / (1024 * 1024)
+    print(f"\n✅ Embeddings quantizados guardados ({size_mb:.1f} MB, {time.time() - start:.1f}s)")
+    print(f"   {QUANTIZED_EMBEDDINGS_PATH}")
+    print(f"   {QUANTIZATION_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+📉 Script para gerar a versão reduzida dos embeddings (128–256 dims)
+
+Gera, ao lado de cache/embeddings.npy:
+    embeddings_reduced.npy  float32[N, R]  filmes projetados em R dimensões
+    reduction.npz           projeção (D x R) e média usadas na projeção
+
+A busca local (VECTOR_SEARCH=local + LOCAL_REDUCED_TIER=1) faz a seleção grossa
+(top-500) nas R dimensões e só ordena esses candidatos com os vetores completos:
+menos 4–8x FLOPs por query.
+
+Métodos:
+    pca       projeção PCA ajustada numa amostra dos embeddings (padrão)
+    truncate  primeiras R dimensões, para modelos treinados com Matryoshka
+
+EXECUTAR ESTE SCRIPT DEPOIS de export_cache.py ou regenerate_embeddings.py.
+
+Uso:
+    python build_reduced.py [R] [pca|truncate]     (R padrão: 256)
+"""
+import os
+import sys
+import time
+import numpy as np
+from cache_store import (
+    EMBEDDINGS_CACHE_PATH, REDUCED_EMBEDDINGS_PATH, REDUCTION_PATH, embeddings_fingerprint, load_embeddings
+)
+
+DEFAULT_DIMS = 256
+PCA_SAMPLE = 20000
+BLOCK_SIZE = 4096
+
+
+def _unit_rows(block: np.ndarray) -> np.ndarray:
+    normas = np.linalg.norm(block, axis=1, keepdims=True)
+    return np.divide(block, normas, out=np.zeros(block.shape, dtype=np.float32), where=normas > 0)
+
+
+def fit_pca_projection(embeddings: np.ndarray, dims: int, sample_size: int = PCA_SAMPLE, seed: int = 0):
+    """
+    PCA dos embeddings normalizados (numa amostra de linhas).
+    Retorna (projeção float32[D, R], média float32[D], variância explicada).
+    """
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(len(embeddings), size=min(sample_size, len(embeddings)), replace=False))
+    unit = _unit_rows(np.asarray(embeddings[sample], dtype=np.float32))
+    mean = unit.mean(axis=0)
+
+    _, singular, vt = np.linalg.svd(unit - mean, full_matrices=False)
+    explained = float((singular[:dims] ** 2).sum() / (singular ** 2).sum())
+    return vt[:dims].T.astype(np.float32), mean.astype(np.float32), explained
+
+
+def truncation_projection(dim: int, dims: int):
+    """Matryoshka: as primeiras R dimensões já são um embedding válido"""
+    return np.eye(dim, dims, dtype=np.float32), np.zeros(dim, dtype=np.float32)
+
+
+def reduce_embeddings(embeddings: np.ndarray, projection: np.ndarray, mean: np.ndarray,
+                      block_size: int = BLOCK_SIZE) -> np.ndarray:
+    """(unit(linha) - média) @ projeção, por blocos; float32[N, R]"""
+    reduced = np.empty((len(embeddings), projection.shape[1]), dtype=np.float32)
+    for inicio in range(0, len(embeddings), block_size):
+        bloco = _unit_rows(np.asarray(embeddings[inicio:inicio + block_size], dtype=np.float32))
+        reduced[inicio:inicio + block_size] = (bloco - mean) @ projection
+    return reduced
+
+
+def main():
+    dims = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_DIMS
+    method = sys.argv[2] if len(sys.argv) > 2 else "pca"
+
+    print("=" * 60)
+    print(f"📉 EMBEDDINGS REDUZIDOS: {dims} DIMS ({method.upper()})")
+    print("=" * 60)
+
+    if not os.path.exists(EMBEDDINGS_CACHE_PATH):
+        print("❌ Cache não encontrado! Execute: python export_cache.py")
+        return
+
+    fingerprint = embeddings_fingerprint()
+    embeddings = load_embeddings()
+    print(f"✅ Embeddings: {embeddings.shape}")
+    if dims >= embeddings.shape[1]:
+        print(f"❌ R tem de ser menor que {embeddings.shape[1]}")
+        return
+
+    start = time.time()
+    if method == "pca":
+        projection, mean, explained = fit_pca_projection(embeddings, dims)
+        print(f"   Variância explicada: {explained * 100:.1f}%")
+    elif method == "truncate":
+        projection, mean = truncation_projection(embeddings.shape[1], dims)
+    else:
+        print(f"❌ Método desconhecido: {method} (pca ou truncate)")
+        return
+
+    reduced = reduce_embeddings(embeddings, projection, mean)
+    np.save(REDUCED_EMBEDDINGS_PATH, reduced)
+    np.savez(REDUCTION_PATH, projection=projection, mean=mean, method=method, embeddings=fingerprint)
+
+    size_mb = reduced.nbytes / (1024 * 1024)
+    print(f"\n✅ Embeddings reduzidos guardados ({size_mb:.1f} MB, {time.time() - start:.1f}s)")
+    print(f"   {REDUCED_EMBEDDINGS_PATH}")
+    print(f"   {REDUCTION_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Local cache of the movies table (written by export_cache.py).
+
+    cache/movies.parquet      movie metadata (no embeddings), columnar; needs pyarrow
+    cache/movies.pkl          same DataFrame as a pickle, used when pyarrow is not installed
+    cache/embeddings.npy      float32 matrix, row i = movies.pkl row i
+    cache/neighbors_idx.npy   int32[N, K] item-item neighbours (build_neighbors.py)
+    cache/neighbors_sims.npy  float16[N, K] similarities of those neighbours
+    cache/neighbors.json      fingerprint of the embeddings.npy the neighbours were built from
+    cache/embeddings_reduced.npy  float32[N, R] PCA / truncated rows (build_reduced.py)
+    cache/reduction.npz       projection (D x R), mean and embeddings.npy fingerprint behind embeddings_reduced.npy
+    cache/embeddings_int8.npy int8[N, D] quantized unit rows (build_quantized.py)
+    cache/quantization.npz    per-dimension scale and embeddings.npy fingerprint behind embeddings_int8.npy
+    cache/manifest.json       high-water mark of the last export (export_cache.py --delta)
+"""
+import os
+import json
+import pickle
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache")
+MOVIES_CACHE_PATH = os.path.join(CACHE_DIR, "movies.pkl")
+MOVIES_PARQUET_PATH = os.path.join(CACHE_DIR, "movies.parquet")
+EMBEDDINGS_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.npy")
+NEIGHBOR_IDX_PATH = os.path.join(CACHE_DIR, "neighbors_idx.npy")
+NEIGHBOR_SIMS_PATH = os.path.join(CACHE_DIR, "neighbors_sims.npy")
+NEIGHBOR_META_PATH = os.path.join(CACHE_DIR, "neighbors.json")
+REDUCED_EMBEDDINGS_PATH = os.path.join(CACHE_DIR, "embeddings_reduced.npy")
+REDUCTION_PATH = os.path.join(CACHE_DIR, "reduction.npz")
+QUANTIZED_EMBEDDINGS_PATH = os.path.join(CACHE_DIR, "embeddings_int8.npy")
+QUANTIZATION_PATH = os.path.join(CACHE_DIR, "quantization.npz")
+MANIFEST_PATH = os.path.join(CACHE_DIR, "manifest.json")
+
+
+def movies_cache_exists() -> bool:
+    return os.path.exists(MOVIES_PARQUET_PATH) or os.path.exists(MOVIES_CACHE_PATH)
+
+
+def cache_exists() -> bool:
+    return movies_cache_exists() and os.path.exists(EMBEDDINGS_CACHE_PATH)
+
+
+def load_movies_cache() -> pd.DataFrame:
+    """Loads the movie metadata DataFrame (Parquet if present, else the pickle)"""
+    if os.path.exists(MOVIES_PARQUET_PATH):
+        return pd.read_parquet(MOVIES_PARQUET_PATH)
+    with open(MOVIES_CACHE_PATH, 'rb') as f:
+        return pickle.load(f)
+
+
+def save_movies_cache(df: pd.DataFrame) -> str:
+    """
+    Saves the movie metadata as Parquet (pickle without pyarrow) and removes
+    the cache in the other format so a stale copy is never loaded. Returns the path written.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    if HAS_PYARROW:
+        path, stale = MOVIES_PARQUET_PATH, MOVIES_CACHE_PATH
+        df.to_parquet(path + ".tmp", index=False)
+    else:
+        path, stale = MOVIES_CACHE_PATH, MOVIES_PARQUET_PATH
+        with open(path + ".tmp", 'wb') as f:
+            pickle.dump(df, f)
+    os.replace(path + ".tmp", path)
+    if os.path.exists(stale):
+        os.remove(stale)
+    return path
+
+
+def spill_movies_page(rows: list, path: str) -> str:
+    """
+    Writes one page of metadata rows to its own spill file (Parquet, or a
+    pickle without pyarrow) so an export never holds the whole catalogue.
+    Returns the path written (the extension is added here).
+    """
+    if HAS_PYARROW:
+        path += ".parquet"
+        pq.write_table(pa.Table.from_pylist(rows), path)
+    else:
+        path += ".pkl"
+        with open(path, 'wb') as f:
+            pickle.dump(rows, f)
+    return path
+
+
+def save_movies_cache_from_spills(spill_paths: list) -> str:
+    """
+    Joins the spill files (in order) into the movies cache and removes them.
+    With pyarrow one page is in memory at a time: the pages are cast to a
+    common schema (a column that was all null on one page takes the type it
+    has on the others) and streamed into movies.parquet. Without pyarrow the
+    pickle needs the full DataFrame, built once from the pages.
+    """
+    if not HAS_PYARROW:
+        pages = []
+        for path in spill_paths:
+            with open(path, 'rb') as f:
+                pages.append(pd.DataFrame(pickle.load(f)))
+        path = save_movies_cache(pd.concat(pages, ignore_index=True))
+    else:
+        schema = pa.unify_schemas([pq.read_schema(p) for p in spill_paths], promote_options="permissive")
+        path = MOVIES_PARQUET_PATH
+        with pq.ParquetWriter(path + ".tmp", schema) as writer:
+            for spill_path in spill_paths:
+                table = pq.read_table(spill_path)
+                for field in schema:
+                    if field.name not in table.column_names:
+                        table = table.append_column(field.name, pa.nulls(len(table), field.type))
+                writer.write_table(table.select(schema.names).cast(schema))
+        os.replace(path + ".tmp", path)
+        if os.path.exists(MOVIES_CACHE_PATH):
+            os.remove(MOVIES_CACHE_PATH)
+    for spill_path in spill_paths:
+        os.remove(spill_path)
+    return path
+
+
+def load_embeddings(mmap_mode: str = 'r') -> np.ndarray:
+    """
+    Loads the embedding matrix (row-aligned with load_movies_cache).
+    By default the file is memory-mapped read-only: pages come from the OS page
+    cache, so every uvicorn worker on the host shares one physical copy.
+    Pass mmap_mode=None for a private in-memory array.
+    """
+    return np.load(EMBEDDINGS_CACHE_PATH, mmap_mode=mmap_mode)
+
+
+def embeddings_fingerprint() -> str:
+    """
+    Identifies the current embeddings.npy (size + mtime), or None without one.
+    Every writer replaces or appends to the file, so any change moves the mtime.
+    """
+    if not os.path.exists(EMBEDDINGS_CACHE_PATH):
+        return None
+    stat = os.stat(EMBEDDINGS_CACHE_PATH)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def save_neighbors(idx: np.ndarray, sims: np.ndarray, fingerprint: str):
+    """Saves the neighbour table and the fingerprint of the embeddings it was built from"""
+    np.save(NEIGHBOR_IDX_PATH, idx)
+    np.save(NEIGHBOR_SIMS_PATH, sims)
+    with open(NEIGHBOR_META_PATH, 'w', encoding='utf-8') as f:
+        json.dump({'embeddings': fingerprint, 'rows': len(idx), 'k': idx.shape[1]}, f)
+
+
+def load_neighbors():
+    """
+    Loads the precomputed neighbour table, or None if it was not built or is
+    stale (built from another embeddings.npy, e.g. before a re-embed).
+    Returns (idx, sims): for movie row i, idx[i] are its K most similar rows
+    (row indices into movies.pkl / embeddings.npy) and sims[i] their similarities, best first.
+    """
+    if not (os.path.exists(NEIGHBOR_IDX_PATH) and os.path.exists(NEIGHBOR_SIMS_PATH)):
+        return None
+    meta = {}
+    if os.path.exists(NEIGHBOR_META_PATH):
+        with open(NEIGHBOR_META_PATH, encoding='utf-8') as f:
+            meta = json.load(f)
+    if meta.get('embeddings') != embeddings_fingerprint():
+        print("⚠️  Neighbour table is older than embeddings.npy (run build_neighbors.py). Using live search.")
+        return None
+    return np.load(NEIGHBOR_IDX_PATH), np.load(NEIGHBOR_SIMS_PATH)
+
+
+def load_reduced():
+    """
+    Loads the reduced search tier, or None if it was not built or is stale
+    (built from another embeddings.npy, e.g. before export_cache.py --delta).
+    Returns (reduced, projection): reduced[i] is movie row i projected to R dims
+    (memory-mapped), projection maps a D-dim query to the same space.
+    """
+    if not (os.path.exists(REDUCED_EMBEDDINGS_PATH) and os.path.exists(REDUCTION_PATH)):
+        return None
+    with np.load(REDUCTION_PATH) as reduction:
+        projection = reduction['projection']
+        fingerprint = str(reduction['embeddings']) if 'embeddings' in reduction.files else None
+    if fingerprint != embeddings_fingerprint():
+        print("⚠️  Reduced tier is older than embeddings.npy (run build_reduced.py)")
+        return None
+    return np.load(REDUCED_EMBEDDINGS_PATH, mmap_mode='r'), projection
+
+
+def load_quantized():
+    """
+    Loads the int8 copy of the embeddings, or None if it was not built or is stale.
+    Returns (compact, scale): compact[i] * scale ≈ unit(movie row i); compact is
+    memory-mapped, so every worker shares the same pages.
+    """
+    if not (os.path.exists(QUANTIZED_EMBEDDINGS_PATH) and os.path.exists(QUANTIZATION_PATH)):
+        return None
+    with np.load(QUANTIZATION_PATH) as quantization:
+        scale = quantization['scale']
+        fingerprint = str(quantization['embeddings'])
+    if fingerprint != embeddings_fingerprint():
+        print("⚠️  Quantized copy is older than embeddings.npy (run build_quantized.py)")
+        return None
+    return np.load(QUANTIZED_EMBEDDINGS_PATH, mmap_mode='r'), scale
+
+
+def load_manifest():
+    """Returns the export manifest (dict), or None if the cache has none"""
+    if not os.path.exists(MANIFEST_PATH):
+        return None
+    with open(MANIFEST_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def cache_consistency_error(movie_rows: int, embedding_rows: int) -> str:
+    """
+    Why the cache on disk cannot be used, or None. The manifest is written
+    last by every writer with the fingerprint of embeddings.npy, so a writer
+    that died half-way (e.g. a --delta between embeddings.npy and the
+    metadata) leaves a cache that is rejected here instead of misaligned rows.
+    """
+    if movie_rows != embedding_rows:
+        return f"movies has {movie_rows} rows but embeddings.npy has {embedding_rows}"
+    manifest = load_manifest()
+    if manifest is None or 'embeddings' not in manifest:
+        return None  # caches exported before the manifest tracked the file
+    if manifest['rows'] != movie_rows or manifest['embeddings'] != embeddings_fingerprint():
+        return "embeddings.npy / metadata changed after the manifest was written (interrupted update)"
+    return None
+
+
+def stamp_manifest(rows: int):
+    """Records the current embeddings.npy in the manifest after an in-place rewrite (regenerate_embeddings.py)"""
+    manifest = load_manifest()
+    if manifest is not None:
+        save_manifest({**manifest, 'rows': int(rows), 'embeddings': embeddings_fingerprint()})
+
+
+def save_manifest(manifest: dict):
+    with open(MANIFEST_PATH + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(MANIFEST_PATH + ".tmp", MANIFEST_PATH)
+
+
+class NpyAppendWriter:
+    """
+    Writes a float32 .npy of unknown length one block of rows at a time, so
+    only the block being written is ever in memory. The header is reserved up
+    front and rewritten with the final row count on close(); the file is
+    built next to `path` and only replaces it once complete.
+    """
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.dim = dim
+        self.rows = 0
+        self._file = open(self.tmp_path, 'wb')
+        # Widest row count the header will ever hold, so its length never changes
+        self._write_header(10 ** 12)
+        self._data_offset = self._file.tell()
+
+    def _write_header(self, rows: int):
+        self._file.seek(0)
+        np.lib.format.write_array_header_1_0(self._file, {
+            'descr': np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+            'fortran_order': False,
+            'shape': (rows, self.dim),
+        })
+
+    def append(self, block: np.ndarray):
+        block = np.ascontiguousarray(block, dtype=np.float32)
+        if block.ndim != 2 or block.shape[1] != self.dim:
+            raise ValueError(f"Expected rows of {self.dim} dims, got {block.shape}")
+        self._file.write(block.tobytes())
+        self.rows += len(block)
+
+    def close(self):
+        self._write_header(self.rows)
+        if self._file.tell() != self._data_offset:
+            raise RuntimeError("npy header size changed while finalizing")
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self.tmp_path)
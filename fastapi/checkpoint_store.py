@@ -0,0 +1,125 @@
+"""
+Crash-safe checkpoint store for embedding regeneration (regenerate_embeddings.py).
+
+    embeddings.partial.npy   preallocated float32 .npy, opened as a memmap;
+                             every batch is written in place
+    embeddings.partial.log   append-only log: a header line, then one JSON line
+                             per flushed batch with its rows and embedding hashes
+
+A flush only touches the pages of the new rows and appends one log line, so it
+costs O(batch) no matter how far the run is. Rows are written before their log
+line, so a crash can at worst redo the last batch. Resume cuts a torn last
+line off the log, reopens the memmap (zero-copy) and replays the log.
+"""
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+
+def checkpoint_fingerprint(shape: Tuple[int, int], model_name: str, rows, hashes: List[str]) -> str:
+    """Identifies one regeneration job: a checkpoint is only resumed by the same job"""
+    digest = hashlib.sha1(f"{model_name}|{shape}".encode('utf-8'))
+    for row in rows:
+        digest.update(f"|{int(row)}:{hashes[row]}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def read_log_lines(path: str) -> List[str]:
+    """
+    Complete lines of an append-only JSON-lines log. A crash can leave a torn
+    last line: it is cut off the file here, so the next append starts on a
+    fresh line instead of being glued to the fragment (and lost on replay).
+    """
+    with open(path, 'r+b') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            f.truncate(end)
+    return data[:end].decode('utf-8', errors='replace').splitlines()
+
+
+class EmbeddingCheckpoint:
+    def __init__(self, data_path: str, log_path: str, matrix: np.memmap, done: Dict[int, str]):
+        self.data_path = data_path
+        self.log_path = log_path
+        self.matrix = matrix
+        self.done = done  # row -> embedding hash of every row already flushed
+        self._log = open(log_path, 'a', encoding='utf-8')
+
+    @classmethod
+    def create(cls, data_path: str, log_path: str, shape: Tuple[int, int], fingerprint: str,
+               initial_path: Optional[str] = None) -> 'EmbeddingCheckpoint':
+        """
+        Starts a new checkpoint. With initial_path (an .npy of the same shape) the
+        unchanged rows are carried over with a file copy, otherwise the array starts at zero.
+        """
+        if initial_path:
+            shutil.copyfile(initial_path, data_path)
+            matrix = np.load(data_path, mmap_mode='r+')
+            if matrix.shape != tuple(shape) or matrix.dtype != np.float32:
+                raise ValueError(f"Initial embeddings {matrix.shape} do not match {tuple(shape)}")
+        else:
+            matrix = np.lib.format.open_memmap(data_path, mode='w+', dtype=np.float32, shape=tuple(shape))
+
+        with open(log_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'fingerprint': fingerprint, 'shape': list(shape)}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        return cls(data_path, log_path, matrix, {})
+
+    @classmethod
+    def resume(cls, data_path: str, log_path: str, fingerprint: str) -> Optional['EmbeddingCheckpoint']:
+        """Reopens a checkpoint left by the same job, or None if there is none / it belongs to another job"""
+        if not (os.path.exists(data_path) and os.path.exists(log_path)):
+            return None
+
+        lines = read_log_lines(log_path)
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            return None
+        if header.get('fingerprint') != fingerprint:
+            return None
+
+        done = {}
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # unreadable entry: that batch is simply redone
+            done.update(zip(entry['rows'], entry['hashes']))
+
+        matrix = np.load(data_path, mmap_mode='r+')
+        return cls(data_path, log_path, matrix, done)
+
+    def write(self, rows, vectors: np.ndarray, hashes: List[str]):
+        """Writes one batch in place and makes it durable (data first, then its log line)"""
+        rows = [int(r) for r in rows]
+        self.matrix[rows] = vectors
+        self.matrix.flush()
+
+        self._log.write(json.dumps({'rows': rows, 'hashes': hashes}) + '\n')
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+        self.done.update(zip(rows, hashes))
+
+    def finalize(self, dest_path: str):
+        """Atomically moves the finished array to dest_path and drops the log"""
+        self.matrix.flush()
+        del self.matrix
+        self._log.close()
+        os.replace(self.data_path, dest_path)
+        os.remove(self.log_path)
+
+    def discard(self):
+        """Closes and deletes an unfinished checkpoint"""
+        del self.matrix
+        self._log.close()
+        for path in (self.data_path, self.log_path):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,114 @@
+"""
+⏱️ Benchmark: local vector search, full precision vs coarse tiers + re-scoring
+
+Coarse tiers: the int8 copy (build_quantized.py) and reduced PCA / truncated
+rows (build_reduced.py), each followed by full-precision re-scoring.
+
+For every configuration reports the resident size of the scanned matrix,
+the latency per query and recall@k against the exact float32 top-k.
+Queries are "taste vectors" (weighted mean of rated movies), like
+main.calculate_user_vector produces.
+
+Usage:
+    python debug/benchmark_search.py                      # synthetic 30000 x 1024 catalogue
+    python debug/benchmark_search.py --cache              # cache/embeddings.npy
+    python debug/benchmark_search.py --k 50 --queries 200
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from cache_store import load_embeddings
+from vector_index import build_index
+from build_quantized import inverse_norms
+from vector_index import quantize_embeddings
+from build_reduced import fit_pca_projection, reduce_embeddings, truncation_projection
+
+
+def synthetic_catalogue(n: int, dim: int, clusters: int = 200, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors with a shared offset (sentence embeddings are not centred)"""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim), dtype=np.float32)
+    offset = rng.standard_normal(dim, dtype=np.float32) * 2
+    rows = centres[rng.integers(clusters, size=n)] + offset + rng.standard_normal((n, dim), dtype=np.float32) * 0.8
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def taste_queries(embeddings: np.ndarray, count: int, ratings: int = 30, seed: int = 1):
+    """(query vector, rated rows) pairs: rating-weighted mean of a user's rated movies"""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(count):
+        anchor = embeddings[rng.integers(len(embeddings))]
+        # Users rate movies close to their taste: pick from the anchor's neighbourhood
+        pool = np.argpartition(-(embeddings @ anchor), 500)[:500]
+        rated = rng.choice(pool, size=ratings, replace=False)
+        weights = rng.integers(1, 6, size=ratings).astype(np.float32)
+        queries.append(((weights @ embeddings[rated]) / weights.sum(), rated))
+    return queries
+
+
+def run(index, queries, k):
+    results, start = [], time.perf_counter()
+    for query, rated in queries:
+        results.append([r['id'] for r in index.search(query, -1.0, k, rated.tolist())])
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def recall(results, truth):
+    return np.mean([len(set(r) & set(t)) / len(t) for r, t in zip(results, truth)])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cache", action="store_true", help="use cache/embeddings.npy")
+    parser.add_argument("--rows", type=int, default=30000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=50)
+    args = parser.parse_args()
+
+    embeddings = np.asarray(load_embeddings()) if args.cache else synthetic_catalogue(args.rows, args.dim)
+    ids = np.arange(len(embeddings))
+    queries = taste_queries(embeddings, args.queries)
+    print(f"⏱️  {embeddings.shape[0]} x {embeddings.shape[1]}, {len(queries)} queries, recall@{args.k}\n")
+
+    exact = build_index(ids, embeddings, kind="exact")
+    truth, _ = run(exact, queries, args.k)
+
+    configs = [("exact float32", "exact", None, None)]
+    for rescore in (100, 300, 1000):
+        configs.append((f"exact int8 r={rescore}", "exact", "int8", rescore))
+    configs += [("ivf float32", "ivf", None, None), ("ivf int8 r=300", "ivf", "int8", 300)]
+
+    quantized = quantize_embeddings(embeddings, inverse_norms(embeddings))
+
+    # Reduced tiers: coarse top-500 on R dims, final ranking on the full vectors
+    tiers = {}
+    for dims in (128, 256):
+        projection, mean, explained = fit_pca_projection(embeddings, dims)
+        tiers[f"pca{dims}"] = (reduce_embeddings(embeddings, projection, mean), projection)
+        print(f"   PCA {dims}: {explained * 100:.1f}% variance explained")
+    projection, mean = truncation_projection(embeddings.shape[1], 256)
+    tiers["trunc256"] = (reduce_embeddings(embeddings, projection, mean), projection)
+    print()
+    for name in tiers:
+        configs.append((f"exact {name} r=500", "exact", name, 500))
+    configs.append(("ivf pca256 r=500", "ivf", "pca256", 500))
+
+    print(f"{'config':<24}{'scan matrix':>12}{'ms/query':>10}{'recall':>9}")
+    for label, kind, coarse, rescore in configs:
+        kwargs = {'reduced': tiers[coarse]} if coarse in tiers else {'quantized': quantized} if coarse else {}
+        if rescore:
+            kwargs['rescore'] = rescore
+        index = build_index(ids, embeddings, kind=kind, **kwargs)
+        results, latency = run(index, queries, args.k)
+        scanned = next(m for m in (index.reduced, index.compact, index.embeddings) if m is not None)
+        print(f"{label:<24}{scanned.nbytes / 2**20:>10.0f}MB{latency:>10.2f}{recall(results, truth):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+⏱️ Micro-benchmark: user vector construction (calculate_user_vector)
+
+Compares the old per-rating loop (next() lookup + json.loads per embedding)
+with the batched path in user_vectors.py, on synthetic payloads shaped like
+the Supabase responses (embeddings as pgvector text).
+
+Usage:
+    python debug/benchmark_user_vector.py
+"""
+import os
+import sys
+import json
+import time
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from user_vectors import weighted_mean_vector
+
+DIM = 1024
+RATING_COUNTS = [50, 500, 5000]
+
+
+def legacy_user_vector(ratings, movies):
+    """Previous implementation from main.calculate_user_vector"""
+    user_vector = np.zeros(DIM)
+    total_weight = 0
+
+    for movie_data in ratings:
+        movie = next((m for m in movies if m['id'] == movie_data['movie_id']), None)
+        if movie and movie.get('embedding'):
+            weight = movie_data['rating']
+            embedding = json.loads(movie['embedding']) if isinstance(movie['embedding'], str) else movie['embedding']
+            user_vector += np.array(embedding) * weight
+            total_weight += weight
+
+    if total_weight > 0:
+        return user_vector / total_weight
+    return None
+
+
+def make_payload(n_ratings: int, rng):
+    """Builds user_movies + movies rows as returned by supabase-py"""
+    ids = rng.choice(10 * n_ratings, size=n_ratings, replace=False) + 1
+    ratings = [{'movie_id': int(i), 'rating': int(rng.integers(1, 21))} for i in ids]
+
+    vectors = rng.standard_normal((n_ratings, DIM)).astype(np.float32)
+    movies = [
+        {'id': int(i), 'embedding': '[' + ','.join(f"{x:.6f}" for x in v) + ']'}
+        for i, v in zip(ids, vectors)
+    ]
+    rng.shuffle(movies)
+    return ratings, movies
+
+
+def time_call(fn, *args, repeats=3):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    rng = np.random.default_rng(42)
+
+    print("=" * 60)
+    print("⏱️  USER VECTOR BENCHMARK (best of 3)")
+    print("=" * 60)
+    print(f"{'ratings':>8} | {'legacy':>10} | {'batched':>10} | {'speedup':>8} | max |Δ|")
+
+    for n in RATING_COUNTS:
+        ratings, movies = make_payload(n, rng)
+
+        legacy_time, legacy_vec = time_call(legacy_user_vector, ratings, movies)
+        batched_time, batched_vec = time_call(weighted_mean_vector, ratings, movies)
+
+        max_diff = float(np.max(np.abs(legacy_vec - batched_vec)))
+        print(f"{n:>8} | {legacy_time * 1000:>8.1f}ms | {batched_time * 1000:>8.1f}ms | "
+              f"{legacy_time / batched_time:>7.1f}x | {max_diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,6 @@ Usage:
 """
 import os
 import sys
-import pickle
 import numpy as np
 import pandas as pd
 from typing import List, Tuple
@@ -22,13 +21,15 @@ from dotenv import load_dotenv
 from supabase import create_client, Client
 import json
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from cache_store import load_movies_cache, movies_cache_exists
+
 # ==============================================================================
 # CONFIG & PATHS
 # ==============================================================================
 load_dotenv()
 
 CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "cache")  # Fixed path relative to debug/
-MOVIES_CACHE_PATH = os.path.join(CACHE_DIR, "movies.pkl")
 EMBEDDINGS_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.npy")
 PROGRESS_PATH = os.path.join(CACHE_DIR, "progress.txt")
 
@@ -52,7 +53,7 @@ def load_data(verbose=True):
     if verbose:
         print("📥 Loading cache...")
     
-    if not os.path.exists(MOVIES_CACHE_PATH):
+    if not movies_cache_exists():
         print("❌ Movie cache not found! Run: python regenerate_embeddings.py")
         return None, None
     
@@ -60,7 +61,7 @@ def load_data(verbose=True):
         print("❌ Embeddings cache not found!")
         return None, None
         
-    df = pickle.load(open(MOVIES_CACHE_PATH, 'rb'))
+    df = load_movies_cache()
     embeddings = np.load(EMBEDDINGS_CACHE_PATH)
     
     if verbose:
@@ -0,0 +1,123 @@
+"""
+🧪 Fake TMDB server for testing tmdb_client.py locally (no API key, no quota)
+
+Serves the endpoints used by the ingestion scripts with canned data:
+    /3/genre/movie/list, /3/discover/movie, /3/movie/{id}, /3/search/movie
+It enforces its own sliding-window limit (40 req/10s) and answers 429 with
+Retry-After when exceeded, so a run shows whether the client stays under the limit.
+
+Usage:
+    python debug/fake_tmdb_server.py              # self-test: runs TMDBClient against it
+    python debug/fake_tmdb_server.py --serve      # just serve on :8765
+    TMDB_BASE_URL=http://127.0.0.1:8765/3 python populate_tmdb.py
+"""
+import os
+import sys
+import json
+import time
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+PORT = 8765
+LATENCY = 0.05       # simulated server latency per request (s)
+LIMIT_CALLS = 40
+LIMIT_PERIOD = 10.0
+
+
+class FakeTMDBHandler(BaseHTTPRequestHandler):
+    calls = deque()
+    lock = threading.Lock()
+    stats = {'ok': 0, 'rate_limited': 0}
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _over_limit(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            while self.calls and self.calls[0] < now - LIMIT_PERIOD:
+                self.calls.popleft()
+            if len(self.calls) >= LIMIT_CALLS:
+                self.stats['rate_limited'] += 1
+                return True
+            self.calls.append(now)
+            self.stats['ok'] += 1
+            return False
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        time.sleep(LATENCY)
+
+        if self._over_limit():
+            return self._send(429, {"status_message": "Rate limit exceeded"}, {"Retry-After": "1"})
+
+        parts = url.path.strip('/').split('/')
+        if url.path == "/3/genre/movie/list":
+            return self._send(200, {"genres": [{"id": 18, "name": "Drama"}, {"id": 878, "name": "Science Fiction"}]})
+        if url.path == "/3/discover/movie":
+            page = int(query.get("page", ["1"])[0])
+            return self._send(200, {"page": page, "results": [
+                {"id": page * 100 + i, "title": f"Movie {page}-{i}", "overview": "A film.",
+                 "genre_ids": [18], "original_language": "en", "vote_average": 7.0,
+                 "vote_count": 500, "poster_path": None}
+                for i in range(20)
+            ]})
+        if url.path == "/3/search/movie":
+            title = query.get("query", [""])[0]
+            return self._send(200, {"results": [{"id": abs(hash(title)) % 100000}]})
+        if len(parts) == 3 and parts[1] == "movie" and parts[2].isdigit():
+            return self._send(200, {
+                "id": int(parts[2]), "title": f"Movie {parts[2]}", "runtime": 120,
+                "original_language": "en", "genres": [{"name": "Drama"}],
+                "keywords": {"keywords": [{"name": "friendship"}]},
+                "credits": {"crew": [{"job": "Director", "department": "Directing", "name": "Jane Doe"}],
+                            "cast": [{"name": "John Roe"}]},
+            })
+        return self._send(404, {"status_message": "Not found"})
+
+
+def start_server(port: int = PORT) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeTMDBHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def self_test(n_requests: int = 60):
+    from tmdb_client import TMDBClient
+
+    server = start_server()
+    client = TMDBClient("fake-key", base_url=f"http://127.0.0.1:{PORT}/3", max_workers=8)
+
+    print(f"🧪 {n_requests} /movie/{{id}} calls, {client.max_workers} workers, limit {LIMIT_CALLS}/{LIMIT_PERIOD:.0f}s")
+    start = time.time()
+    results = list(client.map(lambda movie_id: client.get(f"/movie/{movie_id}"), range(1, n_requests + 1)))
+    elapsed = time.time() - start
+
+    print(f"   ✅ {len(results)} responses in {elapsed:.1f}s ({len(results) / elapsed:.1f} req/s)")
+    print(f"   Server: {FakeTMDBHandler.stats['ok']} ok, {FakeTMDBHandler.stats['rate_limited']} rate-limited (429)")
+    print(f"   Client limiter: {client.limiter.get_stats()}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    if "--serve" in sys.argv:
+        print(f"🎬 Fake TMDB on http://127.0.0.1:{PORT}/3 (Ctrl+C to stop)")
+        server = ThreadingHTTPServer(("127.0.0.1", PORT), FakeTMDBHandler)
+        server.serve_forever()
+    else:
+        self_test()
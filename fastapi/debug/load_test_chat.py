@@ -0,0 +1,244 @@
+"""
+🔥 Load test for /api/chat: sustained concurrent chats while /health is probed
+
+Starts fake upstreams (PostgREST + Groq, see FakeUpstreamHandler) with a slow
+LLM, serves main.app with uvicorn pointed at them and keeps `--concurrency`
+chat requests in flight for `--duration` seconds. Meanwhile /health is called
+every 100 ms. With blocking handlers every chat pins a threadpool thread for
+the whole LLM round trip, and once the pool (40 threads) is full /health queues
+behind them. With the async path its latency stays flat.
+
+With --stream the chats go to /api/chat/stream (SSE) and the client also
+measures time to first token; the fake LLM then spreads its reply over
+`--llm-latency` seconds in STREAM_CHUNKS chunks.
+
+Usage:
+    python debug/load_test_chat.py                              # 100 concurrent chats, 2s LLM latency
+    python debug/load_test_chat.py --concurrency 200 --llm-latency 5
+    python debug/load_test_chat.py --stream                     # streaming endpoint + TTFT
+    python debug/load_test_chat.py --url http://127.0.0.1:8000 --user-id <uuid>   # a running server
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import httpx
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+UPSTREAM_PORT = 8766
+API_PORT = 8767
+N_RATINGS = 40
+STREAM_CHUNKS = 20
+REPLY = "Since you liked Movie 1, try Movie 99."
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    """PostgREST (/rest/v1/user_movies, /rest/v1/movies) and Groq (/openai/v1/chat/completions)"""
+    llm_latency = 2.0
+    lock = threading.Lock()
+    stats = {'postgrest': 0, 'groq': 0, 'groq_in_flight': 0, 'groq_max_in_flight': 0}
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        with self.lock:
+            self.stats['postgrest'] += 1
+        time.sleep(0.01)
+
+        if url.path == "/rest/v1/user_movies":
+            return self._send(200, [{"movie_id": i, "rating": 10 + i % 11} for i in range(1, N_RATINGS + 1)])
+        if url.path == "/rest/v1/movies":
+            ids = query.get("id", ["in.()"])[0][4:-1].split(',')
+            return self._send(200, [
+                {"id": int(i), "series_title": f"Movie {i}", "genre": "Drama", "released_year": 2000}
+                for i in ids if i
+            ])
+        return self._send(404, {"message": "Not found"})
+
+    def _stream(self):
+        """OpenAI-style SSE: the reply split in STREAM_CHUNKS deltas over llm_latency seconds"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        words = (REPLY + " ") * (STREAM_CHUNKS // len(REPLY.split()) + 1)
+        for word in words.split()[:STREAM_CHUNKS]:
+            time.sleep(self.llm_latency / STREAM_CHUNKS)
+            event = {"choices": [{"delta": {"content": word + " "}}]}
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if urlparse(self.path).path != "/openai/v1/chat/completions":
+            return self._send(404, {"message": "Not found"})
+
+        with self.lock:
+            self.stats['groq'] += 1
+            self.stats['groq_in_flight'] += 1
+            self.stats['groq_max_in_flight'] = max(self.stats['groq_max_in_flight'], self.stats['groq_in_flight'])
+        try:
+            if body.get("stream"):
+                return self._stream()
+            time.sleep(self.llm_latency)
+            return self._send(200, {"choices": [{"message": {"content": REPLY}}]})
+        finally:
+            with self.lock:
+                self.stats['groq_in_flight'] -= 1
+
+
+def start_fake_upstreams(llm_latency: float) -> ThreadingHTTPServer:
+    FakeUpstreamHandler.llm_latency = llm_latency
+    server = ThreadingHTTPServer(("127.0.0.1", UPSTREAM_PORT), FakeUpstreamHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_api():
+    """Imports main against the fake upstreams and serves it on API_PORT"""
+    import uvicorn
+
+    upstream = f"http://127.0.0.1:{UPSTREAM_PORT}"
+    os.environ.update({
+        "SUPABASE_URL": upstream,
+        "SUPABASE_SERVICE_KEY": "fake-key",
+        "GROQ_API_KEY": "fake-key",
+        "GROQ_BASE_URL": f"{upstream}/openai/v1",
+        "VECTOR_SEARCH": "pgvector",
+        "USER_VECTOR_STORE": "0",
+    })
+    from main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=API_PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def percentiles(values):
+    if not values:
+        return "n/a"
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+    return f"p50 {p50:.0f} ms, p95 {p95:.0f} ms, p99 {p99:.0f} ms, max {max(values) * 1000:.0f} ms"
+
+
+async def stream_chat(client: httpx.AsyncClient, user_id: str):
+    """One /api/chat/stream call: (time to first token, total time)"""
+    start = time.monotonic()
+    ttft = None
+    async with client.stream("POST", "/api/chat/stream", json={"user_id": user_id, "message": "Recommend me something"}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            event = json.loads(line[5:])
+            if "error" in event:
+                raise RuntimeError(event["error"])
+            if "token" in event and ttft is None:
+                ttft = time.monotonic() - start
+    return ttft, time.monotonic() - start
+
+
+async def run_load(url: str, user_id: str, concurrency: int, duration: float, stream: bool = False):
+    chat_latencies, ttfts, health_latencies, errors = [], [], [], []
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency + 10, max_keepalive_connections=concurrency + 10)
+
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as client:
+        async def chatter():
+            while time.monotonic() < deadline:
+                start = time.monotonic()
+                try:
+                    if stream:
+                        ttft, total = await stream_chat(client, user_id)
+                        ttfts.append(ttft)
+                        chat_latencies.append(total)
+                        continue
+                    response = await client.post("/api/chat", json={"user_id": user_id, "message": "Recommend me something"})
+                    response.raise_for_status()
+                    chat_latencies.append(time.monotonic() - start)
+                except Exception as e:
+                    errors.append(repr(e))
+
+        async def prober():
+            last = {}
+            while time.monotonic() < deadline:
+                start = time.monotonic()
+                try:
+                    response = await client.get("/health", timeout=30)
+                    health_latencies.append(time.monotonic() - start)
+                    last = response.json().get("upstreams", last)
+                except Exception as e:
+                    errors.append(f"/health: {e!r}")
+                await asyncio.sleep(0.1)
+            return last
+
+        results = await asyncio.gather(prober(), *(chatter() for _ in range(concurrency)))
+        server_metrics = (await client.get("/metrics")).json()
+
+    return chat_latencies, ttfts, health_latencies, errors, results[0], server_metrics
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="running API to test (default: start main.app against fake upstreams)")
+    parser.add_argument("--user-id", default="load-test-user")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--llm-latency", type=float, default=2.0, help="fake Groq latency (s)")
+    parser.add_argument("--stream", action="store_true", help="use /api/chat/stream and measure time to first token")
+    args = parser.parse_args()
+
+    url = args.url
+    if not url:
+        start_fake_upstreams(args.llm_latency)
+        start_api()
+        url = f"http://127.0.0.1:{API_PORT}"
+        print(f"🧪 Fake upstreams on :{UPSTREAM_PORT} (LLM latency {args.llm_latency}s), API on :{API_PORT}")
+
+    endpoint = "/api/chat/stream" if args.stream else "/api/chat"
+    print(f"🔥 {args.concurrency} concurrent {endpoint} for {args.duration:.0f}s against {url}")
+    start = time.time()
+    chats, ttfts, health, errors, upstreams, server_metrics = asyncio.run(
+        run_load(url, args.user_id, args.concurrency, args.duration, args.stream)
+    )
+    elapsed = time.time() - start
+
+    print(f"\n💬 {endpoint}: {len(chats)} completed ({len(chats) / elapsed:.1f} req/s), {percentiles(chats)}")
+    if args.stream:
+        print(f"⏱️  Time to first token: {percentiles(ttfts)}")
+    print(f"❤️  /health:   {len(health)} probes, {percentiles(health)}")
+    if upstreams:
+        print(f"🔌 Upstreams (last probe): {upstreams}")
+    print(f"📈 /metrics latencies: {server_metrics.get('latencies')}")
+    if not args.url:
+        print(f"🤖 Fake Groq: {FakeUpstreamHandler.stats['groq']} calls, "
+              f"max {FakeUpstreamHandler.stats['groq_max_in_flight']} in flight")
+    if errors:
+        print(f"❌ {len(errors)} errors, first: {errors[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+📏 Per-worker memory of the local vector index: private copy vs memory-mapped matrix
+
+Starts N worker processes the way `uvicorn --workers N` does (fresh interpreters),
+each one loads the embedding matrix, builds the serving index and answers a few
+searches. Every worker reports from /proc/self/smaps_rollup:
+    RSS   resident pages (shared file pages are counted in every worker)
+    PSS   proportional share: shared pages divided by the workers mapping them
+    USS   private pages, i.e. what the worker really adds to the host
+
+Usage:
+    python debug/measure_worker_memory.py                 # synthetic 30000 x 1024 matrix
+    python debug/measure_worker_memory.py --cache         # cache/embeddings.npy
+    python debug/measure_worker_memory.py --workers 8 --index ivf
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing as mp
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from cache_store import EMBEDDINGS_CACHE_PATH
+from vector_index import build_index
+
+
+def memory_kb():
+    """RSS / PSS / USS of the current process in kB (Linux only)"""
+    values = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    uss = values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)
+    return values.get('Rss', 0), values.get('Pss', 0), uss
+
+
+def worker(path, mmap_mode, kind, ready, done, results):
+    embeddings = np.load(path, mmap_mode=mmap_mode)
+    index = build_index(np.arange(len(embeddings)), embeddings, kind=kind)
+    rng = np.random.default_rng(os.getpid())
+    for _ in range(20):
+        index.search(rng.standard_normal(index.dim).astype(np.float32), match_threshold=-1.0)
+
+    ready.wait()  # every worker holds its mapping while the others measure
+    results.put(memory_kb())
+    done.wait()
+
+
+def measure(path, mmap_mode, kind, workers):
+    ctx = mp.get_context('spawn')
+    ready, done = ctx.Barrier(workers), ctx.Event()
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(path, mmap_mode, kind, ready, done, results)) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    samples = [results.get() for _ in procs]
+    done.set()
+    for p in procs:
+        p.join()
+    return np.array(samples) / 1024  # MB
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rows", type=int, default=30000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--index", default="exact", choices=["exact", "ivf"])
+    parser.add_argument("--cache", action="store_true", help="use cache/embeddings.npy")
+    args = parser.parse_args()
+
+    if args.cache:
+        path = EMBEDDINGS_CACHE_PATH
+    else:
+        path = os.path.join(tempfile.mkdtemp(), "embeddings.npy")
+        rng = np.random.default_rng(0)
+        np.save(path, rng.standard_normal((args.rows, args.dim), dtype=np.float32))
+
+    matrix_mb = os.path.getsize(path) / (1024 * 1024)
+    print(f"📏 {path}: {matrix_mb:.0f} MB, {args.workers} workers, {args.index} index\n")
+    print(f"{'mode':<14}{'RSS/worker':>12}{'PSS/worker':>12}{'USS/worker':>12}{'host total (ΣPSS)':>20}")
+
+    for label, mmap_mode in (("np.load", None), ("mmap_mode='r'", 'r')):
+        start = time.time()
+        mb = measure(path, mmap_mode, args.index, args.workers)
+        rss, pss, uss = mb.mean(axis=0)
+        print(f"{label:<14}{rss:>10.0f}MB{pss:>10.0f}MB{uss:>10.0f}MB{mb[:, 1].sum():>18.0f}MB"
+              f"   ({time.time() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
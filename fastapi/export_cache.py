@@ -4,16 +4,44 @@
 EXECUTAR ESTE SCRIPT UMA VEZ quando o Supabase recuperar o Disk IO Budget.
 Depois disso, o main.py vai usar os ficheiros locais em vez de fazer queries.
 
+O export é feito em streaming: cada página é descodificada e escrita logo em
+cache/embeddings.npy, e os metadados da página num ficheiro de spill, e depois
+libertada. No fim os spills são juntados em cache/movies.parquet uma página de
+cada vez, por isso a memória fica perto de uma página, seja qual for o tamanho
+do catálogo. Sem pyarrow os metadados vão para movies.pkl, que precisa do
+DataFrame inteiro em memória nesse último passo.
+
+As páginas são lidas por keyset (cursor no id, sem OFFSET) e o intervalo de ids
+é dividido entre vários workers que buscam em paralelo.
+
+Cada export grava cache/manifest.json com o maior id (e o maior valor de
+--since-column, se indicado). Com --delta só os filmes novos/alterados desde
+esse ponto são buscados e aplicados numa cópia do cache, que depois substitui
+o embeddings.npy de uma vez (os workers que o têm em mmap não são afetados).
+
 Uso:
-    python export_cache.py
+    python export_cache.py                          # todas as colunas, 4 workers
+    python export_cache.py --columns serving        # só o que o servidor usa
+    python export_cache.py --columns id,series_title,embedding --workers 8
+    python export_cache.py --delta                  # só filmes com id novo
+    python export_cache.py --delta --since-column updated_at   # + filmes alterados
 """
 import os
-import json
-import pickle
+import time
+import argparse
+import datetime
+import threading
 import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from supabase import create_client, Client
+from cache_store import (
+    CACHE_DIR, EMBEDDINGS_CACHE_PATH, HAS_PYARROW, NpyAppendWriter,
+    cache_consistency_error, cache_exists, embeddings_fingerprint, load_manifest, load_movies_cache, save_manifest, save_movies_cache,
+    save_movies_cache_from_spills, spill_movies_page
+)
+from user_vectors import decode_embeddings
 
 # Carregar variáveis de ambiente
 load_dotenv()
@@ -32,16 +60,182 @@ if not supabase_url or not supabase_key:
 
 supabase: Client = create_client(supabase_url, supabase_key)
 
-# Diretório para o cache
-CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache")
 os.makedirs(CACHE_DIR, exist_ok=True)
 
-# Caminhos dos ficheiros de cache
-MOVIES_CACHE_PATH = os.path.join(CACHE_DIR, "movies.pkl")
-EMBEDDINGS_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.npy")
+PAGE_SIZE = 1000
+DEFAULT_WORKERS = 4
+MERGE_CHUNK_ROWS = 4096
+
+# Colunas lidas pelo main.py / recommendation_system.py / rag_service.py
+SERVING_COLUMNS = [
+    'id', 'series_title', 'genre', 'released_year', 'imdb_rating', 'overview',
+    'origin_country', 'original_language', 'embedding',
+]
+
+
+class ExportStats:
+    """Contadores partilhados pelos workers (páginas, filmes, bytes, tempo de fetch)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pages = 0
+        self.rows = 0
+        self.embedding_bytes = 0
+        self.fetch_time = 0.0
+        self.start = time.time()
+
+    def record(self, rows: int, embedding_bytes: int, fetch_time: float):
+        with self.lock:
+            self.pages += 1
+            self.rows += rows
+            self.embedding_bytes += embedding_bytes
+            self.fetch_time += fetch_time
+            return self.rows
+
+    def summary(self):
+        elapsed = time.time() - self.start
+        mb = self.embedding_bytes / (1024 * 1024)
+        print(f"\n⏱️  Throughput:")
+        print(f"   {self.pages} páginas, {self.rows} filmes em {elapsed:.1f}s")
+        print(f"   {self.rows / elapsed:.0f} filmes/s | {mb / elapsed:.1f} MB/s de embeddings")
+        if self.pages:
+            print(f"   Latência média por página: {self.fetch_time / self.pages * 1000:.0f} ms")
+
+
+def resolve_columns(spec: str, since_column: str = None) -> str:
+    """
+    '*', 'serving' ou lista separada por vírgulas.
+    id, embedding (e a since_column do delta) são sempre incluídos.
+    """
+    if spec == '*':
+        return '*'
+    columns = SERVING_COLUMNS if spec == 'serving' else [c.strip() for c in spec.split(',') if c.strip()]
+    if 'id' not in columns:
+        columns = ['id'] + columns
+    if since_column and since_column not in columns:
+        columns = columns + [since_column]
+    if 'embedding' not in columns:
+        columns = columns + ['embedding']
+    return ','.join(columns)
+
+
+def build_manifest(df: pd.DataFrame, dim: int, columns: str, since_column: str = None, previous: dict = None) -> dict:
+    """High-water mark do cache: maior id e maior valor da since_column já exportados"""
+    since_value = None
+    if since_column and since_column in df.columns and df[since_column].notna().any():
+        since_value = str(df[since_column].dropna().astype(str).max())
+    if previous and previous.get('since_value') and since_column == previous.get('since_column'):
+        since_value = max(filter(None, [since_value, previous['since_value']]))
+    return {
+        'max_id': int(df['id'].max()),
+        'since_column': since_column,
+        'since_value': since_value,
+        'columns': columns,
+        'rows': int(len(df)),
+        'dim': int(dim),
+        'embeddings': embeddings_fingerprint(),
+        'exported_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
 
 
-def export_movies_to_cache():
+def fetch_id_bounds():
+    """Menor e maior id da tabela movies, ou None se estiver vazia"""
+    first = supabase.table("movies").select("id").order("id").limit(1).execute().data
+    if not first:
+        return None
+    last = supabase.table("movies").select("id").order("id", desc=True).limit(1).execute().data
+    return first[0]['id'], last[0]['id']
+
+
+def split_id_ranges(min_id: int, max_id: int, parts: int):
+    """Divide [min_id, max_id] em intervalos [lo, hi) contíguos"""
+    parts = max(1, min(parts, max_id - min_id + 1))
+    bounds = np.linspace(min_id, max_id + 1, parts + 1).astype(np.int64)
+    return [(int(lo), int(hi)) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+
+def iter_keyset_pages(columns: str, page_size: int, start_id: int, end_id: int = None, filters=None):
+    """
+    Keyset pagination: id >= cursor [AND id < end_id] ORDER BY id LIMIT page_size.
+    filters(query) pode acrescentar condições. Gera (rows, embeddings float32, tempo do fetch).
+    """
+    cursor = start_id
+    while end_id is None or cursor < end_id:
+        fetch_start = time.time()
+        query = supabase.table("movies").select(columns).gte("id", cursor)
+        if end_id is not None:
+            query = query.lt("id", end_id)
+        if filters is not None:
+            query = filters(query)
+        rows = query.order("id").limit(page_size).execute().data
+        if not rows:
+            return
+        
+        page_embeddings = decode_embeddings([row.pop('embedding') for row in rows])
+        yield rows, page_embeddings, time.time() - fetch_start
+        
+        cursor = rows[-1]['id'] + 1
+        if len(rows) < page_size:
+            return
+
+
+def export_partition(part: int, id_range, columns: str, page_size: int, stats: ExportStats):
+    """
+    Lê um intervalo de ids [lo, hi) por keyset pagination.
+    Os embeddings vão para um .npy próprio da partição e os metadados de cada
+    página para um ficheiro de spill; retorna (caminhos dos spills, caminho do .npy).
+    """
+    lo, hi = id_range
+    part_path = os.path.join(CACHE_DIR, f"embeddings.part{part}.npy")
+    writer = None
+    spill_paths = []
+    
+    try:
+        for rows, page_embeddings, fetch_time in iter_keyset_pages(columns, page_size, lo, hi):
+            if writer is None:
+                writer = NpyAppendWriter(part_path, page_embeddings.shape[1])
+            writer.append(page_embeddings)
+            spill_paths.append(spill_movies_page(
+                rows, os.path.join(CACHE_DIR, f"movies.part{part}.{len(spill_paths)}")
+            ))
+            
+            total = stats.record(len(rows), page_embeddings.nbytes, fetch_time)
+            print(f"   📄 Worker {part}: +{len(rows)} filmes (total {total})")
+    except Exception:
+        if writer is not None:
+            writer.abort()
+        remove_partitions(spill_paths)
+        raise
+    
+    if writer is None:
+        return spill_paths, None
+    writer.close()
+    return spill_paths, part_path
+
+
+def merge_partitions(part_paths):
+    """Junta os .npy das partições (por ordem de id) em embeddings.npy, em blocos"""
+    writer = None
+    for path in part_paths:
+        part = np.load(path, mmap_mode='r')
+        if writer is None:
+            writer = NpyAppendWriter(EMBEDDINGS_CACHE_PATH, part.shape[1])
+        for start in range(0, len(part), MERGE_CHUNK_ROWS):
+            writer.append(part[start:start + MERGE_CHUNK_ROWS])
+        del part
+        os.remove(path)
+    writer.close()
+    return writer
+
+
+def remove_partitions(part_paths):
+    for path in part_paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def export_movies_to_cache(columns: str = '*', workers: int = DEFAULT_WORKERS, page_size: int = PAGE_SIZE,
+                           since_column: str = None):
     """
     Exporta todos os filmes do Supabase para ficheiros locais.
     Isto evita queries pesadas em cada inicialização do servidor.
@@ -51,78 +245,79 @@ def export_movies_to_cache():
     print("=" * 60)
     print()
     
-    print("📥 Buscando filmes do Supabase (com paginação)...")
+    print("📥 Buscando filmes do Supabase (keyset pagination)...")
     print("   ⚠️  Isto vai consumir Disk IO Budget, só executar quando necessário!")
+    print(f"   Colunas: {columns}")
     print()
     
-    all_movies = []
-    page_size = 1000
-    offset = 0
-    page_num = 1
-    
-    while True:
-        try:
-            response = supabase.table("movies").select("*").range(offset, offset + page_size - 1).execute()
-            
-            if not response.data:
-                break
-            
-            all_movies.extend(response.data)
-            print(f"   📄 Página {page_num}: {len(response.data)} filmes carregados")
-            
-            # Se retornou menos que page_size, chegamos ao fim
-            if len(response.data) < page_size:
-                break
-            
-            offset += page_size
-            page_num += 1
-            
-        except Exception as e:
-            print(f"❌ Erro ao buscar página {page_num}: {e}")
-            print("   O servidor pode ainda estar a recuperar. Tenta novamente mais tarde.")
-            return False
+    try:
+        bounds = fetch_id_bounds()
+    except Exception as e:
+        print(f"❌ Erro ao ler os ids: {e}")
+        print("   O servidor pode ainda estar a recuperar. Tenta novamente mais tarde.")
+        return False
     
-    if not all_movies:
+    if bounds is None:
         print("❌ Nenhum filme encontrado!")
         return False
     
-    print(f"\n✅ Total: {len(all_movies)} filmes carregados do Supabase")
-    
-    # Converter para DataFrame
-    df_movies = pd.DataFrame(all_movies)
+    id_ranges = split_id_ranges(bounds[0], bounds[1], workers)
+    print(f"   ids {bounds[0]}..{bounds[1]} em {len(id_ranges)} partições")
     
-    # Extrair embeddings
-    print("\n⚙️  Processando embeddings...")
-    embeddings_list = []
-    for emb in df_movies['embedding']:
-        if isinstance(emb, str):
-            emb = json.loads(emb)
-        embeddings_list.append(emb)
+    stats = ExportStats()
+    with ThreadPoolExecutor(max_workers=len(id_ranges)) as executor:
+        futures = [
+            executor.submit(export_partition, part, id_range, columns, page_size, stats)
+            for part, id_range in enumerate(id_ranges)
+        ]
+        results, error = [], None
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                error = error or e
     
-    embeddings = np.array(embeddings_list, dtype=np.float32)
-    print(f"   Shape: {embeddings.shape}")
+    if error is not None:
+        remove_partitions(path for spills, npy in results for path in spills + [npy])
+        print(f"❌ Erro ao buscar páginas: {error}")
+        print("   O servidor pode ainda estar a recuperar. Tenta novamente mais tarde.")
+        return False
     
-    # Remover coluna embedding do DataFrame (já está no .npy)
-    df_movies_no_emb = df_movies.drop(columns=['embedding'])
+    # Partições por ordem de id: metadados e embeddings ficam alinhados linha a linha
+    spill_paths = [path for spills, _ in results for path in spills]
+    part_paths = [path for _, path in results if path]
+    del results
     
-    # Salvar para ficheiros locais
-    print(f"\n💾 Salvando cache em: {CACHE_DIR}")
+    if not spill_paths:
+        print("❌ Nenhum filme encontrado!")
+        return False
     
-    # Salvar DataFrame (sem embeddings) como pickle
-    with open(MOVIES_CACHE_PATH, 'wb') as f:
-        pickle.dump(df_movies_no_emb, f)
-    print(f"   ✅ {MOVIES_CACHE_PATH}")
+    embeddings_writer = merge_partitions(part_paths)
+    print(f"\n✅ Total: {embeddings_writer.rows} filmes exportados do Supabase")
+    print(f"   Embeddings: ({embeddings_writer.rows}, {embeddings_writer.dim})")
+    stats.summary()
     
-    # Salvar embeddings como numpy array
-    np.save(EMBEDDINGS_CACHE_PATH, embeddings)
+    # Salvar metadados (formato colunar se o pyarrow existir), página a página
+    print(f"\n💾 Salvando cache em: {CACHE_DIR}")
+    movies_path = save_movies_cache_from_spills(spill_paths)
+    # O manifest só precisa do id (e da since_column): não carrega o resto dos metadados
+    manifest_columns = ['id'] + ([since_column] if since_column else [])
+    if HAS_PYARROW:
+        df_manifest = pd.read_parquet(movies_path, columns=manifest_columns)
+    else:
+        df_manifest = load_movies_cache()[manifest_columns]
+    save_manifest(build_manifest(df_manifest, embeddings_writer.dim, columns, since_column))
+    print(f"   ✅ {movies_path}")
     print(f"   ✅ {EMBEDDINGS_CACHE_PATH}")
+    if not HAS_PYARROW:
+        print("   💡 pip install pyarrow para guardar os metadados em Parquet")
     
     # Mostrar tamanhos
-    movies_size = os.path.getsize(MOVIES_CACHE_PATH) / (1024 * 1024)
+    movies_size = os.path.getsize(movies_path) / (1024 * 1024)
     emb_size = os.path.getsize(EMBEDDINGS_CACHE_PATH) / (1024 * 1024)
     
     print(f"\n📊 Tamanho dos ficheiros:")
-    print(f"   movies.pkl:     {movies_size:.2f} MB")
+    print(f"   {os.path.basename(movies_path) + ':':<16}{movies_size:.2f} MB")
     print(f"   embeddings.npy: {emb_size:.2f} MB")
     print(f"   Total:          {movies_size + emb_size:.2f} MB")
     
@@ -136,5 +331,154 @@ def export_movies_to_cache():
     return True
 
 
+def sync_delta(page_size: int = PAGE_SIZE, since_column: str = None):
+    """
+    Sync incremental: busca só os filmes com id acima do high-water mark do
+    manifest (e, com since_column, os que mudaram desde o último export) e aplica-os
+    no cache existente: linhas alteradas são substituídas, filmes novos são
+    acrescentados no fim.
+
+    O .npy nunca é alterado no lugar: é copiado por blocos para um ficheiro
+    temporário com as alterações e trocado com os.replace. Os workers em
+    execução continuam com o mmap do ficheiro antigo, consistente com as normas,
+    listas IVF e cópias quantizadas que calcularam no arranque.
+    """
+    print("=" * 60)
+    print("🔄 SYNC INCREMENTAL DO CACHE (DELTA)")
+    print("=" * 60)
+    print()
+    
+    manifest = load_manifest()
+    if manifest is None or not cache_exists():
+        print("❌ Cache ou manifest não encontrado! Execute primeiro: python export_cache.py")
+        return False
+    
+    since_column = since_column or manifest.get('since_column')
+    if since_column and since_column != manifest.get('since_column'):
+        print(f"❌ O último export não guardou '{since_column}'.")
+        print(f"   Execute: python export_cache.py --since-column {since_column}")
+        return False
+    since_value = manifest.get('since_value') if since_column else None
+    columns = manifest['columns']
+    
+    df = load_movies_cache()
+    embeddings = np.load(EMBEDDINGS_CACHE_PATH, mmap_mode='r')
+    error = cache_consistency_error(len(df), len(embeddings))
+    if error is None and len(df) != manifest['rows']:
+        error = "o número de filmes mudou depois do export"
+    if error:
+        print(f"❌ Cache desalinhado com o manifest: {error}.")
+        print("   Execute um export completo: python export_cache.py")
+        return False
+    dim = embeddings.shape[1]
+    del embeddings
+    
+    print(f"📦 Cache atual: {len(df)} filmes, max id {manifest['max_id']}"
+          + (f", {since_column} > {since_value}" if since_value else ""))
+    print()
+    
+    stats = ExportStats()
+    row_of = {int(movie_id): row for row, movie_id in enumerate(df['id'])}
+    fetched = {}  # id -> (metadados, embedding); um filme novo que também mudou aparece uma vez
+    
+    try:
+        # 1) Filmes novos: id acima do high-water mark
+        for rows, page_embeddings, fetch_time in iter_keyset_pages(columns, page_size, manifest['max_id'] + 1):
+            stats.record(len(rows), page_embeddings.nbytes, fetch_time)
+            fetched.update((row['id'], (row, vec)) for row, vec in zip(rows, page_embeddings))
+        
+        # 2) Filmes alterados desde o último export
+        if since_value:
+            changed_filter = lambda query: query.gt(since_column, since_value)
+            for rows, page_embeddings, fetch_time in iter_keyset_pages(
+                columns, page_size, 0, manifest['max_id'] + 1, filters=changed_filter
+            ):
+                stats.record(len(rows), page_embeddings.nbytes, fetch_time)
+                fetched.update((row['id'], (row, vec)) for row, vec in zip(rows, page_embeddings))
+    except Exception as e:
+        print(f"❌ Erro ao buscar o delta: {e}")
+        print("   O cache não foi alterado.")
+        return False
+    
+    if not fetched:
+        print("✅ Cache já está atualizado, nada para sincronizar.")
+        stats.summary()
+        return True
+    
+    updated = [(row_of[i], row, vec) for i, (row, vec) in fetched.items() if i in row_of]
+    added = [(row, vec) for i, (row, vec) in sorted(fetched.items()) if i not in row_of]
+    if any(len(vec) != dim for _, vec in fetched.values()):
+        print(f"❌ Embeddings do Supabase com dimensão diferente do cache ({dim}). Faça um export completo.")
+        return False
+    
+    print(f"   🔁 {len(updated)} filmes alterados, ➕ {len(added)} filmes novos")
+    
+    # Embeddings: cópia por blocos com as linhas alteradas, novos no fim, depois troca atómica
+    updated_rows = np.array([row for row, _, _ in updated], dtype=np.int64)
+    updated_vecs = np.stack([vec for _, _, vec in updated]) if updated else None
+    embeddings = np.load(EMBEDDINGS_CACHE_PATH, mmap_mode='r')
+    writer = NpyAppendWriter(EMBEDDINGS_CACHE_PATH, dim)
+    try:
+        for inicio in range(0, len(embeddings), page_size):
+            block = np.array(embeddings[inicio:inicio + page_size], dtype=np.float32)
+            in_block = (updated_rows >= inicio) & (updated_rows < inicio + len(block))
+            if in_block.any():
+                block[updated_rows[in_block] - inicio] = updated_vecs[in_block]
+            writer.append(block)
+        if added:
+            writer.append(np.stack([vec for _, vec in added]))
+    except BaseException:
+        writer.abort()
+        raise
+    del embeddings
+    writer.close()
+    
+    # Metadados (pequenos): mesma operação no DataFrame
+    if updated:
+        positions = [row for row, _, _ in updated]
+        updated_df = pd.DataFrame([row for _, row, _ in updated])
+        for col in updated_df.columns:
+            if col not in df.columns:
+                df[col] = None
+            df.loc[df.index[positions], col] = updated_df[col].to_numpy()
+        if 'embedding_hash' in df.columns:
+            # O embedding veio do Supabase: regenerate_embeddings.py volta a verificar estes filmes
+            df.loc[df.index[positions], 'embedding_hash'] = ''
+    if added:
+        df = pd.concat([df, pd.DataFrame([row for row, _ in added])], ignore_index=True)
+    
+    # Ordem: embeddings.npy, metadados, manifest por último. Um crash pelo meio
+    # deixa o manifest com a impressão digital antiga e o cache é rejeitado
+    save_movies_cache(df)
+    save_manifest(build_manifest(df, dim, columns, since_column, previous=manifest))
+    
+    stats.summary()
+    print(f"\n✅ Cache sincronizado: {len(df)} filmes")
+    print("   💡 A tabela de vizinhos e o tier reduzido ficaram desatualizados (são ignorados até")
+    print("      serem recriados): python build_neighbors.py / python build_reduced.py")
+    print("   💡 Reinicia o servidor para carregar o novo embeddings.npy")
+    return True
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Exporta filmes e embeddings do Supabase para cache/")
+    parser.add_argument("--columns", default="*",
+                        help="'*' (padrão), 'serving' ou lista separada por vírgulas")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="nº de partições de ids buscadas em paralelo")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--delta", action="store_true",
+                        help="só filmes novos/alterados desde o último export (usa cache/manifest.json)")
+    parser.add_argument("--since-column", default=None,
+                        help="coluna de timestamp (ex: updated_at) usada para detetar filmes alterados")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    export_movies_to_cache()
+    args = parse_args()
+    if args.delta:
+        sync_delta(args.page_size, args.since_column)
+    else:
+        export_movies_to_cache(
+            resolve_columns(args.columns, args.since_column), args.workers, args.page_size, args.since_column
+        )
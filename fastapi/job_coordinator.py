@@ -0,0 +1,102 @@
+"""
+Per-user coalescing of background recommendation jobs.
+
+A user has at most one job queued or running at a time. A trigger that
+arrives while one is queued is absorbed by it. A trigger that arrives while
+one is running marks it dirty, and the same job runs once more when it
+finishes. This way the latest ratings are always picked up, without parallel
+delete/insert cycles for the same user.
+
+The coordination is per process: with several uvicorn workers, triggers that
+land on different workers can still recompute the same user at the same time
+(the atomic replace_user_recommendations RPC keeps the result consistent).
+"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+IDLE = "idle"
+
+
+class JobCoordinator:
+    def __init__(self, finished_ttl: float = 3600, max_finished: int = 10000):
+        self.lock = threading.Lock()
+        self.jobs: Dict[str, Dict] = {}  # user_id -> state of the active job
+        # user_id -> when the last job finished; kept for finished_ttl, at most max_finished users
+        self.finished: "OrderedDict[str, float]" = OrderedDict()
+        self.finished_ttl = finished_ttl
+        self.max_finished = max_finished
+
+    def _mark_finished(self, user_id: str):
+        now = time.time()
+        self.finished[user_id] = now
+        self.finished.move_to_end(user_id)
+        while self.finished and (len(self.finished) > self.max_finished
+                                 or next(iter(self.finished.values())) < now - self.finished_ttl):
+            self.finished.popitem(last=False)
+
+    def _last_finished(self, user_id: str) -> Optional[float]:
+        finished_at = self.finished.get(user_id)
+        if finished_at is not None and finished_at < time.time() - self.finished_ttl:
+            return None
+        return finished_at
+
+    def _snapshot(self, user_id: str, job: Optional[Dict], coalesced: bool) -> Dict:
+        if job is None:
+            return {"state": IDLE, "coalesced": coalesced, "rerun_pending": False,
+                    "last_finished_at": self._last_finished(user_id)}
+        return {
+            "state": job["state"],
+            "coalesced": coalesced,
+            "rerun_pending": job["dirty"],
+            "triggers": job["triggers"],
+            "runs": job["runs"],
+            "last_finished_at": self._last_finished(user_id),
+        }
+
+    def submit(self, user_id: str):
+        """
+        Registers a trigger. Returns (status, start): start is True only when
+        the caller has to schedule run(); otherwise the trigger was coalesced.
+        """
+        with self.lock:
+            job = self.jobs.get(user_id)
+            if job is None:
+                job = {"state": QUEUED, "dirty": False, "triggers": 1, "runs": 0, "queued_at": time.time()}
+                self.jobs[user_id] = job
+                return self._snapshot(user_id, job, coalesced=False), True
+
+            job["triggers"] += 1
+            if job["state"] == RUNNING:
+                # The running job read the ratings already: run it once more afterwards
+                job["dirty"] = True
+            return self._snapshot(user_id, job, coalesced=True), False
+
+    def run(self, user_id: str, fn: Callable[[str], None]):
+        """Runs fn(user_id), repeating while triggers arrived during the run"""
+        while True:
+            with self.lock:
+                job = self.jobs[user_id]
+                job["state"] = RUNNING
+                job["dirty"] = False
+                job["runs"] += 1
+
+            try:
+                fn(user_id)
+            except Exception as e:
+                print(f"❌ Recommendation job for user {user_id} failed: {e}")
+
+            with self.lock:
+                if not job["dirty"]:
+                    del self.jobs[user_id]
+                    self._mark_finished(user_id)
+                    if job["triggers"] > job["runs"]:
+                        print(f"🔁 User {user_id}: {job['triggers']} triggers served by {job['runs']} run(s)")
+                    return
+
+    def status(self, user_id: str) -> Dict:
+        with self.lock:
+            return self._snapshot(user_id, self.jobs.get(user_id), coalesced=False)
@@ -0,0 +1,258 @@
+"""
+HTTP transport for the LLM API (used by rag_service.GroqClient).
+
+- One requests.Session (sync callers, e.g. debug_suite) and one pooled async
+  upstream (the FastAPI endpoints), so calls reuse connections and TLS sessions
+- Retries on 429 / 5xx / connection errors with exponential backoff and full
+  jitter. A Retry-After header is honoured, and when it asks for longer than
+  max_retry_after the call gives up at once instead of sleeping
+- A concurrency limit held only while a request is on the wire, never during
+  the backoff sleeps
+- A circuit breaker: after `failure_threshold` failed calls in a row, calls fail
+  immediately for `reset_timeout` seconds. Then one probe call decides whether it
+  closes again. A Groq outage costs one fast error per request instead of
+  three 30s timeouts
+"""
+import json
+import time
+import random
+import asyncio
+import threading
+import requests
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Dict, Optional
+from requests.adapters import HTTPAdapter
+from upstreams import Upstream
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class LLMError(Exception):
+    def __init__(self, message: str, status: Optional[int] = None, body: Optional[str] = None):
+        super().__init__(message)
+        self.status = status
+        self.body = body
+
+
+class CircuitOpenError(LLMError):
+    pass
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After in seconds (delta-seconds or HTTP-date), None when absent or invalid"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class CircuitBreaker:
+    """Thread-safe consecutive-failure breaker: closed -> open -> half_open (one probe) -> closed / open"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.probe_started = 0.0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            if self.state == OPEN and now - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self.probe_in_flight = False
+            if self.state == CLOSED:
+                return True
+            # A probe that never reported back (e.g. a cancelled request) is replaced after reset_timeout
+            if self.state == HALF_OPEN and (not self.probe_in_flight or now - self.probe_started >= self.reset_timeout):
+                self.probe_in_flight = True
+                self.probe_started = now
+                return True
+            self.rejected += 1
+            return False
+
+    def is_open(self) -> bool:
+        with self.lock:
+            return self.state == OPEN
+
+    def record_success(self):
+        with self.lock:
+            if self.state != CLOSED:
+                print(f"✅ {self.name} circuit closed again")
+            self.state = CLOSED
+            self.failures = 0
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                print(f"⚡ {self.name} circuit open after {self.failures} failures, "
+                      f"failing fast for {self.reset_timeout:.0f}s")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.probe_in_flight = False
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {'state': self.state, 'consecutive_failures': self.failures, 'rejected': self.rejected}
+
+
+class LLMTransport:
+    def __init__(self, name: str, base_url: str, headers: Dict[str, str], breaker: CircuitBreaker,
+                 slots: Optional[threading.BoundedSemaphore] = None, max_concurrency: int = 8,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_cap: float = 8.0,
+                 max_retry_after: float = 20.0, timeout: float = 30.0):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_retry_after = max_retry_after
+        self.timeout = timeout
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.slots = slots or threading.BoundedSemaphore(max_concurrency)
+
+        self.upstream = Upstream(name, base_url, headers=headers, max_concurrency=max_concurrency, timeout=timeout)
+        self.retries = 0
+
+    def _delay(self, attempt: int, retry_after: Optional[float]) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None to give up"""
+        if attempt + 1 >= self.max_retries:
+            return None
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            return retry_after + random.uniform(0, self.backoff_base)
+        # Full jitter: spreads out the retries of the callers that failed together
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def _outcome(self, status: int, body: str, attempt: int, retry_after: Optional[str]):
+        """Wait before retrying a failed response (raises when giving up)"""
+        if status not in RETRY_STATUSES:
+            # Client errors (bad request, auth) are not an outage: no retry, the upstream is up
+            self.breaker.record_success()
+            raise LLMError(f"{self.name} API error {status}: {body[:300]}", status=status, body=body)
+        delay = self._delay(attempt, parse_retry_after(retry_after))
+        print(f"⚠️ {self.name} answered {status} (attempt {attempt + 1}/{self.max_retries})"
+              + (f", retrying in {delay:.1f}s" if delay is not None else ", giving up"))
+        if delay is None or self.breaker.is_open():
+            self.breaker.record_failure()
+            raise LLMError(f"{self.name} API error {status} after {attempt + 1} attempt(s)")
+        return delay
+
+    def _connection_failure(self, error: Exception, attempt: int) -> float:
+        delay = self._delay(attempt, None)
+        print(f"⚠️ {self.name} request failed: {error} (attempt {attempt + 1}/{self.max_retries})")
+        if delay is None or self.breaker.is_open():
+            self.breaker.record_failure()
+            raise LLMError(f"{self.name} unreachable: {error}") from error
+        return delay
+
+    def _admit(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name} circuit open, call skipped")
+
+    def post(self, path: str, payload: Dict) -> Dict:
+        """Sync POST returning the JSON body. Raises LLMError / CircuitOpenError"""
+        self._admit()
+        for attempt in range(self.max_retries):
+            try:
+                with self.slots:
+                    response = self.session.post(f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+            except requests.RequestException as e:
+                delay = self._connection_failure(e, attempt)
+            else:
+                if response.status_code == 200:
+                    self.breaker.record_success()
+                    return response.json()
+                delay = self._outcome(response.status_code, response.text, attempt, response.headers.get("Retry-After"))
+            self.retries += 1
+            time.sleep(delay)
+        raise LLMError(f"{self.name}: retries exhausted")
+
+    async def apost(self, path: str, payload: Dict) -> Dict:
+        """Async POST through the pooled upstream. Raises LLMError / CircuitOpenError"""
+        self._admit()
+        for attempt in range(self.max_retries):
+            try:
+                response = await self.upstream.request('POST', path, json=payload)
+            except Exception as e:
+                delay = self._connection_failure(e, attempt)
+            else:
+                if response.status_code == 200:
+                    self.breaker.record_success()
+                    return response.json()
+                delay = self._outcome(response.status_code, response.text, attempt, response.headers.get("Retry-After"))
+            self.retries += 1
+            await asyncio.sleep(delay)
+        raise LLMError(f"{self.name}: retries exhausted")
+
+    async def astream(self, path: str, payload: Dict) -> AsyncIterator[Dict]:
+        """
+        Async POST of an OpenAI-style `stream: true` request, yielding every
+        server-sent `data:` event as a dict. Retries only happen before the
+        first event; once data has been forwarded a failure raises LLMError.
+        """
+        self._admit()
+        started = False
+        for attempt in range(self.max_retries):
+            try:
+                async with self.upstream.stream('POST', path, json=payload) as response:
+                    if response.status_code == 200:
+                        self.breaker.record_success()
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[5:].strip()
+                            if data == "[DONE]":
+                                return
+                            started = True
+                            yield json.loads(data)
+                        return
+                    body = (await response.aread()).decode('utf-8', errors='replace')
+                    delay = self._outcome(response.status_code, body, attempt, response.headers.get("Retry-After"))
+            except LLMError:
+                raise
+            except Exception as e:
+                if started:
+                    raise LLMError(f"{self.name} stream interrupted: {e}") from e
+                delay = self._connection_failure(e, attempt)
+            self.retries += 1
+            await asyncio.sleep(delay)
+        raise LLMError(f"{self.name}: retries exhausted")
+
+    async def aclose(self):
+        await self.upstream.aclose()
+
+    def close(self):
+        self.session.close()
+
+    def stats(self) -> Dict:
+        return {**self.upstream.stats(), 'retries': self.retries, 'circuit': self.breaker.stats()}
@@ -1,15 +1,35 @@
 import os
 import json
-import numpy as np
+import time
+from contextlib import asynccontextmanager
+from anyio import from_thread
 from fastapi import FastAPI, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from supabase import create_client, Client
 from dotenv import load_dotenv
+from user_vectors import decode_embeddings, weighted_mean_from_matrix
+from cache_store import cache_consistency_error, cache_exists, load_movies_cache, load_embeddings, load_quantized, load_reduced
+from vector_index import build_index
+from user_history import UserHistory, fetch_movies_by_ids, load_user_history, afetch_movies_by_ids, aload_user_history
+from user_vector_store import UserVectorStore
+from job_coordinator import JobCoordinator
+from recommendation_store import recommendation_rows, replace_recommendations
+from upstreams import PostgrestClient, in_
+from metrics import metrics
 
 # Load environment variables FIRST
 load_dotenv()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Close the pooled upstream connections of this worker
+    await postgrest.aclose()
+    await rag_service.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS Middleware
 frontend_url = os.getenv("FRONTEND_URL", "http://localhost:5173")
@@ -39,149 +59,241 @@ if not supabase_url or not supabase_key:
 
 supabase: Client = create_client(supabase_url, supabase_key)
 
-print("✅ Supabase connected. Using pgvector for similarity search.")
+# Async request path: one pooled PostgREST client, bounded in-flight calls (see upstreams.py).
+# The sync client above is kept for the background recommendation jobs.
+postgrest = PostgrestClient(
+    supabase_url, supabase_key,
+    max_concurrency=int(os.getenv("POSTGREST_MAX_CONCURRENCY", "20"))
+)
+
+# Vector search backend: "pgvector" (match_movies RPC, default) or "local"
+# (in-process index over cache/embeddings.npy, saves Supabase Disk IO Budget)
+VECTOR_SEARCH = os.getenv("VECTOR_SEARCH", "pgvector").lower()
+local_index = None
+
+if VECTOR_SEARCH == "local":
+    if not cache_exists():
+        raise ValueError(
+            "❌ VECTOR_SEARCH=local but the local cache was not found!\n"
+            "Run: python export_cache.py"
+        )
+    movies_df = load_movies_cache()
+    cache_error = cache_consistency_error(len(movies_df), len(load_embeddings()))
+    if cache_error:
+        raise ValueError(
+            f"❌ VECTOR_SEARCH=local but the local cache is inconsistent: {cache_error}\n"
+            "Run: python export_cache.py"
+        )
+    reduced_tier = None
+    if os.getenv("LOCAL_REDUCED_TIER", "0") == "1":
+        reduced_tier = load_reduced()
+        if reduced_tier is None:
+            print("⚠️  LOCAL_REDUCED_TIER=1 but no up-to-date cache/embeddings_reduced.npy (run build_reduced.py)")
+    quantized = None
+    if os.getenv("LOCAL_QUANTIZATION", "none").lower() == "int8" and reduced_tier is None:
+        quantized = load_quantized()
+        if quantized is None:
+            print("⚠️  LOCAL_QUANTIZATION=int8 but no up-to-date cache/embeddings_int8.npy (run build_quantized.py)")
+    local_index = build_index(
+        movies_df['id'].astype(int).to_numpy(),
+        load_embeddings(),
+        kind=os.getenv("LOCAL_INDEX", "ivf"),
+        nprobe=int(os.getenv("IVF_NPROBE", "0")) or None,
+        quantized=quantized,
+        reduced=reduced_tier,
+        rescore=int(os.getenv("RESCORE_CANDIDATES", "0")) or None
+    )
+    del movies_df
+    print(f"✅ Supabase connected. Using local {os.getenv('LOCAL_INDEX', 'ivf')} index ({len(local_index)} movies) for similarity search.")
+else:
+    print("✅ Supabase connected. Using pgvector for similarity search.")
+
+def match_movies(user_vector, excluded_ids, match_threshold: float = 0.5, match_count: int = 50):
+    """
+    Similarity search with the match_movies semantics.
+    Uses the local index when VECTOR_SEARCH=local, otherwise the pgvector RPC.
+    Returns rows with 'id' and 'similarity'.
+    """
+    if local_index is not None:
+        return local_index.search(user_vector, match_threshold, match_count, excluded_ids)
+    
+    result = supabase.rpc('match_movies', {
+        'query_embedding': user_vector,
+        'match_threshold': match_threshold,
+        'match_count': match_count,
+        'excluded_ids': excluded_ids
+    }).execute()
+    return result.data or []
+
+async def amatch_movies(user_vector, excluded_ids, match_threshold: float = 0.5, match_count: int = 50):
+    """match_movies for the async endpoints (local search runs in the threadpool, it is CPU-bound)"""
+    if local_index is not None:
+        return await run_in_threadpool(local_index.search, user_vector, match_threshold, match_count, excluded_ids)
+    
+    return await postgrest.rpc('match_movies', {
+        'query_embedding': user_vector,
+        'match_threshold': match_threshold,
+        'match_count': match_count,
+        'excluded_ids': excluded_ids
+    }) or []
+
 
-# Helper function to calculate user vector from ratings
-def calculate_user_vector(user_id: str):
+# Persistent per-user vectors (cache/user_vectors.sqlite), updated incrementally on rating changes
+user_vector_store = UserVectorStore() if os.getenv("USER_VECTOR_STORE", "1") == "1" else None
+
+def lookup_embeddings(movie_ids):
+    """
+    Embeddings of the given movies: rows of the local matrix, or one bulk
+    fetch of only these movies from Supabase. Returns (ids found, matrix).
+    """
+    if local_index is not None:
+        found = [m for m in movie_ids if m in local_index.id_to_row]
+        return found, local_index.embeddings[[local_index.id_to_row[m] for m in found]]
+    
+    movies = [m for m in fetch_movies_by_ids(supabase, movie_ids, 'id, embedding') if m.get('embedding')]
+    return [m['id'] for m in movies], decode_embeddings([m['embedding'] for m in movies])
+
+async def alookup_embeddings(movie_ids):
+    """lookup_embeddings through the pooled async PostgREST client (local matrix rows in the threadpool)"""
+    if local_index is not None:
+        return await run_in_threadpool(lookup_embeddings, movie_ids)
+    
+    movies = [m for m in await afetch_movies_by_ids(postgrest, movie_ids, 'id, embedding') if m.get('embedding')]
+    return [m['id'] for m in movies], decode_embeddings([m['embedding'] for m in movies])
+
+def calculate_user_vector(history: UserHistory, lookup=lookup_embeddings):
     """
     Calculates weighted average vector based on user ratings.
     Returns None if user doesn't have enough ratings.
     """
     try:
-        # Fetch user ratings
-        response = supabase.table('user_movies')\
-            .select('movie_id, rating')\
-            .eq('user_id', user_id)\
-            .execute()
-        
-        if not response.data or len(response.data) < 5:
-            print(f"⚠️  User {user_id} has only {len(response.data) if response.data else 0} ratings (minimum: 5)")
+        if len(history) < 5:
+            print(f"⚠️  User {history.user_id} has only {len(history)} ratings (minimum: 5)")
             return None
         
-        # Fetch embeddings of rated movies
-        movie_ids = [m['movie_id'] for m in response.data]
-        movies_response = supabase.table('movies')\
-            .select('id, embedding')\
-            .in_('id', movie_ids)\
-            .execute()
-        
-        if not movies_response.data:
-            print(f"⚠️  No embeddings found for movies of user {user_id}")
-            return None
-        
-        # Calculate weighted average by rating
-        user_vector = np.zeros(1024)
-        total_weight = 0
-        
-        for movie_data in response.data:
-            movie = next((m for m in movies_response.data if m['id'] == movie_data['movie_id']), None)
-            if movie and movie.get('embedding'):
-                weight = movie_data['rating']
-                embedding = json.loads(movie['embedding']) if isinstance(movie['embedding'], str) else movie['embedding']
-                user_vector += np.array(embedding) * weight
-                total_weight += weight
+        if user_vector_store is not None:
+            # Cached running sum: only rating changes since the last call touch embeddings
+            user_vector = user_vector_store.user_vector(history.user_id, history.ratings, lookup)
+        elif local_index is not None:
+            # Embeddings come from the local matrix, nothing to download
+            user_vector = weighted_mean_from_matrix(history.ratings, local_index.id_to_row, local_index.embeddings)
+        else:
+            ids, matrix = lookup(history.seen_ids)
+            user_vector = weighted_mean_from_matrix(history.ratings, {m: i for i, m in enumerate(ids)}, matrix)
         
-        if total_weight > 0:
-            user_vector = user_vector / total_weight
+        if user_vector is not None:
             return user_vector.tolist()
         
+        print(f"⚠️  No embeddings found for movies of user {history.user_id}")
         return None
         
     except Exception as e:
         print(f"❌ Error calculating user vector: {e}")
         return None
 
+async def acalculate_user_vector(history: UserHistory):
+    """
+    calculate_user_vector for the async endpoints. The numpy / SQLite work runs
+    in the threadpool; embedding lookups hop back to the event loop so they
+    share the pooled PostgREST client and its concurrency limit. With the
+    local index the rows are read in place, already off the event loop.
+    """
+    if local_index is not None:
+        return await run_in_threadpool(calculate_user_vector, history, lookup_embeddings)
+    
+    def lookup(movie_ids):
+        return from_thread.run(alookup_embeddings, movie_ids)
+    
+    return await run_in_threadpool(calculate_user_vector, history, lookup)
+
 def generate_and_save_recommendations(user_id: str):
     """
     Generates and saves recommendations for a user using Supabase pgvector
     """
     print(f"🚀 Generating recommendations for user {user_id}...")
     
-    # 1. Calculate user vector
-    user_vector = calculate_user_vector(user_id)
+    # 1. Load user history (ratings + metadata) in bulk
+    try:
+        history = load_user_history(supabase, user_id)
+    except Exception as e:
+        print(f"❌ Error loading user history: {e}")
+        return
+    
+    # 2. Calculate user vector
+    user_vector = calculate_user_vector(history)
     if user_vector is None:
         print(f"⚠️  User {user_id} does not have enough ratings (minimum: 5)")
         return
     
-    # 2. Fetch watched movies to exclude
-    try:
-        seen_response = supabase.table('user_movies')\
-            .select('movie_id')\
-            .eq('user_id', user_id)\
-            .execute()
-        seen_ids = [m['movie_id'] for m in seen_response.data] if seen_response.data else []
-    except Exception as e:
-        print(f"⚠️  Error fetching watched movies: {e}")
-        seen_ids = []
+    seen_ids = history.seen_ids
     
-    # 3. Use SQL function for similarity search via pgvector
+    # 3. Similarity search (pgvector RPC or local index)
     try:
-        result = supabase.rpc('match_movies', {
-            'query_embedding': user_vector,
-            'match_threshold': 0.5,
-            'match_count': 50,
-            'excluded_ids': seen_ids
-        }).execute()
+        candidates = match_movies(user_vector, seen_ids)
         
-        if not result.data:
-            print("⚠️  No recommendations generated by pgvector")
+        if not candidates:
+            print("⚠️  No recommendations generated by similarity search")
             return
         
-        print(f"📊 pgvector returned {len(result.data)} candidates")
+        print(f"📊 {VECTOR_SEARCH} returned {len(candidates)} candidates")
         
     except Exception as e:
         print(f"❌ Error calling match_movies: {e}")
         return
     
-    # 4. Prepare data for insertion into Supabase
-    recs_to_insert = []
-    for i, rec in enumerate(result.data[:25]):  # Salva top 25 no DB
-        recs_to_insert.append({
-            'user_id': user_id,
-            'movie_id': rec['id'],
-            'predicted_score': rec['similarity'],
-            'position': i + 1,
-        })
-
-    # 5. Deletar recomendações antigas do usuário
-    try:
-        supabase.table('user_recommendations')\
-            .delete()\
-            .eq('user_id', user_id)\
-            .execute()
-        print(f"🗑️  Old recommendations deleted for user {user_id}")
-    except Exception as e:
-        print(f"⚠️  Error deleting old recommendations: {e}")
+    # 4. Prepare data for Supabase (top 25)
+    recs_to_save = recommendation_rows(user_id, candidates)
 
-    # 6. Insert new recommendations
+    # 5. Swap the user's set atomically (only new / moved rows are written)
     try:
-        supabase.table('user_recommendations')\
-            .insert(recs_to_insert)\
-            .execute()
-        print(f"✅ {len(recs_to_insert)} recommendations saved successfully!")
+        result = replace_recommendations(supabase, {user_id: recs_to_save})
+        print(f"✅ {len(recs_to_save)} recommendations saved for user {user_id} "
+              f"({result['written']} written, {result['unchanged']} unchanged, {result['deleted']} removed)")
     except Exception as e:
-        print(f"❌ Error inserting recommendations: {e}")
+        print(f"❌ Error saving recommendations: {e}")
         return
 
+# One queued/running job per user; repeated triggers are coalesced into it
+recommendation_jobs = JobCoordinator()
+
 @app.post("/generate-recommendations/{user_id}")
-def trigger_recommendation_generation(user_id: str, background_tasks: BackgroundTasks):
+async def trigger_recommendation_generation(user_id: str, background_tasks: BackgroundTasks):
     """
     Endpoint for generating recommendations in background
     """
-    background_tasks.add_task(generate_and_save_recommendations, user_id)
+    job, start = recommendation_jobs.submit(user_id)
+    if start:
+        background_tasks.add_task(recommendation_jobs.run, user_id, generate_and_save_recommendations)
+        message = f"Recommendation generation started for user {user_id}"
+    elif job["rerun_pending"]:
+        message = f"Recommendation generation already running for user {user_id}, it will run again with the latest ratings"
+    else:
+        message = f"Recommendation generation already queued for user {user_id}"
+    
     return {
-        "message": f"Recommendation generation started for user {user_id}",
-        "status": "processing"
+        "message": message,
+        "status": "processing",
+        "job": job
     }
 
+@app.get("/generate-recommendations/{user_id}/status")
+async def recommendation_job_status(user_id: str):
+    """Current state of the user's recommendation job (idle / queued / running)"""
+    return recommendation_jobs.status(user_id)
+
 @app.get("/health")
-def health_check():
+async def health_check():
     """
     Health check endpoint for monitoring
     """
+    upstreams = {"postgrest": postgrest.stats()}
+    if rag_service.llm:
+        upstreams["groq"] = rag_service.llm.transport.stats()
     return {
         "status": "ok",
-        "message": "FastAPI is running with pgvector"
+        "message": "FastAPI is running with pgvector",
+        "upstreams": upstreams,
+        "rerank_cache": rag_service.rerank_cache.stats() if rag_service.rerank_cache else None
     }
 
 
@@ -199,112 +311,149 @@ class ChatRequest(BaseModel):
 class AiRecsRequest(BaseModel):
     user_id: str
 
+NO_HISTORY_REPLY = "Hello! I haven't seen any movies in your history yet. Rate some movies first so I can help! 🎬"
+ERROR_REPLY = "Sorry, I'm having technical difficulties. Please try again later. 🤖💥"
+
 
 @app.post("/api/chat")
-def chat_with_history(request: ChatRequest):
+async def chat_with_history(request: ChatRequest):
     """
     Chatbot endpoint: Receives user_id + message.
     Fetches user history from Supabase, calls RAG Service, returns text.
     """
+    received = time.perf_counter()
     try:
         print(f"💬 Chat Request received for User ID: {request.user_id}")
         
         # 1. Fetch User History
-        user_movies = supabase.table('user_movies').select('*').eq('user_id', request.user_id).execute()
-        ratings = []
+        history = await aload_user_history(postgrest, request.user_id)
         
-        if user_movies.data:
-            print(f"   Found {len(user_movies.data)} raw ratings in Supabase.")
-            
-            # Fetch movie details
-            movie_ids = [item['movie_id'] for item in user_movies.data]
-            movies = supabase.table('movies')\
-                .select('id, series_title, genre, released_year')\
-                .in_('id', movie_ids)\
-                .execute()
-            
-            # Create movie map
-            movie_map = {m['id']: m for m in movies.data} if movies.data else {}
-            
-            for item in user_movies.data:
-                movie = movie_map.get(item['movie_id'])
-                if movie:
-                    ratings.append({
-                        'title': movie['series_title'],
-                        'rating': item['rating'],
-                        'genre': movie.get('genre', ''),
-                        'year': movie.get('released_year', '')
-                    })
+        if len(history):
+            print(f"   Found {len(history)} raw ratings in Supabase.")
         else:
             print("   ⚠️ No ratings found in Supabase for this user.")
         
+        ratings = history.rag_ratings()
         print(f"   ✅ Processed {len(ratings)} valid movie ratings for context.")
 
         if not ratings:
-            return {"response": "Hello! I haven't seen any movies in your history yet. Rate some movies first so I can help! 🎬"}
+            return {"response": NO_HISTORY_REPLY}
             
         # 2. Call RAG Chat
-        ai_reply = rag_service.chat_with_history(ratings, request.message)
+        ai_reply = await rag_service.achat_with_history(ratings, request.message)
+        metrics.observe('chat_total', time.perf_counter() - received)
         return {"response": ai_reply}
         
     except Exception as e:
         print(f"Chat Error: {e}")
         import traceback
         traceback.print_exc()
-        return {"response": "Sorry, I'm having technical difficulties. Please try again later. 🤖💥"}
+        return {"response": ERROR_REPLY}
+
+
+@app.post("/api/chat/stream")
+async def chat_with_history_stream(request: ChatRequest):
+    """
+    Streaming variant of /api/chat (Server-Sent Events). Every event is a JSON
+    object: {"token": "..."} while the reply is generated, then
+    {"done": true, "ttft_ms": ..., "total_ms": ...} or {"error": "..."}.
+    """
+    received = time.perf_counter()
+    metrics.incr('chat_stream_requests')
+    print(f"💬 Streaming chat request received for User ID: {request.user_id}")
+
+    def sse(data) -> str:
+        return f"data: {json.dumps(data)}\n\n"
+
+    async def events():
+        ttft = None
+        try:
+            history = await aload_user_history(postgrest, request.user_id)
+            ratings = history.rag_ratings()
+            
+            if ratings:
+                chunks = rag_service.achat_stream(ratings, request.message)
+            else:
+                async def no_history():
+                    yield NO_HISTORY_REPLY
+                chunks = no_history()
+            
+            async for chunk in chunks:
+                if ttft is None:
+                    # Time to first token as the client sees it (history load included)
+                    ttft = time.perf_counter() - received
+                    metrics.observe('chat_stream_ttft', ttft)
+                yield sse({"token": chunk})
+            
+            total = time.perf_counter() - received
+            metrics.observe('chat_stream_total', total)
+            yield sse({
+                "done": True,
+                "ttft_ms": round(ttft * 1000, 1) if ttft is not None else None,
+                "total_ms": round(total * 1000, 1)
+            })
+        except Exception as e:
+            metrics.incr('chat_stream_errors')
+            print(f"Chat Stream Error: {e}")
+            yield sse({"error": ERROR_REPLY})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Per-worker counters, latency percentiles (chat TTFT, totals) and prompt token counts"""
+    return metrics.snapshot()
 
 
 @app.post("/api/recommendations/ai")
-def get_ai_recommendations(request: AiRecsRequest):
+async def get_ai_recommendations(request: AiRecsRequest):
     """
     Direct RAG Recommendations Endpoint usando pgvector
     """
     try:
         print(f"🤖 AI Recommendations request for user {request.user_id}")
         
-        # 1. Calculate user vector
-        user_vector = calculate_user_vector(request.user_id)
+        # 1. Load user history once (ratings + metadata)
+        history = await aload_user_history(postgrest, request.user_id)
+        
+        # 2. Calculate user vector
+        user_vector = await acalculate_user_vector(history)
         if user_vector is None:
             print("⚠️  User without enough ratings")
             return {"recommendations": []}
         
-        # 2. Fetch watched movies to exclude
-        seen_response = supabase.table('user_movies')\
-            .select('movie_id')\
-            .eq('user_id', request.user_id)\
-            .execute()
-        seen_ids = [m['movie_id'] for m in seen_response.data] if seen_response.data else []
+        seen_ids = history.seen_ids
         
-        # 3. Fetch candidates via pgvector
-        result = supabase.rpc('match_movies', {
-            'query_embedding': user_vector,
-            'match_threshold': 0.5,
-            'match_count': 50,
-            'excluded_ids': seen_ids
-        }).execute()
+        # 3. Fetch candidates (pgvector RPC or local index)
+        matches = await amatch_movies(user_vector, seen_ids)
         
-        if not result.data:
-            print("⚠️  No candidates returned by pgvector")
+        if not matches:
+            print("⚠️  No candidates returned by similarity search")
             return {"recommendations": []}
         
-        print(f"📊 {len(result.data)} candidates found")
+        print(f"📊 {len(matches)} candidates found")
         
         # 4. Fetch full movie details
-        movie_ids = [r['id'] for r in result.data]
-        movies_response = supabase.table('movies')\
-            .select('id, series_title, released_year, genre, overview, origin_country')\
-            .in_('id', movie_ids)\
-            .execute()
+        movie_ids = [r['id'] for r in matches]
+        movies = await postgrest.select(
+            'movies', 'id, series_title, released_year, genre, overview, origin_country', id=in_(movie_ids)
+        )
         
-        if not movies_response.data:
+        if not movies:
             return {"recommendations": []}
         
         # 5. Combine similarity scores with movie details
-        score_map = {r['id']: r['similarity'] for r in result.data}
+        score_map = {r['id']: r['similarity'] for r in matches}
         candidates = []
         
-        for movie in movies_response.data:
+        for movie in movies:
             candidates.append({
+                'id': movie['id'],
                 'title': movie['series_title'],
                 'year': movie.get('released_year', 'N/A'),
                 'genre': movie.get('genre', ''),
@@ -313,29 +462,13 @@ def get_ai_recommendations(request: AiRecsRequest):
                 'origin_country': movie.get('origin_country', '')
             })
         
-        # 6. Fetch user history for RAG context
-        ratings = []
-        user_data = supabase.table('user_movies').select('*').eq('user_id', request.user_id).execute()
-        
-        if user_data.data:
-            for item in user_data.data[:50]:  # Limit to 50 to save tokens
-                movie_match = supabase.table('movies')\
-                    .select('series_title, genre, released_year')\
-                    .eq('id', item['movie_id'])\
-                    .single()\
-                    .execute()
-                    
-                if movie_match.data:
-                    ratings.append({
-                        'title': movie_match.data['series_title'],
-                        'rating': item['rating'],
-                        'genre': movie_match.data.get('genre', ''),
-                        'year': movie_match.data.get('released_year', '')
-                    })
+        # 6. User history for RAG context (already hydrated); the prompt builder
+        #    keeps the best rated movies that fit in RERANK_PROMPT_TOKENS
+        ratings = history.rag_ratings()
         
         # 7. RAG Rerank
         print("🧠 Applying RAG reranking...")
-        final_recs = rag_service.rerank(ratings, candidates)
+        final_recs = await rag_service.arerank(ratings, candidates)
         
         return {"recommendations": final_recs}
         
@@ -0,0 +1,73 @@
+"""
+In-process metrics for the API (exposed by GET /metrics in main.py).
+
+Counters are plain totals. Latencies (and token counts) keep the last `window`
+samples and report count / mean / p50 / p95 / p99 / max, in milliseconds (or
+tokens). Everything is per worker and resets on restart.
+"""
+import time
+import threading
+from collections import deque
+from typing import Dict
+
+import numpy as np
+
+
+class LatencyStats:
+    def __init__(self, window: int = 1000, scale: float = 1000.0, unit: str = "ms"):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.scale = scale
+        self.unit = unit
+
+    def observe(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+
+    def snapshot(self) -> Dict:
+        if not self.samples:
+            return {'count': self.count}
+        values = np.asarray(self.samples) * self.scale
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {
+            'count': self.count,
+            f'mean_{self.unit}': round(float(values.mean()), 1),
+            f'p50_{self.unit}': round(float(p50), 1),
+            f'p95_{self.unit}': round(float(p95), 1),
+            f'p99_{self.unit}': round(float(p99), 1),
+            f'max_{self.unit}': round(float(values.max()), 1),
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.counters: Dict[str, int] = {}
+        self.latencies: Dict[str, LatencyStats] = {}
+        self.tokens: Dict[str, LatencyStats] = {}
+
+    def incr(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            self.latencies.setdefault(name, LatencyStats()).observe(seconds)
+
+    def observe_tokens(self, name: str, tokens: int):
+        with self.lock:
+            self.tokens.setdefault(name, LatencyStats(scale=1.0, unit="tokens")).observe(tokens)
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {
+                'uptime_s': round(time.time() - self.started_at, 1),
+                'counters': dict(self.counters),
+                'latencies': {name: stats.snapshot() for name, stats in self.latencies.items()},
+                'tokens': {name: stats.snapshot() for name, stats in self.tokens.items()},
+            }
+
+
+# One registry per worker process
+metrics = Metrics()
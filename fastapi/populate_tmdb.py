@@ -1,12 +1,11 @@
 import os
-import time
-import requests
 import pandas as pd
 import numpy as np
 from typing import List, Dict, Any
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from sentence_transformers import SentenceTransformer
+from tmdb_client import TMDBClient
 
 # Load environment variables
 load_dotenv()
@@ -23,55 +22,46 @@ if not SUPABASE_URL or not SUPABASE_KEY:
 
 # Initialize clients
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Pooled TMDB client: concurrent workers sharing one rate limiter (40 req/10s)
+tmdb = TMDBClient(TMDB_API_KEY, max_workers=int(os.getenv("TMDB_WORKERS", "8")))
 print("📥 Loading embeddings model (768 dimensions)...")
 model = SentenceTransformer('all-mpnet-base-v2')  # 768 dimensions (best quality)
 print("✅ Model loaded!")
 
-BASE_URL = "https://api.themoviedb.org/3"
-
 def fetch_movies_from_tmdb(pages: int = 5, start_page: int = 1, sort_by: str = "popularity.desc") -> List[Dict]:
     """
-    Fetch movies from TMDB using the discover endpoint
+    Fetch movies from TMDB using the discover endpoint (pages fetched concurrently)
     """
     movies = []
     print(f"🔄 Fetching {pages} pages of movies from TMDB (Sort: {sort_by})...")
     
-    for page in range(start_page, start_page + pages):
+    def fetch_page(page: int) -> List[Dict]:
         try:
-            url = f"{BASE_URL}/discover/movie"
-            params = {
-                "api_key": TMDB_API_KEY,
-                "language": "en-US",
-                "sort_by": sort_by,
-                "include_adult": "false",
-                "include_video": "false",
-                "page": page,
-                "vote_count.gte": 100  # Filtrar filmes com poucos votos para garantir qualidade
-            }
-            
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            
-            results = data.get("results", [])
-            movies.extend(results)
-            
-            print(f"   Page {page}/{start_page + pages - 1}: {len(results)} movies found")
-            time.sleep(0.1)  # Respect rate limit (40 req/10s)
-            
+            data = tmdb.get(
+                "/discover/movie",
+                language="en-US",
+                sort_by=sort_by,
+                include_adult="false",
+                include_video="false",
+                page=page,
+                **{"vote_count.gte": 100}  # Filtrar filmes com poucos votos para garantir qualidade
+            )
+            return data.get("results", [])
         except Exception as e:
             print(f"❌ Error on page {page}: {e}")
-            continue
+            return []
+    
+    page_numbers = range(start_page, start_page + pages)
+    for page, results in zip(page_numbers, tmdb.map(fetch_page, page_numbers)):
+        movies.extend(results)
+        print(f"   Page {page}/{start_page + pages - 1}: {len(results)} movies found")
             
     return movies
 
 def get_genres_map() -> Dict[int, str]:
     """Fetches genre ID to name map"""
     try:
-        url = f"{BASE_URL}/genre/movie/list"
-        params = {"api_key": TMDB_API_KEY, "language": "en-US"}
-        response = requests.get(url, params=params)
-        data = response.json()
+        data = tmdb.get("/genre/movie/list", language="en-US")
         return {g["id"]: g["name"] for g in data.get("genres", [])}
     except Exception as e:
         print(f"⚠️ Error fetching genres: {e}")
@@ -80,13 +70,7 @@ def get_genres_map() -> Dict[int, str]:
 def get_movie_details(movie_id: int) -> Dict[str, Any]:
     """Fetches full movie details (keywords, runtime, director, cast)"""
     try:
-        url = f"{BASE_URL}/movie/{movie_id}"
-        params = {
-            "api_key": TMDB_API_KEY,
-            "append_to_response": "keywords,credits"
-        }
-        response = requests.get(url, params=params)
-        data = response.json()
+        data = tmdb.get(f"/movie/{movie_id}", append_to_response="keywords,credits")
         
         # Extract keywords
         keywords = [k['name'] for k in data.get('keywords', {}).get('keywords', [])]
@@ -128,6 +112,11 @@ def process_and_upload_movies(raw_movies: List[Dict], genres_map: Dict[int, str]
     unique_movies = list({m['id']: m for m in raw_movies}.values())
     print(f"   After removing duplicates: {len(unique_movies)} unique movies")
     
+    # Fetch full details (keywords, runtime, director) concurrently for the movies we will keep
+    to_detail = [m['id'] for m in unique_movies if m.get('overview') and m.get('title')]
+    print(f"   Fetching details for {len(to_detail)} movies ({tmdb.max_workers} workers)...")
+    details_map = dict(zip(to_detail, tmdb.map(get_movie_details, to_detail)))
+    
     for idx, movie in enumerate(unique_movies):
         try:
             # Show progress every 10 movies
@@ -142,8 +131,8 @@ def process_and_upload_movies(raw_movies: List[Dict], genres_map: Dict[int, str]
             genre_names = [genres_map.get(gid, "Unknown") for gid in movie.get('genre_ids', [])]
             genre_str = ", ".join(genre_names)
             
-            # 1. Fetch full details (keywords, runtime, director, cast)
-            details = get_movie_details(movie['id'])
+            # 1. Full details (keywords, runtime, director, cast), fetched above
+            details = details_map[movie['id']]
             keywords_str = ", ".join(details['keywords'][:10])  # Top 10 keywords
             
             # 2. Get Language
@@ -182,9 +171,6 @@ def process_and_upload_movies(raw_movies: List[Dict], genres_map: Dict[int, str]
             
             processed_movies.append(movie_data)
             
-            # Manual rate limit to not exceed API with extra keyword requests
-            time.sleep(0.05) 
-            
         except Exception as e:
             print(f"⚠️ Error processing movie {movie.get('title', 'Unknown')}: {e}")
             import traceback
@@ -216,7 +202,7 @@ def process_and_upload_movies(raw_movies: List[Dict], genres_map: Dict[int, str]
 
 def main():
     print("🎬 Starting TMDB population script for 100K MOVIES...")
-    print("⚠️  THIS PROCESS WILL TAKE 4-6 HOURS. Leave it running!\n")
+    print("⚠️  THIS PROCESS IS BOUND BY THE TMDB RATE LIMIT (~2 HOURS at 40 req/10s). Leave it running!\n")
     
     print("\n📥 Fetching data from TMDB...")
     genres_map = get_genres_map()
@@ -244,6 +230,9 @@ def main():
     
     process_and_upload_movies(all_movies, genres_map)
     
+    rl_stats = tmdb.limiter.get_stats()
+    print(f"📊 TMDB: {rl_stats['total_calls']} calls, {rl_stats['total_waits']} rate-limit waits")
+    
     print("\n✅ Completed! Check Supabase.")
 
 if __name__ == "__main__":
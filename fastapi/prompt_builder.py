@@ -0,0 +1,110 @@
+"""
+Token-budgeted prompt assembly for RagService.
+
+A prompt is a fixed template plus sections of optional lines (liked history,
+candidates). Lines are given in priority order and each section takes them
+until its share of the budget is used up. Budget left by a section goes to the
+next ones. A line may carry a detail (e.g. a candidate overview). Details are
+added, again by priority, only after the section's lines are in. Prompt size,
+and with it LLM latency and Groq cost, stays bounded for any history length.
+
+Tokens are counted with tiktoken (cl100k_base, close to the Llama 3 tokenizer)
+when it is installed. Otherwise they are estimated from the UTF-8 length at
+~4 bytes per token, which errs on the high side for emoji and accents.
+"""
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+    HAS_TIKTOKEN = True
+except Exception:  # not installed, or the BPE file cannot be downloaded
+    HAS_TIKTOKEN = False
+
+
+def count_tokens(text: str) -> int:
+    if HAS_TIKTOKEN:
+        return len(_ENCODING.encode(text))
+    return -(-len(text.encode('utf-8')) // 4)
+
+
+class PromptBuilder:
+    """
+    Fills the {<name>} placeholders of a str.format template within `budget`
+    tokens. {<name>_shown} and {<name>_total} hold the number of lines kept
+    and offered for each section; other placeholders come from build(**fields).
+    """
+
+    def __init__(self, template: str, budget: int):
+        self.template = template
+        self.budget = budget
+        self.sections: List[Dict] = []
+
+    def add_section(self, name: str, lines: List[str], details: Optional[List[Optional[str]]] = None,
+                    weight: float = 1.0) -> 'PromptBuilder':
+        self.sections.append({
+            'name': name,
+            'lines': lines,
+            'details': details or [None] * len(lines),
+            'weight': weight,
+            'shown': 0,
+            'detailed': 0,
+        })
+        return self
+
+    @staticmethod
+    def _fill(section: Dict, allowance: int) -> int:
+        """Adds lines, then details of the shown lines, while they fit. Returns tokens spent"""
+        spent = 0
+        lines, details = section['lines'], section['details']
+        while section['shown'] < len(lines):
+            cost = count_tokens(lines[section['shown']] + "\n")
+            if spent + cost > allowance:
+                break
+            spent += cost
+            section['shown'] += 1
+        while section['detailed'] < section['shown']:
+            detail = details[section['detailed']]
+            cost = count_tokens(detail + "\n") if detail else 0
+            if spent + cost > allowance:
+                break
+            spent += cost
+            section['detailed'] += 1
+        return spent
+
+    def _fields(self, empty: bool = False) -> Dict:
+        fields = {}
+        for section in self.sections:
+            name = section['name']
+            text = []
+            if not empty:
+                for i in range(section['shown']):
+                    text.append(section['lines'][i])
+                    if i < section['detailed'] and section['details'][i]:
+                        text.append(section['details'][i])
+            fields[name] = "\n".join(text)
+            fields[f"{name}_shown"] = len(section['lines']) if empty else section['shown']
+            fields[f"{name}_total"] = len(section['lines'])
+        return fields
+
+    def build(self, **fields) -> Tuple[str, Dict]:
+        """(prompt, report): the report has prompt_tokens, budget and shown/total/detailed per section"""
+        fixed = count_tokens(self.template.format(**fields, **self._fields(empty=True)))
+        available = max(0, self.budget - fixed)
+
+        # First pass: each section up to its weighted share; second pass: leftovers in section order
+        total_weight = sum(s['weight'] for s in self.sections) or 1.0
+        spent = sum(self._fill(s, int(available * s['weight'] / total_weight)) for s in self.sections)
+        for section in self.sections:
+            spent += self._fill(section, available - spent)
+
+        prompt = self.template.format(**fields, **self._fields())
+        report = {
+            'prompt_tokens': count_tokens(prompt),
+            'budget': self.budget,
+            'sections': {
+                s['name']: {'shown': s['shown'], 'total': len(s['lines']), 'detailed': s['detailed']}
+                for s in self.sections
+            },
+        }
+        return prompt, report
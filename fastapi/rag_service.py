@@ -1,52 +1,170 @@
 import os
 import json
-import requests
-from typing import List, Dict, Optional
+import time
+import threading
+from typing import AsyncIterator, List, Dict, Optional
+from llm_transport import CircuitBreaker, LLMError, LLMTransport
+from metrics import metrics
+from prompt_builder import PromptBuilder
+from rerank_cache import build_rerank_cache, rerank_cache_key
+from rerank_parser import FAILED, OK, parse_rerank_decisions
+
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+GROQ_MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", "8"))
+GROQ_MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", "3"))
+
+# Prompt size caps (template + history + candidates), see prompt_builder.py
+RERANK_PROMPT_TOKENS = int(os.getenv("RERANK_PROMPT_TOKENS", "3000"))
+CHAT_PROMPT_TOKENS = int(os.getenv("CHAT_PROMPT_TOKENS", "1500"))
+
+# Ask for response_format json_object on rerank (0 for models without JSON mode)
+RERANK_JSON_MODE = os.getenv("RERANK_JSON_MODE", "1") == "1"
+
+# Shared by every GroqClient of the process: one concurrency limit, one breaker
+groq_slots = threading.BoundedSemaphore(GROQ_MAX_CONCURRENCY)
+groq_breaker = CircuitBreaker(
+    "Groq",
+    failure_threshold=int(os.getenv("GROQ_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.getenv("GROQ_BREAKER_RESET", "30"))
+)
+
+RERANK_PROMPT_TEMPLATE = """You are a movie recommendation engine.
+        
+USER LIKES THESE MOVIES:
+{history}
+
+CANDIDATES (generated by algorithm):
+{candidates}
+
+TASK:
+Re-rank the CANDIDATES list to find the best 5-8 matches for the user based *exclusively* on their movie history.
+The user did NOT search for anything specific, so your goal is to find "more like what they already like".
+
+CRITICAL RULES:
+1. ONLY SELECT FROM THE CANDIDATES LIST. DO NOT INVENT MOVIES.
+2. If a candidate has a low rank (high ID) but matches the user history perfectly, boost it!
+3. If a candidate matches the genre/tone of 'USER LIKES', it is a good match.
+4. If a candidate is completely unrelated, ignore it (do not return it).
+
+OUTPUT FORMAT:
+Return a JSON object with a "recommendations" list, best match first. NO COMMENTS. NO MATH.
+{{
+  "recommendations": [
+    {{
+      "index": 0,
+      "adjusted_score": 0.95,
+      "reason": "Perfect match because..."
+    }}
+  ]
+}}
+"""
+
+CHAT_PROMPT_TEMPLATE = """You are a personalized movie expert assistant.
+        
+USER PROFILE ({history_total} movies total, top {history_shown} shown):
+{history}
+
+USER MESSAGE: "{user_message}"
+
+TASK:
+Answer the user's message based on their movie taste.
+- Be helpful, conversational, and concise.
+- Use their history to justify your answers (e.g., "Since you liked X...").
+- If they ask for recommendations, suggest 3-5 titles that aren't in their history.
+- Do NOT output JSON. Output normal text.
+"""
 
 class GroqClient:
     def __init__(self, api_key: str):
         self.api_key = api_key
-        self.url = "https://api.groq.com/openai/v1/chat/completions"
         self.model = "llama-3.1-8b-instant"  # Updated to faster/higher limit model
-        
-    def generate(self, prompt: str, max_tokens: int = 2048) -> str:
+        self.transport = LLMTransport(
+            "Groq", GROQ_BASE_URL, headers=self._headers(), breaker=groq_breaker, slots=groq_slots,
+            max_concurrency=GROQ_MAX_CONCURRENCY, max_retries=GROQ_MAX_RETRIES
+        )
+        # Pooled async transport shared by every request of this worker
+        self.upstream = self.transport.upstream
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
 
+    def _payload(self, prompt: str, max_tokens: int, json_mode: bool = False) -> Dict:
         payload = {
             "model": self.model,
             "messages": [{"role": "user", "content": prompt}],
             "temperature": 0.5,
             "max_tokens": max_tokens
         }
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-        
-        max_retries = 3
+        if json_mode:
+            payload["response_format"] = {"type": "json_object"}
+        return payload
         
-        for attempt in range(max_retries):
-            try:
-                response = requests.post(self.url, json=payload, headers=headers, timeout=30)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    return data['choices'][0]['message']['content']
-                
-                elif response.status_code == 429:
-                    wait_time = 10 * (attempt + 1)
-                    print(f"Update: ⚠️ Rate limit reached. Pause for {wait_time}s... (Attempt {attempt+1}/{max_retries})")
-                    time.sleep(wait_time)
-                    continue
-                    
-                else:
-                    print(f"❌ Groq API Error: {response.text}")
-                    return ""
-                    
-            except Exception as e:
-                print(f"❌ LLM Call Failed: {e}")
-                return ""
+    @staticmethod
+    def _content(data: Dict) -> str:
+        usage = data.get('usage') or {}
+        if 'prompt_tokens' in usage:
+            # Real count from the API, to compare with the builder's estimate
+            metrics.observe_tokens('llm_prompt_tokens', usage['prompt_tokens'])
+        return data['choices'][0]['message']['content']
+
+    @staticmethod
+    def _failed_generation(error: LLMError) -> str:
+        """
+        In JSON mode Groq rejects an answer that is not valid JSON with a 400 that
+        still carries the generated text (error.failed_generation): hand it to the
+        tolerant parser instead of losing it.
+        """
+        if error.status != 400 or not error.body:
+            return ""
+        try:
+            text = json.loads(error.body).get('error', {}).get('failed_generation') or ""
+        except (ValueError, AttributeError):
+            return ""
+        if text:
+            metrics.incr('llm_json_validate_failed')
+        return text
         
-        return ""
+    def generate(self, prompt: str, max_tokens: int = 2048, json_mode: bool = False) -> str:
+        """Completion text, or "" when the call failed (retries and breaker in LLMTransport)"""
+        try:
+            data = self.transport.post("/chat/completions", self._payload(prompt, max_tokens, json_mode))
+            return self._content(data)
+        except LLMError as e:
+            print(f"❌ LLM Call Failed: {e}")
+            return self._failed_generation(e) if json_mode else ""
+        except (KeyError, IndexError, ValueError) as e:
+            print(f"❌ LLM Call Failed: {e}")
+            return ""
+
+    async def agenerate(self, prompt: str, max_tokens: int = 2048, json_mode: bool = False) -> str:
+        """generate() for the async endpoints: pooled connection, waits without holding a thread"""
+        try:
+            data = await self.transport.apost("/chat/completions", self._payload(prompt, max_tokens, json_mode))
+            return self._content(data)
+        except LLMError as e:
+            print(f"❌ LLM Call Failed: {e}")
+            return self._failed_generation(e) if json_mode else ""
+        except (KeyError, IndexError, ValueError) as e:
+            print(f"❌ LLM Call Failed: {e}")
+            return ""
+
+    async def astream(self, prompt: str, max_tokens: int = 2048) -> AsyncIterator[str]:
+        """Completion text chunks as they are generated (stream: true). Raises LLMError"""
+        payload = {**self._payload(prompt, max_tokens), "stream": True}
+        start = time.perf_counter()
+        first = True
+        async for event in self.transport.astream("/chat/completions", payload):
+            choices = event.get('choices') or []
+            text = (choices[0].get('delta') or {}).get('content') if choices else None
+            if not text:
+                continue
+            if first:
+                metrics.observe('llm_stream_ttft', time.perf_counter() - start)
+                first = False
+            yield text
 
 class RagService:
     def __init__(self):
@@ -56,6 +174,8 @@ class RagService:
             self.llm = None
         else:
             self.llm = GroqClient(self.api_key)
+        # Same liked history + same candidate set -> previous ranking, no LLM call
+        self.rerank_cache = build_rerank_cache() if self.llm else None
             
     def rerank(self, ratings: List[Dict], candidates: List[Dict], user_query: str = "") -> List[Dict]:
         """
@@ -65,71 +185,117 @@ class RagService:
             print("⚠️ LLM not configured. Returning top candidates without reranking.")
             return candidates[:10]
 
-        # Format History
-        history_text = "\n".join([f"- {r['title']} ({r['rating']}⭐)" for r in ratings if r['rating'] >= 15])
-        
-        # Format Candidates
-        candidates_text = ""
-        for i, c in enumerate(candidates):
-            candidates_text += f"ID {i}: {c['title']} ({c.get('year', 'N/A')}) - {c.get('genre', 'N/A')}\n"
-            candidates_text += f"   Overview: {c.get('overview', 'N/A')[:150]}...\n"
-        
-        prompt = f"""You are a movie recommendation engine.
+        key, cached = self._cached_rerank(ratings, candidates)
+        if cached is not None:
+            return cached
+
+        prompt, shown = self._rerank_prompt(ratings, candidates)
+        response = self.llm.generate(prompt, json_mode=RERANK_JSON_MODE)
+        return self._store_rerank(key, self._parse_rerank(response, shown), candidates)
+
+    async def arerank(self, ratings: List[Dict], candidates: List[Dict], user_query: str = "") -> List[Dict]:
+        """rerank() for the async endpoints"""
+        if not self.llm:
+            print("⚠️ LLM not configured. Returning top candidates without reranking.")
+            return candidates[:10]
+
+        key, cached = self._cached_rerank(ratings, candidates)
+        if cached is not None:
+            return cached
+
+        prompt, shown = self._rerank_prompt(ratings, candidates)
+        response = await self.llm.agenerate(prompt, json_mode=RERANK_JSON_MODE)
+        return self._store_rerank(key, self._parse_rerank(response, shown), candidates)
+
+    def _liked(self, ratings: List[Dict]) -> List[Dict]:
+        """Liked movies, best rated first (the order the prompt builder keeps them in)"""
+        return sorted([r for r in ratings if r['rating'] >= 15], key=lambda r: r['rating'], reverse=True)
+
+    def _liked_history(self, ratings: List[Dict]) -> str:
+        return "\n".join([f"- {r['title']} ({r['rating']}⭐)" for r in self._liked(ratings)])
+
+    def _cached_rerank(self, ratings: List[Dict], candidates: List[Dict]):
+        """(cache key, cached ranking or None)"""
+        if self.rerank_cache is None:
+            return None, None
+        key = rerank_cache_key(f"{self.llm.model}|{RERANK_PROMPT_TOKENS}", self._liked_history(ratings),
+                               [c.get('id', c['title']) for c in candidates])
+        cached = self.rerank_cache.get(key)
+        if cached is not None:
+            print(f"⚡ Rerank cache hit ({len(cached)} recommendations, no LLM call)")
+        return key, cached
+
+    def _store_rerank(self, key: Optional[str], reranked: Optional[List[Dict]], candidates: List[Dict]) -> List[Dict]:
+        # Failed / unparseable answers fall back to the vector ranking and are not cached
+        if reranked is None:
+            return candidates[:10]
+        if key is not None:
+            self.rerank_cache.set(key, reranked)
+        return reranked
+
+    def _rerank_prompt(self, ratings: List[Dict], candidates: List[Dict]):
+        """
+        (prompt, candidates shown): liked movies by rating and candidates by
+        vector score, as many as fit in RERANK_PROMPT_TOKENS. Every shown
+        candidate gets its title line; overviews are added best-first with
+        the budget that remains. The IDs index the returned list.
+        """
+        liked = self._liked(ratings)
+        ranked = sorted(candidates, key=lambda c: c.get('score', 0), reverse=True)
         
-USER LIKES THESE MOVIES:
-{history_text}
+        builder = PromptBuilder(RERANK_PROMPT_TEMPLATE, RERANK_PROMPT_TOKENS)
+        builder.add_section('history', [f"- {r['title']} ({r['rating']}⭐)" for r in liked], weight=1)
+        builder.add_section(
+            'candidates',
+            [f"ID {i}: {c['title']} ({c.get('year', 'N/A')}) - {c.get('genre', 'N/A')}" for i, c in enumerate(ranked)],
+            details=[f"   Overview: {(c.get('overview') or 'N/A')[:150]}..." for c in ranked],
+            weight=2
+        )
+        prompt, report = builder.build()
+        self._report_prompt('rerank', report)
+        return prompt, ranked[:report['sections']['candidates']['shown']]
 
-CANDIDATES (generated by algorithm):
-{candidates_text}
+    def _report_prompt(self, kind: str, report: Dict):
+        metrics.observe_tokens(f"{kind}_prompt_tokens", report['prompt_tokens'])
+        sections = ", ".join(f"{name} {s['shown']}/{s['total']}" for name, s in report['sections'].items())
+        print(f"📏 {kind} prompt: {report['prompt_tokens']}/{report['budget']} tokens ({sections})")
 
-TASK:
-Re-rank the CANDIDATES list to find the best 5-8 matches for the user based *exclusively* on their movie history.
-The user did NOT search for anything specific, so your goal is to find "more like what they already like".
+    def _parse_rerank(self, response: str, candidates: List[Dict]) -> Optional[List[Dict]]:
+        """Candidates picked by the LLM, best first; None when the answer is unusable"""
+        if not response or not response.strip():
+            # The call itself failed (transport error, open circuit): not a parse outcome
+            metrics.incr('rerank_llm_error')
+            return None
+        decisions, outcome = parse_rerank_decisions(response)
+        metrics.incr(f"rerank_parse_{outcome}")
+        if outcome == FAILED:
+            print(f"❌ Rerank answer could not be parsed ({len(response)} chars)")
+            return None
 
-CRITICAL RULES:
-1. ONLY SELECT FROM THE CANDIDATES LIST. DO NOT INVENT MOVIES.
-2. If a candidate has a low rank (high ID) but matches the user history perfectly, boost it!
-3. If a candidate matches the genre/tone of 'USER LIKES', it is a good match.
-4. If a candidate is completely unrelated, ignore it (do not return it).
+        reranked, seen, dropped = [], set(), 0
+        for d in decisions:
+            try:
+                idx = int(d['index'])
+                if not 0 <= idx < len(candidates) or idx in seen:
+                    raise ValueError(f"index {idx}")
+                score = float(d.get('adjusted_score', candidates[idx]['score']))
+            except (KeyError, TypeError, ValueError):
+                # One bad decision no longer discards the others
+                dropped += 1
+                continue
+            seen.add(idx)
+            cand = candidates[idx]
+            cand['rag_explanation'] = d.get('reason', 'N/A')
+            cand['score'] = score
+            reranked.append(cand)
 
-OUTPUT FORMAT:
-Provide a valid JSON list. NO COMMENTS. NO MATH.
-[
-  {{
-    "index": 0,
-    "adjusted_score": 0.95,
-    "reason": "Perfect match because..."
-  }}
-]
-"""
-        response = self.llm.generate(prompt)
+        if dropped:
+            metrics.incr('rerank_decisions_dropped', dropped)
+        if outcome != OK or dropped:
+            print(f"⚠️ Rerank answer {outcome}: {len(reranked)} decisions kept, {dropped} dropped")
         
-        # Parse Response
-        try:
-            if '[' in response and ']' in response:
-                start = response.find('[')
-                end = response.rfind(']') + 1
-                json_str = response[start:end]
-                lines = [l.split('//')[0] for l in json_str.split('\n')]
-                json_clean = '\n'.join(lines)
-                
-                decisions = json.loads(json_clean)
-                
-                reranked = []
-                for d in decisions:
-                    idx = d.get('index')
-                    if idx is not None and idx < len(candidates):
-                        cand = candidates[idx]
-                        cand['rag_explanation'] = d.get('reason', 'N/A')
-                        cand['score'] = float(d.get('adjusted_score', cand['score']))
-                        reranked.append(cand)
-                
-                reranked.sort(key=lambda x: x['score'], reverse=True)
-                return reranked if reranked else candidates[:10]
-        except Exception as e:
-            print(f"❌ JSON Parsing failed: {e}")
-            return candidates[:10]
-        return candidates[:10]
+        reranked.sort(key=lambda x: x['score'], reverse=True)
+        return reranked if reranked else None
 
     def chat_with_history(self, ratings: List[Dict], user_message: str) -> str:
         """
@@ -139,30 +305,52 @@ Provide a valid JSON list. NO COMMENTS. NO MATH.
         if not self.llm:
              return "⚠️ Chatbot disabled: GROQ_API_KEY not configured."
 
-        # Format history very compactly to save tokens
-        history_len = len(ratings)
-        # Prioritize top rated movies
-        top_rated = sorted(ratings, key=lambda x: x['rating'], reverse=True)[:50]
-        
-        history_text = "\n".join([f"- {r['title']} ({r['rating']}⭐)" for r in top_rated])
-        
-        prompt = f"""You are a personalized movie expert assistant.
-        
-USER PROFILE ({history_len} movies total, top 50 shown):
-{history_text}
+        try:
+             # Use a slightly higher temperature for chat to be more creative? Default is fine.
+             response = self.llm.generate(self._chat_prompt(ratings, user_message), max_tokens=1024)
+             return response.strip()
+        except Exception as e:
+             return f"⚠️ Error generating response: {e}"
 
-USER MESSAGE: "{user_message}"
+    async def achat_with_history(self, ratings: List[Dict], user_message: str) -> str:
+        """chat_with_history() for the async endpoints"""
+        if not self.llm:
+             return "⚠️ Chatbot disabled: GROQ_API_KEY not configured."
 
-TASK:
-Answer the user's message based on their movie taste.
-- Be helpful, conversational, and concise.
-- Use their history to justify your answers (e.g., "Since you liked X...").
-- If they ask for recommendations, suggest 3-5 titles that aren't in their history.
-- Do NOT output JSON. Output normal text.
-"""
         try:
-             # Use a slightly higher temperature for chat to be more creative? Default is fine.
-             response = self.llm.generate(prompt, max_tokens=1024)
+             response = await self.llm.agenerate(self._chat_prompt(ratings, user_message), max_tokens=1024)
              return response.strip()
         except Exception as e:
              return f"⚠️ Error generating response: {e}"
+
+    async def achat_stream(self, ratings: List[Dict], user_message: str) -> AsyncIterator[str]:
+        """chat_with_history() streamed: reply chunks as the LLM generates them (raises LLMError)"""
+        if not self.llm:
+            yield "⚠️ Chatbot disabled: GROQ_API_KEY not configured."
+            return
+
+        leading = True
+        async for chunk in self.llm.astream(self._chat_prompt(ratings, user_message), max_tokens=1024):
+            if leading:
+                # Same as the .strip() of the non-streaming reply, for the leading side
+                chunk = chunk.lstrip()
+                if not chunk:
+                    continue
+                leading = False
+            yield chunk
+
+    def _chat_prompt(self, ratings: List[Dict], user_message: str) -> str:
+        # Prioritize top rated movies, as many as fit in CHAT_PROMPT_TOKENS
+        top_rated = sorted(ratings, key=lambda x: x['rating'], reverse=True)
+        
+        builder = PromptBuilder(CHAT_PROMPT_TEMPLATE, CHAT_PROMPT_TOKENS)
+        builder.add_section('history', [f"- {r['title']} ({r['rating']}⭐)" for r in top_rated])
+        prompt, report = builder.build(user_message=user_message)
+        self._report_prompt('chat', report)
+        return prompt
+
+    async def aclose(self):
+        """Closes the pooled Groq connections (app shutdown)"""
+        if self.llm:
+            await self.llm.transport.aclose()
+
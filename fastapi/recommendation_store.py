@@ -0,0 +1,63 @@
+"""
+Write path for user_recommendations.
+
+replace_recommendations() calls the replace_user_recommendations RPC
+(webapp/supabase/migrations/..._replace_user_recommendations.sql). In one
+transaction it removes the movies that left each user's set, inserts the new
+ones and rewrites only the rows whose position or score changed. Until the
+migration is applied it falls back to the old delete-then-insert.
+"""
+from typing import Dict, List
+from supabase import Client
+
+REPLACE_RPC = 'replace_user_recommendations'
+TOP_N = 25
+
+_rpc_available = True
+
+
+def recommendation_rows(user_id: str, candidates: List[Dict], limit: int = TOP_N) -> List[Dict]:
+    """match_movies rows ({'id', 'similarity'}, best first) -> user_recommendations rows"""
+    return [
+        {
+            'user_id': user_id,
+            'movie_id': rec['id'],
+            'predicted_score': rec['similarity'],
+            'position': i + 1,
+        }
+        for i, rec in enumerate(candidates[:limit])
+    ]
+
+
+def _is_missing_function(error: Exception) -> bool:
+    # PostgREST answers PGRST202 when the function is not in its schema cache
+    return getattr(error, 'code', None) == 'PGRST202' or 'PGRST202' in str(error)
+
+
+def _delete_then_insert(client: Client, user_ids: List[str], rows: List[Dict]) -> Dict:
+    client.table('user_recommendations').delete().in_('user_id', user_ids).execute()
+    if rows:
+        client.table('user_recommendations').insert(rows).execute()
+    return {'deleted': 'all', 'written': len(rows), 'unchanged': 0}
+
+
+def replace_recommendations(client: Client, rows_by_user: Dict[str, List[Dict]]) -> Dict:
+    """
+    Replaces the recommendation set of every user in rows_by_user with one call.
+    Returns the RPC counters: deleted, written (inserted or changed), unchanged.
+    """
+    global _rpc_available
+    user_ids = list(rows_by_user)
+    rows = [row for user_rows in rows_by_user.values() for row in user_rows]
+
+    if _rpc_available:
+        try:
+            return client.rpc(REPLACE_RPC, {'p_user_ids': user_ids, 'p_rows': rows}).execute().data
+        except Exception as e:
+            if not _is_missing_function(e):
+                raise
+            _rpc_available = False
+            print(f"⚠️  RPC {REPLACE_RPC} not found, falling back to delete + insert "
+                  "(apply the Supabase migration to enable atomic replacement)")
+
+    return _delete_then_insert(client, user_ids, rows)
@@ -1,13 +1,18 @@
 import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from typing import Dict, List, Union
+from typing import Dict, List, Tuple, Union
+from cache_store import load_neighbors
 
 class SistemaRecomendacaoSimilaridade:
-    def __init__(self, embeddings: np.ndarray, dataset_source: Union[str, pd.DataFrame]):
+    def __init__(self, embeddings: np.ndarray, dataset_source: Union[str, pd.DataFrame],
+                 vizinhos: Union[Tuple[np.ndarray, np.ndarray], bool, None] = None):
         """
         Pure similarity-based recommendation system.
         For each rated movie, finds the K most similar ones.
+
+        vizinhos: precomputed neighbour table used to serve candidates without a
+        live search. By default cache_store.load_neighbors() (the table from
+        build_neighbors.py, if built and up to date); False always searches live.
         """
         print("Loading similarity recommendation system...")
         self.embeddings = embeddings
@@ -40,16 +45,37 @@ class SistemaRecomendacaoSimilaridade:
             for idx, movie_id in enumerate(self.bd['id'])
         }
         
+        # Normalized embedding matrix: cosine similarity becomes a plain matrix product
+        normas = np.linalg.norm(self.embeddings, axis=1, keepdims=True)
+        self.embeddings_norm = np.divide(
+            self.embeddings, normas,
+            out=np.zeros(self.embeddings.shape, dtype=np.float32),
+            where=normas > 0
+        ).astype(np.float32, copy=False)
+        self.ids = self.bd['id'].to_numpy()
+        
         # User state
         self.avaliacoes = {}
         self.filmes_vistos_ids = set()
+        self.mascara_vistos = np.zeros(len(self.bd), dtype=bool)
+        
+        # Precomputed neighbours (build_neighbors.py), ignored if stale
+        self.vizinhos_idx, self.vizinhos_sims = None, None
+        if vizinhos is None:
+            vizinhos = load_neighbors()
+        if vizinhos is not None and vizinhos is not False:
+            if len(vizinhos[0]) == len(self.bd):
+                self.vizinhos_idx, self.vizinhos_sims = vizinhos
+            else:
+                print("⚠️  Neighbour table does not match the catalogue (run build_neighbors.py). Using live search.")
         
         # Configuration
         self.k_por_filme = 3  # Top 3 similar per rated movie
         
         print(f"✅ System loaded!")
         print(f"   Total movies: {len(self.bd)}")
-        print(f"   Embedding dimensions: {self.embeddings.shape[1]}\n")
+        print(f"   Embedding dimensions: {self.embeddings.shape[1]}")
+        print(f"   Neighbour table: {'yes' if self.vizinhos_idx is not None else 'no'}\n")
     
     def set_user_data(self, avaliacoes_por_movie_id: Dict[int, float], 
                      filmes_vistos_ids: List[int]):
@@ -62,47 +88,75 @@ class SistemaRecomendacaoSimilaridade:
                 self.avaliacoes[idx] = float(rating)
         
         self.filmes_vistos_ids = set(int(mid) for mid in filmes_vistos_ids)
+        self.mascara_vistos = np.isin(self.ids, list(self.filmes_vistos_ids))
         self._perfil_usuario_cache = None  # Invalidate cache
         
         print(f"📊 User data loaded:")
         print(f"   Ratings: {len(self.avaliacoes)}")
         print(f"   Watched movies: {len(self.filmes_vistos_ids)}")
     
-    def _calcular_similaridades(self, idx_filme_avaliado: int) -> List[tuple]:
+    def _calcular_similaridades(self, indices_avaliados: List[int], k: int,
+                                bloco: int = 256) -> Tuple[np.ndarray, np.ndarray]:
         """
-        For a rated movie, calculates similarity with all non-watched ones.
-        Returns list of (idx_movie, similarity, title).
+        For every rated movie, finds the k most similar non-watched ones.
+        One matrix product per block of rated movies against the whole catalogue.
+        Returns (indices, similarities), both shaped [len(indices_avaliados), k],
+        each row sorted by similarity (highest first).
         """
-        emb_avaliado = self.embeddings[idx_filme_avaliado]
+        indices_avaliados = np.asarray(indices_avaliados, dtype=np.int64)
+        k = min(k, int((~self.mascara_vistos).sum()))
+        
+        top_idx = np.empty((len(indices_avaliados), k), dtype=np.int64)
+        top_sims = np.empty((len(indices_avaliados), k), dtype=np.float32)
+        if k == 0:
+            return top_idx, top_sims
         
-        similaridades = []
-        for idx in range(len(self.bd)):
-            movie_id = int(self.bd.iloc[idx]['id'])
+        for inicio in range(0, len(indices_avaliados), bloco):
+            linhas = indices_avaliados[inicio:inicio + bloco]
+            sims = self.embeddings_norm[linhas] @ self.embeddings_norm.T
             
             # Skip watched movies
-            if movie_id in self.filmes_vistos_ids:
-                continue
+            sims[:, self.mascara_vistos] = -np.inf
             
-            emb_candidato = self.embeddings[idx]
-            sim = cosine_similarity([emb_avaliado], [emb_candidato])[0][0]
+            # Top K without sorting the whole catalogue
+            parcial = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            parcial_sims = np.take_along_axis(sims, parcial, axis=1)
+            ordem = np.argsort(-parcial_sims, axis=1, kind='stable')
             
-            titulo = self.bd.iloc[idx].get('series_title', 'Unknown')
-            genero = self.bd.iloc[idx].get('genre', 'Unknown')
-            imdb = float(self.bd.iloc[idx].get('imdb_rating', 0.0))
-            
-            similaridades.append({
-                'idx': idx,
-                'movie_id': movie_id,
-                'similaridade': float(sim),
-                'titulo': titulo,
-                'genero': genero,
-                'imdb_rating': imdb
-            })
+            top_idx[inicio:inicio + len(linhas)] = np.take_along_axis(parcial, ordem, axis=1)
+            top_sims[inicio:inicio + len(linhas)] = np.take_along_axis(parcial_sims, ordem, axis=1)
+        
+        return top_idx, top_sims
+    
+    def _vizinhos_top_k(self, indices_avaliados: List[int], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top k non-watched neighbours per rated movie from the precomputed table.
+        Rated movies with fewer than k unseen neighbours in the table fall back to a live search.
+        Same return format as _calcular_similaridades.
+        """
+        if self.vizinhos_idx is None:
+            return self._calcular_similaridades(indices_avaliados, k)
+        
+        indices_avaliados = np.asarray(indices_avaliados, dtype=np.int64)
+        vizinhos = self.vizinhos_idx[indices_avaliados]
+        validos = ~self.mascara_vistos[vizinhos]
+        
+        suficientes = validos.sum(axis=1) >= k
+        # First k valid positions of every row, keeping the table order (best first)
+        posicoes = np.argsort(~validos, axis=1, kind='stable')[:, :k]
         
-        # Sort by similarity (highest first)
-        similaridades.sort(key=lambda x: x['similaridade'], reverse=True)
+        top_idx = np.take_along_axis(vizinhos, posicoes, axis=1).astype(np.int64)
+        top_sims = np.take_along_axis(self.vizinhos_sims[indices_avaliados], posicoes, axis=1).astype(np.float32)
         
-        return similaridades
+        if not suficientes.all():
+            # Too many neighbours already seen: live search for those rows only
+            faltam = np.flatnonzero(~suficientes)
+            live_idx, live_sims = self._calcular_similaridades(indices_avaliados[faltam], k)
+            top_idx[faltam, :live_idx.shape[1]] = live_idx
+            top_sims[faltam, :live_sims.shape[1]] = live_sims
+            print(f"   Live search for {len(faltam)}/{len(indices_avaliados)} rated movies")
+        
+        return top_idx, top_sims
     
     def gerar_recomendacoes(self, n: int = 50) -> List[Dict]:  # ✅ Default 50 now
         """
@@ -116,87 +170,59 @@ class SistemaRecomendacaoSimilaridade:
         print(f"   Method: Top-{self.k_por_filme} similar per rated movie")
         print(f"   Base movies: {len(self.avaliacoes)}")
         
-        # Dictionary to accumulate scores by movie
-        # movie_id -> {max_similarity, similarity_list, info}
-        candidatos = {}
+        top_idx, top_sims = self._vizinhos_top_k(list(self.avaliacoes.keys()), self.k_por_filme)
         
-        for idx_avaliado in self.avaliacoes.keys():
-            titulo_avaliado = self.bd.iloc[idx_avaliado].get('series_title', 'Unknown')
-            print(f"   Searching similar to: {titulo_avaliado}")
-            
-            similaridades = self._calcular_similaridades(idx_avaliado)
-            
-            # Get Top K
-            top_k = similaridades[:self.k_por_filme]
-            
-            for rec in top_k:
-                movie_id = rec['movie_id']
-                idx = rec['idx']
-                
-                if movie_id not in candidatos:
-                    candidatos[movie_id] = {
-                        'idx': idx,
-                        'movie_id': movie_id,
-                        'titulo': rec['titulo'],
-                        'genero': rec['genero'],
-                        'imdb_rating': rec['imdb_rating'],
-                        'similaridades': [],
-                        'max_sim': 0.0
-                    }
-                
-                candidatos[movie_id]['similaridades'].append(rec['similaridade'])
-                candidatos[movie_id]['max_sim'] = max(
-                    candidatos[movie_id]['max_sim'], 
-                    rec['similaridade']
-                )
+        # Accumulate scores by movie: every candidate index with its similarities
+        candidatos, inverso = np.unique(top_idx.ravel(), return_inverse=True)
+        sims = top_sims.ravel().astype(np.float64)
+        
+        count = np.bincount(inverso, minlength=len(candidatos))
+        avg_sim = np.bincount(inverso, weights=sims, minlength=len(candidatos)) / np.maximum(count, 1)
+        max_sim = np.zeros(len(candidatos))
+        np.maximum.at(max_sim, inverso, sims)
+        
+        # Final score: combines average, max and count
+        # Movies that appear multiple times (similar to several rated movies) are preferred
+        scores = (avg_sim * 0.5 + max_sim * 0.3) * (1 + count * 0.1)
+        
+        # Only the final top n rows get their metadata materialized
+        ordem = np.argsort(-scores, kind='stable')[:n]
         
-        # Converter para lista e calcular score final
         recomendacoes = []
-        for movie_id, info in candidatos.items():
-            # Score = média das similaridades (se apareceu múltiplas vezes, é muito relevante)
-            avg_sim = np.mean(info['similaridades'])
-            max_sim = info['max_sim']
-            count = len(info['similaridades'])
-            
-            # Final score: combines average, max and count
-            # Movies that appear multiple times (similar to several rated movies) are preferred
-            score = (avg_sim * 0.5 + max_sim * 0.3) * (1 + count * 0.1)
-            
-            # ✅ ADD COMPLETE METADATA FOR RAG
-            idx = info['idx']
+        for pos in ordem:
+            idx = int(candidatos[pos])
             row = self.bd.iloc[idx]
+            titulo = row.get('series_title', 'Unknown')
+            genero = row.get('genre', 'Unknown')
             
             recomendacoes.append({
-                'movie_id': movie_id,
-                'score': float(score),
-                'avg_similarity': float(avg_sim),
-                'max_similarity': float(max_sim),
-                'appears_for': count,
+                'movie_id': int(self.ids[idx]),
+                'score': float(scores[pos]),
+                'avg_similarity': float(avg_sim[pos]),
+                'max_similarity': float(max_sim[pos]),
+                'appears_for': int(count[pos]),
                 
                 # Original fields
-                'titulo': info['titulo'],
-                'genero': info['genero'],
-                'imdb_rating': info['imdb_rating'],
+                'titulo': titulo,
+                'genero': genero,
+                'imdb_rating': float(row.get('imdb_rating', 0.0)),
                 
                 # ✅ NEW FIELDS FOR RAG
-                'title': info['titulo'],  # Alias
-                'genre': info['genero'],  # Alias
+                'title': titulo,  # Alias
+                'genre': genero,  # Alias
                 'year': row.get('released_year', 'N/A'),
                 'origin_country': row.get('origin_country', 'N/A'),
                 'original_language': row.get('original_language', 'N/A'),
                 'overview': row.get('overview', 'N/A'),
             })
         
-        # Sort by score
-        recomendacoes.sort(key=lambda x: x['score'], reverse=True)
-        
-        print(f"✅ {len(recomendacoes)} recommendations generated")
+        print(f"✅ {len(candidatos)} recommendations generated")
         if recomendacoes:
             print(f"   Top score: {recomendacoes[0]['score']:.4f}")
             print(f"   Top title: {recomendacoes[0]['titulo']}")
         print(f"   Returning top {n}\n")
         
-        return recomendacoes[:n]
+        return recomendacoes
     
     def _get_popular_movies(self, n: int) -> List[Dict]:
         """Cold start: returns popular movies"""
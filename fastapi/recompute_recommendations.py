@@ -0,0 +1,202 @@
+"""
+🌙 Script para recalcular as recomendações de TODOS os utilizadores de uma vez
+
+Substitui milhares de chamadas a generate_and_save_recommendations (várias
+idas à rede por utilizador) por um job matricial:
+    1. user_movies é lido uma única vez (paginado)
+    2. vetores de gosto = avaliações (scipy.sparse, utilizadores x filmes) @ embeddings
+       / soma dos pesos, a mesma média ponderada do main.calculate_user_vector
+    3. scores de cosseno em blocos de utilizadores (bloco @ embeddings.T), filmes
+       já vistos mascarados, top-25 acima de 0.5 (semântica do match_movies)
+    4. user_recommendations atualizada em lotes grandes pelo RPC
+       replace_user_recommendations (só as linhas que mudaram são escritas)
+
+Usa o cache local (cache/embeddings.npy + movies), por isso EXECUTAR DEPOIS de
+export_cache.py ou regenerate_embeddings.py.
+
+Uso:
+    python recompute_recommendations.py              # recalcula e grava
+    python recompute_recommendations.py --dry-run    # só calcula e mostra o throughput
+"""
+import os
+import time
+import argparse
+import numpy as np
+import scipy.sparse as sp
+from dotenv import load_dotenv
+from supabase import create_client, Client
+from cache_store import cache_exists, load_embeddings, load_movies_cache
+from recommendation_store import TOP_N, recommendation_rows, replace_recommendations
+
+load_dotenv()
+
+MIN_RATINGS = 5
+MATCH_THRESHOLD = 0.5
+PAGE_SIZE = 1000
+USER_BLOCK = 256
+WRITE_USERS_PER_BATCH = 200  # 200 utilizadores x 25 = 5000 linhas por insert
+
+
+def get_client() -> Client:
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_SERVICE_KEY")
+    if not supabase_url or not supabase_key:
+        raise ValueError(
+            "❌ Variáveis de ambiente não configuradas!\n"
+            "Adicione ao arquivo FastApi/.env:\n"
+            "SUPABASE_URL=...\n"
+            "SUPABASE_SERVICE_KEY=..."
+        )
+    return create_client(supabase_url, supabase_key)
+
+
+def fetch_all_ratings(client: Client):
+    """
+    Todas as linhas de user_movies (user_id, movie_id, rating), página a página.
+    Paginação por chave (id > último id), como o export_cache: o custo de cada
+    página não cresce com o offset.
+    """
+    rows, last_id = [], None
+    while True:
+        query = client.table("user_movies").select("id, user_id, movie_id, rating")
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        page = query.order("id").limit(PAGE_SIZE).execute().data
+        if not page:
+            break
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            break
+        last_id = page[-1]['id']
+    return rows
+
+
+def build_rating_matrix(rows, movie_ids: np.ndarray):
+    """
+    Matriz esparsa utilizadores x filmes do catálogo com peso = rating.
+    Retorna (user_ids, pesos csr, vistos csr, nº de avaliações por utilizador).
+    Avaliações de filmes fora do catálogo contam para o mínimo, como no endpoint.
+    """
+    user_ids, user_rows = np.unique([r['user_id'] for r in rows], return_inverse=True)
+    row_of_movie = {int(m): i for i, m in enumerate(movie_ids)}
+    movie_cols = np.fromiter((row_of_movie.get(int(r['movie_id']), -1) for r in rows), dtype=np.int64, count=len(rows))
+    weights = np.fromiter((r['rating'] or 0 for r in rows), dtype=np.float32, count=len(rows))
+
+    rating_counts = np.bincount(user_rows, minlength=len(user_ids))
+    in_catalogue = movie_cols >= 0
+    shape = (len(user_ids), len(movie_ids))
+    seen = sp.csr_matrix(
+        (np.ones(in_catalogue.sum(), dtype=bool), (user_rows[in_catalogue], movie_cols[in_catalogue])), shape=shape
+    )
+    ratings = sp.csr_matrix(
+        (weights[in_catalogue], (user_rows[in_catalogue], movie_cols[in_catalogue])), shape=shape
+    )
+    return user_ids, ratings, seen, rating_counts
+
+
+def score_users(ratings: sp.csr_matrix, seen: sp.csr_matrix, embeddings: np.ndarray, eligible: np.ndarray,
+                block_size: int = USER_BLOCK):
+    """
+    Top-N por utilizador elegível. Gera (índice do utilizador, linhas dos filmes, similaridades).
+    """
+    norms = np.sqrt(np.einsum('ij,ij->i', embeddings, embeddings))
+    valid = norms > 0
+    unit = np.divide(embeddings, norms[:, None], out=np.zeros(embeddings.shape, dtype=np.float32), where=valid[:, None])
+
+    total_weight = np.asarray(ratings.sum(axis=1)).ravel()
+    users = np.flatnonzero(eligible & (total_weight > 0))
+
+    for start in range(0, len(users), block_size):
+        block = users[start:start + block_size]
+
+        # Vetor de gosto: média ponderada; só a direção conta para o cosseno
+        taste = np.asarray(ratings[block] @ embeddings, dtype=np.float32)
+        taste /= np.linalg.norm(taste, axis=1, keepdims=True) + 1e-12
+        sims = taste @ unit.T
+
+        sims[:, ~valid] = -np.inf
+        seen_block = seen[block].tocoo()
+        sims[seen_block.row, seen_block.col] = -np.inf
+
+        k = min(TOP_N, sims.shape[1])
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_sims = np.take_along_axis(top_sims, order, axis=1)
+
+        for i, user in enumerate(block):
+            keep = top_sims[i] > MATCH_THRESHOLD
+            yield user, top[i][keep], top_sims[i][keep]
+
+
+def write_recommendations(client: Client, recommendations: dict):
+    """Substitui os conjuntos de user_recommendations por lotes de utilizadores (uma chamada por lote)"""
+    user_ids = list(recommendations)
+    written = unchanged = 0
+    for start in range(0, len(user_ids), WRITE_USERS_PER_BATCH):
+        batch = user_ids[start:start + WRITE_USERS_PER_BATCH]
+        result = replace_recommendations(client, {user_id: recommendations[user_id] for user_id in batch})
+        written += result['written']
+        unchanged += result['unchanged']
+        print(f"   💾 {min(start + len(batch), len(user_ids))}/{len(user_ids)} utilizadores gravados")
+    print(f"   {written} linhas escritas, {unchanged} inalteradas")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recalcula user_recommendations para todos os utilizadores")
+    parser.add_argument("--dry-run", action="store_true", help="não grava no Supabase")
+    parser.add_argument("--block-size", type=int, default=USER_BLOCK, help="utilizadores por multiplicação matricial")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("🌙 RECALCULAR RECOMENDAÇÕES DE TODOS OS UTILIZADORES")
+    print("=" * 60)
+
+    if not cache_exists():
+        print("❌ Cache não encontrado! Execute: python export_cache.py")
+        return
+
+    movie_ids = load_movies_cache()['id'].astype(int).to_numpy()
+    embeddings = load_embeddings()
+    print(f"✅ Catálogo: {embeddings.shape}")
+
+    client = get_client()
+    start = time.time()
+    rows = fetch_all_ratings(client)
+    print(f"✅ {len(rows)} avaliações lidas em {time.time() - start:.1f}s")
+    if not rows:
+        return
+
+    user_ids, ratings, seen, rating_counts = build_rating_matrix(rows, movie_ids)
+    del rows
+    eligible = rating_counts >= MIN_RATINGS
+    print(f"👥 {len(user_ids)} utilizadores, {eligible.sum()} com pelo menos {MIN_RATINGS} avaliações")
+
+    score_start = time.time()
+    recommendations = {}
+    for user, movie_rows, sims in score_users(ratings, seen, embeddings, eligible, args.block_size):
+        if len(movie_rows) == 0:
+            continue  # como no endpoint: sem candidatos, as recomendações antigas ficam
+        recommendations[user_ids[user]] = recommendation_rows(user_ids[user], [
+            {'id': int(movie_ids[row]), 'similarity': float(sim)} for row, sim in zip(movie_rows, sims)
+        ])
+    score_time = time.time() - score_start
+    print(f"🧮 {len(recommendations)} utilizadores calculados em {score_time:.2f}s "
+          f"({len(recommendations) / score_time if score_time > 0 else 0:.0f} utilizadores/s)")
+
+    if args.dry_run:
+        print("🔎 --dry-run: nada foi gravado")
+    else:
+        write_start = time.time()
+        write_recommendations(client, recommendations)
+        write_time = time.time() - write_start
+        print(f"💾 Gravação: {write_time:.1f}s ({len(recommendations) / write_time if write_time > 0 else 0:.0f} utilizadores/s)")
+
+    total = time.time() - start
+    print(f"\n✅ CONCLUÍDO: {len(recommendations)} utilizadores em {total:.1f}s "
+          f"({len(recommendations) / total if total > 0 else 0:.0f} utilizadores/s no total)")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,75 +2,55 @@
 Versão OTIMIZADA com batch processing e rate limiting inteligente.
 
 Melhorias:
-- Rate limiter para TMDB (40 calls/10s)
-- Progress saving (resume capability)
+- Fetch concorrente do TMDB com rate limiter partilhado (40 calls/10s, tmdb_client.py)
+- Duas etapas: textos (TMDB) e depois encode em batches ordenados por tamanho
+- Incremental: só recodifica filmes cujo texto ou modelo mudou (embedding_hash)
+- Checkpoint crash-safe: memmap pré-alocado + log append-only (resume sem cópias)
 - Validação de API key antes de começar
 - Estatísticas em tempo real
 
 Uso:
     export TMDB_API_KEY="your_key_here"
-    python regenerate_embeddings_v3.py
+    export EMBED_BATCH_SIZE=64   # opcional
+    python regenerate_embeddings_v3.py [--upload]
 """
 import os
 import sys
 import pickle
 import time
+import hashlib
+import json
 import numpy as np
-import requests
-from collections import deque
+from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
+from tmdb_client import TMDBClient
+from checkpoint_store import EmbeddingCheckpoint, checkpoint_fingerprint, read_log_lines
+from cache_store import load_movies_cache, movies_cache_exists, save_movies_cache, stamp_manifest
+from user_vector_store import UserVectorStore
 
 load_dotenv()
 
 # Paths
 CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache")
-MOVIES_CACHE_PATH = os.path.join(CACHE_DIR, "movies.pkl")
 EMBEDDINGS_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.npy")
 TMDB_CACHE_PATH = os.path.join(CACHE_DIR, "tmdb_metadata.pkl")
-PROGRESS_PATH = os.path.join(CACHE_DIR, "progress.txt")
+TMDB_LOG_PATH = os.path.join(CACHE_DIR, "tmdb_metadata.log")
+PARTIAL_EMBEDDINGS_PATH = os.path.join(CACHE_DIR, "embeddings.partial.npy")
+CHECKPOINT_LOG_PATH = os.path.join(CACHE_DIR, "embeddings.partial.log")
+
+# Model / batching
+MODEL_NAME = 'BAAI/bge-large-en-v1.5'
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '64'))
+UPLOAD = '--upload' in sys.argv  # envia só os embeddings alterados para o Supabase
 
 # API
 TMDB_API_KEY = os.getenv('TMDB_API_KEY')
-TMDB_BASE_URL = "https://api.themoviedb.org/3"
-
-
-class TMDBRateLimiter:
-    """Rate limiter inteligente para TMDB API (40 calls / 10 segundos)"""
-    def __init__(self, max_calls=38, period=10):  # 38 para margem de segurança
-        self.calls = deque()
-        self.max_calls = max_calls
-        self.period = period
-        self.total_waits = 0
-        self.total_wait_time = 0
-    
-    def wait_if_needed(self):
-        now = time.time()
-        
-        # Remove chamadas antigas (fora da janela)
-        while self.calls and self.calls[0] < now - self.period:
-            self.calls.popleft()
-        
-        # Se chegou ao limite, espera
-        if len(self.calls) >= self.max_calls:
-            sleep_time = self.period - (now - self.calls[0]) + 0.1  # +0.1s margem
-            if sleep_time > 0:
-                self.total_waits += 1
-                self.total_wait_time += sleep_time
-                print(f"      ⏳ Rate limit - aguardando {sleep_time:.1f}s (wait #{self.total_waits})...")
-                time.sleep(sleep_time)
-        
-        self.calls.append(time.time())
-    
-    def get_stats(self):
-        return {
-            'total_waits': self.total_waits,
-            'total_wait_time': self.total_wait_time,
-            'calls_in_window': len(self.calls)
-        }
+TMDB_WORKERS = int(os.getenv('TMDB_WORKERS', '8'))
 
 
-def validate_tmdb_api():
+def validate_tmdb_api(client: TMDBClient):
     """Valida que a API key está configurada e funciona"""
     if not TMDB_API_KEY:
         print("❌ TMDB_API_KEY não configurada!")
@@ -83,9 +63,7 @@ def validate_tmdb_api():
     # Test API call
     print("🔑 Validando TMDB API key...")
     try:
-        url = f"{TMDB_BASE_URL}/movie/550"  # Fight Club
-        params = {'api_key': TMDB_API_KEY}
-        response = requests.get(url, params=params, timeout=5)
+        response = client.get_response("/movie/550")  # Fight Club
         
         if response.status_code == 401:
             print("❌ API Key inválida!")
@@ -104,19 +82,15 @@ def validate_tmdb_api():
         return False
 
 
-def fetch_tmdb_rich_metadata(title: str, year: int, rate_limiter: TMDBRateLimiter) -> dict:
-    """Fetch TMDB metadata com rate limiting"""
+def fetch_tmdb_rich_metadata(title: str, year: int, client: TMDBClient) -> dict:
+    """Fetch TMDB metadata (search + details, ambos pelo rate limiter partilhado)"""
     try:
-        # Rate limiting
-        rate_limiter.wait_if_needed()
-        
         # Search
-        search_url = f"{TMDB_BASE_URL}/search/movie"
-        params = {'api_key': TMDB_API_KEY, 'query': title}
+        params = {'query': title}
         if year:
             params['year'] = year
         
-        response = requests.get(search_url, params=params, timeout=5)
+        response = client.get_response("/search/movie", **params)
         if response.status_code != 200:
             return {}
         
@@ -126,16 +100,8 @@ def fetch_tmdb_rich_metadata(title: str, year: int, rate_limiter: TMDBRateLimite
         
         movie_id = results[0]['id']
         
-        # Details (outra chamada, precisa de rate limit)
-        rate_limiter.wait_if_needed()
-        
-        details_url = f"{TMDB_BASE_URL}/movie/{movie_id}"
-        params = {
-            'api_key': TMDB_API_KEY,
-            'append_to_response': 'keywords,credits'
-        }
-        
-        response = requests.get(details_url, params=params, timeout=5)
+        # Details
+        response = client.get_response(f"/movie/{movie_id}", append_to_response='keywords,credits')
         if response.status_code != 200:
             return {}
         
@@ -243,20 +209,222 @@ def build_semantic_embedding_text(row, tmdb_data: dict = None) -> str:
     return '\n'.join(parts)
 
 
-def save_progress(index: int):
-    """Salva progresso para resume capability"""
-    with open(PROGRESS_PATH, 'w') as f:
-        f.write(str(index))
+def load_tmdb_cache() -> dict:
+    """Carrega o cache TMDB: último snapshot (pickle) + entradas do log append-only"""
+    tmdb_cache = {}
+    if os.path.exists(TMDB_CACHE_PATH):
+        tmdb_cache = pickle.load(open(TMDB_CACHE_PATH, 'rb'))
+    if os.path.exists(TMDB_LOG_PATH):
+        # Corta a última linha se um crash a deixou a meio, antes de voltar a acrescentar ao log
+        for line in read_log_lines(TMDB_LOG_PATH):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            tmdb_cache[entry['key']] = entry['data']
+    return tmdb_cache
+
+
+def compact_tmdb_cache(tmdb_cache: dict):
+    """Grava o snapshot completo do cache TMDB e limpa o log"""
+    pickle.dump(tmdb_cache, open(TMDB_CACHE_PATH, 'wb'))
+    if os.path.exists(TMDB_LOG_PATH):
+        os.remove(TMDB_LOG_PATH)
+
+
+def _row_title_year(row):
+    title = row.get('series_title', '')
+    year = row.get('released_year', None)
+    if year:
+        try:
+            year = int(year)
+        except (ValueError, TypeError):
+            year = None
+    return title, year
+
+
+def build_embedding_texts(df, tmdb_cache: dict, client: TMDBClient) -> Tuple[List[str], Dict[str, int]]:
+    """
+    Etapa 1: metadados TMDB + texto semântico de cada filme (na ordem do DataFrame).
+    Os filmes que não estão no tmdb_cache são buscados em paralelo pelo TMDBClient.
+    Cada metadado novo é acrescentado ao log do cache TMDB, por isso um rerun só busca o que falta.
+    Retorna (textos, stats) com stats = {'tmdb_fetched', 'tmdb_hits'}.
+    """
+    rows = [_row_title_year(row) for _, row in df.iterrows()]
+    
+    # Cache misses (sem duplicados)
+    missing = list(dict.fromkeys(
+        (title, year) for title, year in rows
+        if title and f"{title}_{year}" not in tmdb_cache
+    ))
+    tmdb_hits = sum(1 for title, year in rows if f"{title}_{year}" in tmdb_cache)
+    tmdb_fetched = 0
+    
+    print(f"   TMDB: {tmdb_hits} em cache, {len(missing)} para buscar ({client.max_workers} workers)")
+    start_time = time.time()
+    
+    results = client.map(lambda key: fetch_tmdb_rich_metadata(key[0], key[1], client), missing)
+    tmdb_log = open(TMDB_LOG_PATH, 'a', encoding='utf-8')
+    for i, ((title, year), tmdb_data) in enumerate(zip(missing, results)):
+        if tmdb_data and tmdb_data.get('tmdb_id'):
+            cache_key = f"{title}_{year}"
+            tmdb_cache[cache_key] = tmdb_data
+            tmdb_fetched += 1
+            
+            # Checkpoint O(1): só a entrada nova vai para o log
+            tmdb_log.write(json.dumps({'key': cache_key, 'data': tmdb_data}) + '\n')
+            tmdb_log.flush()
+        
+        # Progress (a cada 25 filmes)
+        if (i + 1) % 25 == 0:
+            elapsed = time.time() - start_time
+            rate = (i + 1) / elapsed if elapsed > 0 else 0
+            eta_mins = (len(missing) - i - 1) / rate / 60 if rate > 0 else 0
+            
+            print(f"   ✓ {i + 1}/{len(missing)} | "
+                  f"TMDB: {tmdb_fetched} new | "
+                  f"Rate: {rate:.1f} films/s | "
+                  f"ETA: {eta_mins:.1f}min")
+    
+    tmdb_log.close()
+    
+    # Build texts
+    texts = []
+    for (title, year), (_, row) in zip(rows, df.iterrows()):
+        try:
+            tmdb_data = tmdb_cache.get(f"{title}_{year}") if title else None
+            texts.append(build_semantic_embedding_text(row, tmdb_data))
+        except Exception as e:
+            print(f"❌ Erro: {e}")
+            texts.append('')
+    
+    stats = {'tmdb_fetched': tmdb_fetched, 'tmdb_hits': tmdb_hits}
+    return texts, stats
+
+
+def embedding_hash(text: str, model_name: str = MODEL_NAME) -> str:
+    """Hash do texto de embedding + modelo: se nenhum dos dois mudou, o embedding também não"""
+    return hashlib.sha1(f"{model_name}\n{text}".encode('utf-8')).hexdigest()
+
+
+def find_changed_rows(df, hashes: list, existing: np.ndarray) -> np.ndarray:
+    """
+    Linhas que precisam de novo encode: texto ou modelo diferente do cache atual.
+    Sem embeddings.npy alinhado com o DataFrame, todas as linhas mudaram.
+    """
+    if existing is None or len(existing) != len(df):
+        return np.arange(len(df))
+    
+    if 'embedding_hash' in df.columns:
+        old_hashes = df['embedding_hash'].fillna('').to_numpy()
+    elif 'embedding_input' in df.columns:
+        # Cache antigo sem hash: assume que os embeddings atuais vieram deste modelo
+        # (a dimensão é verificada depois de carregar o modelo)
+        old_hashes = np.array([
+            embedding_hash(t) if isinstance(t, str) and t else ''
+            for t in df['embedding_input']
+        ])
+    else:
+        return np.arange(len(df))
+    
+    return np.flatnonzero(old_hashes != np.asarray(hashes))
+
+
+def upload_changed_embeddings(df, embeddings: np.ndarray, rows: np.ndarray):
+    """
+    Envia para o Supabase só os filmes recodificados (embedding + embedding_input).
+    Linhas sem hash (texto vazio) têm embedding zero e não são enviadas,
+    para não sobrescrever o embedding bom que está no pgvector.
+    """
+    valid = df['embedding_hash'].to_numpy()[rows] != ''
+    skipped = rows[~valid]
+    rows = rows[valid]
+    if len(skipped):
+        print(f"   ⚠️  {len(skipped)} filmes sem embedding válido não serão enviados "
+              f"(ids: {', '.join(str(i) for i in df['id'].iloc[skipped[:10]])}{'...' if len(skipped) > 10 else ''})")
+    if len(rows) == 0:
+        return
+    
+    from supabase import create_client
+    supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_KEY"))
+    
+    def update_row(row):
+        try:
+            supabase.table('movies').update({
+                'embedding': embeddings[row].tolist(),
+                'embedding_input': df['embedding_input'].iloc[row],
+            }).eq('id', int(df['id'].iloc[row])).execute()
+            return True
+        except Exception as e:
+            print(f"   ❌ Erro ao enviar filme {df['id'].iloc[row]}: {e}")
+            return False
+    
+    print(f"🚀 Enviando {len(rows)} embeddings alterados para o Supabase...")
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        ok = list(executor.map(update_row, rows))
+    print(f"   ✅ {sum(ok)}/{len(rows)} filmes atualizados")
+    
+    # Vetores de gosto em cache que somam um embedding antigo deixam de valer
+    uploaded_ids = df['id'].to_numpy()[rows[np.asarray(ok, dtype=bool)]]
+    stale_users = UserVectorStore().invalidate_movies(uploaded_ids)
+    print(f"   🧮 {stale_users} vetores de utilizador invalidados (user_vectors.sqlite)")
 
 
-def load_progress() -> int:
-    """Carrega progresso anterior"""
-    if os.path.exists(PROGRESS_PATH):
+def encode_texts(model, texts: list, hashes: list, checkpoint: EmbeddingCheckpoint,
+                 batch_size: int, rows: np.ndarray) -> int:
+    """
+    Etapa 2: encode em batches, ordenados por tamanho do texto (menos padding).
+    Cada batch é escrito diretamente nas suas linhas do checkpoint (memmap) e
+    registado no log, por isso um crash só perde o batch em curso.
+    
+    Textos vazios ficam com embedding zero e hash vazio. Batches com erro não
+    são escritos nem registados: as linhas mantêm o embedding anterior e voltam
+    a ser tentadas no próximo run. Retorna o nº de filmes codificados.
+    """
+    lengths = np.array([len(t) for t in texts])
+    order = np.asarray(rows, dtype=np.int64)
+    order = order[np.argsort(-lengths[order], kind='stable')]
+    
+    empty = order[lengths[order] == 0]
+    if len(empty):
+        checkpoint.write(empty, 0.0, [''] * len(empty))
+    order = order[lengths[order] > 0]
+    
+    start_time = time.time()
+    encoded = failed = 0
+    
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
         try:
-            return int(open(PROGRESS_PATH).read().strip())
-        except:
-            return 0
-    return 0
+            vectors = model.encode(
+                [texts[r] for r in batch],
+                batch_size=len(batch),
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+        except Exception as e:
+            print(f"❌ Erro no batch {start // batch_size}: {e}")
+            failed += len(batch)
+        else:
+            checkpoint.write(batch, vectors, [hashes[r] for r in batch])
+            encoded += len(batch)
+        position = start + len(batch)
+        
+        # Progress
+        if position // batch_size % 10 == 0 or position == len(order):
+            elapsed = time.time() - start_time
+            rate = encoded / elapsed if elapsed > 0 else 0
+            eta_mins = (len(order) - position) / rate / 60 if rate > 0 else 0
+            print(f"   ✓ {position}/{len(order)} | Rate: {rate:.1f} films/s | ETA: {eta_mins:.1f}min")
+    
+    # Validação Zero Input
+    zero_rows = sum(1 for h in checkpoint.done.values() if not h)
+    if zero_rows:
+        print(f"      ⚠️  Warning: {zero_rows} embeddings zero")
+    if failed:
+        print(f"      ⚠️  Warning: {failed} filmes com erro no encode (mantêm o embedding anterior)")
+    
+    return encoded
 
 
 def main():
@@ -266,171 +434,120 @@ def main():
     print()
     
     # Validate API
-    if not validate_tmdb_api():
+    client = TMDBClient(TMDB_API_KEY, max_workers=TMDB_WORKERS)
+    if not validate_tmdb_api(client):
         return
     
     print()
     
     # Load data
     print("📥 Carregando dados...")
-    if not os.path.exists(MOVIES_CACHE_PATH):
+    if not movies_cache_exists():
         print("❌ Cache não encontrado! Execute: python export_cache.py")
         return
     
-    df = pickle.load(open(MOVIES_CACHE_PATH, 'rb'))
+    df = load_movies_cache()
     print(f"✅ {len(df)} filmes")
     
     # Load TMDB cache
-    tmdb_cache = {}
-    if os.path.exists(TMDB_CACHE_PATH):
-        tmdb_cache = pickle.load(open(TMDB_CACHE_PATH, 'rb'))
+    tmdb_cache = load_tmdb_cache()
+    if tmdb_cache:
         print(f"📦 {len(tmdb_cache)} metadados TMDB em cache")
     
-    # Check progress
-    start_idx = load_progress()
-    if start_idx > 0:
-        print(f"📍 Retomando do filme #{start_idx}")
-        response = input("   Continuar de onde parou? (y/n): ")
-        if response.lower() != 'y':
-            start_idx = 0
-            save_progress(0)
-    
     print()
     
-    # Load model
-    print("📥 Carregando modelo...")
-    model = SentenceTransformer('BAAI/bge-large-en-v1.5')
-    print("✅ BAAI/bge-large-en-v1.5")
+    # Etapa 1: textos
+    print(f"📝 Etapa 1/2: Construindo textos para {len(df)} filmes...")
+    start_time = time.time()
+    texts, stats = build_embedding_texts(df, tmdb_cache, client)
+    texts_time = time.time() - start_time
+    print(f"✅ Textos prontos ({texts_time/60:.1f} minutos)")
     print()
     
-    # Initialize
-    rate_limiter = TMDBRateLimiter()
-    new_embeddings = []
-    new_embedding_inputs = []
-    
-    # Se está a resumir, carrega embeddings anteriores
-    if start_idx > 0 and os.path.exists(EMBEDDINGS_CACHE_PATH):
-        try:
-            prev_embeddings = np.load(EMBEDDINGS_CACHE_PATH)
-            new_embeddings = prev_embeddings[:start_idx].tolist()
-            
-            prev_df = pickle.load(open(MOVIES_CACHE_PATH, 'rb'))
-            if 'embedding_input' in prev_df.columns:
-                new_embedding_inputs = prev_df['embedding_input'].iloc[:start_idx].tolist()
-            print(f"   ✅ Carregados {len(new_embeddings)} embeddings anteriores")
-        except Exception as e:
-            print(f"   ⚠️  Erro ao carregar checkpoint anterior: {e}")
-            print(f"   ⚠️  Recomeçando do zero...")
-            new_embeddings = []
-            new_embedding_inputs = []
-            start_idx = 0
-            save_progress(0)
-    
-    # Stats
-    tmdb_fetched = 0
-    tmdb_hits = 0
-    start_time = time.time()
+    # Incremental: só codifica o que mudou (hash do texto + modelo)
+    hashes = [embedding_hash(t) if t else '' for t in texts]
+    existing = np.load(EMBEDDINGS_CACHE_PATH, mmap_mode='r') if os.path.exists(EMBEDDINGS_CACHE_PATH) else None
+    changed = find_changed_rows(df, hashes, existing)
+    print(f"🔎 {len(changed)}/{len(df)} filmes com texto ou modelo alterado")
     
-    print(f"⚙️  Processando {len(df) - start_idx} filmes...")
-    print(f"   (Estimativa: ~{(len(df) - start_idx) * 0.5 / 60:.1f} minutos com rate limiting)")
+    if len(changed) == 0:
+        print("✅ Nada para codificar, embeddings já atualizados!")
+        compact_tmdb_cache(tmdb_cache)
+        return
     print()
     
-    # Process
-    for i, (idx, row) in enumerate(df.iloc[start_idx:].iterrows(), start=start_idx):
-        try:
-            title = row.get('series_title', '')
-            year = row.get('released_year', None)
-            if year:
-                try:
-                    year = int(year)
-                except (ValueError, TypeError):
-                    year = None
-            
-            # TMDB metadata
-            tmdb_data = None
-            cache_key = f"{title}_{year}"
-            
-            if cache_key in tmdb_cache:
-                tmdb_data = tmdb_cache[cache_key]
-                tmdb_hits += 1
-            elif title:
-                tmdb_data = fetch_tmdb_rich_metadata(title, year, rate_limiter)
-                if tmdb_data and tmdb_data.get('tmdb_id'):
-                    tmdb_cache[cache_key] = tmdb_data
-                    tmdb_fetched += 1
-            
-            # Build text
-            enriched_text = build_semantic_embedding_text(row, tmdb_data)
-            
-            # Generate embedding
-            embedding = model.encode(enriched_text).tolist()
-            
-            # Validação Zero Input
-            if all(v == 0 for v in embedding):
-                print(f"      ⚠️  Warning: Embedding zero para '{title}'")
-            
-            new_embeddings.append(embedding)
-            new_embedding_inputs.append(enriched_text)
-            
-            # Progress (a cada 25 filmes)
-            if (i + 1) % 25 == 0:
-                elapsed = time.time() - start_time
-                rate = (i + 1 - start_idx) / elapsed if elapsed > 0 else 0
-                eta_seconds = (len(df) - i - 1) / rate if rate > 0 else 0
-                eta_mins = eta_seconds / 60
-                
-                rl_stats = rate_limiter.get_stats()
-                
-                print(f"   ✓ {i + 1}/{len(df)} | "
-                      f"TMDB: {tmdb_fetched} new, {tmdb_hits} cached | "
-                      f"Rate: {rate:.1f} films/s | "
-                      f"ETA: {eta_mins:.1f}min")
-                
-                # Save progress
-                save_progress(i + 1)
-                
-                # Save intermediate results (a cada 100)
-                if (i + 1) % 100 == 0:
-                    print(f"      💾 Salvando checkpoint...")
-                    embeddings_array = np.array(new_embeddings, dtype=np.float32)
-                    np.save(EMBEDDINGS_CACHE_PATH, embeddings_array)
-                    # Handle size mismatch if checkpoints happen
-                    # Fill remainder with empty
-                    remaining = len(df) - len(new_embedding_inputs)
-                    df['embedding_input'] = new_embedding_inputs + [''] * remaining
-                    pickle.dump(df, open(MOVIES_CACHE_PATH, 'wb'))
-                    pickle.dump(tmdb_cache, open(TMDB_CACHE_PATH, 'wb'))
-            
-        except Exception as e:
-            print(f"❌ Erro: {e}")
-            new_embeddings.append([0.0] * 768)
-            new_embedding_inputs.append('')
+    # Load model
+    print("📥 Carregando modelo...")
+    model = SentenceTransformer(MODEL_NAME)
+    dim = model.get_sentence_embedding_dimension()
+    print(f"✅ {MODEL_NAME} ({dim} dims)")
+    print()
     
-    # Final save
+    shape = (len(df), dim)
+    reuse_existing = existing is not None and existing.shape == shape and existing.dtype == np.float32
+    if existing is not None and not reuse_existing:
+        print(f"⚠️  Embeddings atuais {existing.shape} incompatíveis com o modelo, recodificando tudo")
+        changed = np.arange(len(df))
+    del existing
+    
+    # Checkpoint: retoma o mesmo job (mesmos filmes, textos e modelo) se existir
+    fingerprint = checkpoint_fingerprint(shape, MODEL_NAME, changed, hashes)
+    checkpoint = EmbeddingCheckpoint.resume(PARTIAL_EMBEDDINGS_PATH, CHECKPOINT_LOG_PATH, fingerprint)
+    if checkpoint is not None and checkpoint.done:
+        print(f"📍 Checkpoint encontrado: {len(checkpoint.done)}/{len(changed)} filmes já codificados")
+        response = input("   Continuar de onde parou? (y/n): ")
+        if response.lower() != 'y':
+            checkpoint.discard()
+            checkpoint = None
+    if checkpoint is None:
+        checkpoint = EmbeddingCheckpoint.create(
+            PARTIAL_EMBEDDINGS_PATH, CHECKPOINT_LOG_PATH, shape, fingerprint,
+            initial_path=EMBEDDINGS_CACHE_PATH if reuse_existing else None
+        )
+    
+    remaining = np.array([r for r in changed if int(r) not in checkpoint.done], dtype=np.int64)
+    
+    # Etapa 2: encode em batches
+    print(f"🧠 Etapa 2/2: Encode de {len(remaining)} filmes em batches de {EMBED_BATCH_SIZE}...")
+    start_time = time.time()
+    encoded = encode_texts(model, texts, hashes, checkpoint, EMBED_BATCH_SIZE, remaining)
+    encode_time = time.time() - start_time
+    
+    # Hash final de cada linha recodificada. Se o batch falhou, a linha mantém o
+    # embedding e o hash anteriores e volta a ser tentada no próximo run
+    if reuse_existing and 'embedding_hash' in df.columns:
+        previous = df['embedding_hash'].fillna('').tolist()
+    else:
+        previous = [''] * len(df)
+    encoded_rows = np.array([r for r in changed if int(r) in checkpoint.done], dtype=np.int64)
+    for row in changed:
+        hashes[row] = checkpoint.done.get(int(row), previous[row])
+    
+    # Final save (uma única escrita do DataFrame e do cache TMDB)
     print(f"\n💾 Salvando resultados finais...")
-    embeddings_array = np.array(new_embeddings, dtype=np.float32)
-    np.save(EMBEDDINGS_CACHE_PATH, embeddings_array)
+    checkpoint.finalize(EMBEDDINGS_CACHE_PATH)
     
-    df['embedding_input'] = new_embedding_inputs
-    pickle.dump(df, open(MOVIES_CACHE_PATH, 'wb'))
-    pickle.dump(tmdb_cache, open(TMDB_CACHE_PATH, 'wb'))
+    df['embedding_input'] = texts
+    df['embedding_hash'] = hashes
+    save_movies_cache(df)
+    stamp_manifest(len(df))
+    compact_tmdb_cache(tmdb_cache)
     
-    # Remove progress file
-    if os.path.exists(PROGRESS_PATH):
-        os.remove(PROGRESS_PATH)
+    if UPLOAD:
+        upload_changed_embeddings(df, np.load(EMBEDDINGS_CACHE_PATH, mmap_mode='r'), encoded_rows)
     
     # Stats
-    total_time = time.time() - start_time
-    rl_stats = rate_limiter.get_stats()
+    rl_stats = client.limiter.get_stats()
     
     print(f"\n✅ CONCLUÍDO!")
     print(f"\n📊 Estatísticas:")
-    print(f"   Total processado: {len(new_embeddings)}")
-    print(f"   TMDB novos: {tmdb_fetched}")
-    print(f"   TMDB cache hits: {tmdb_hits}")
-    print(f"   Taxa TMDB: {(tmdb_fetched+tmdb_hits)/len(df)*100:.1f}%")
-    print(f"   Tempo total: {total_time/60:.1f} minutos")
-    print(f"   Rate limiter: {rl_stats['total_waits']} waits, {rl_stats['total_wait_time']/60:.1f}min waiting")
+    print(f"   Total processado: {len(df)} ({len(changed)} recodificados)")
+    print(f"   TMDB novos: {stats['tmdb_fetched']}")
+    print(f"   TMDB cache hits: {stats['tmdb_hits']}")
+    print(f"   Taxa TMDB: {(stats['tmdb_fetched']+stats['tmdb_hits'])/len(df)*100:.1f}%")
+    print(f"   Tempo textos: {texts_time/60:.1f} minutos")
+    print(f"   Tempo encode: {encode_time/60:.1f} minutos ({encoded / encode_time if encode_time > 0 else 0:.1f} films/s)")
+    print(f"   Rate limiter: {rl_stats['total_calls']} calls, {rl_stats['total_waits']} waits, {rl_stats['total_wait_time']/60:.1f}min waiting")
     print(f"\n🧪 Teste agora: python debug/test_embeddings.py")
 
 
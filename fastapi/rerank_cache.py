@@ -0,0 +1,159 @@
+"""
+Cache in front of RagService.rerank.
+
+The key hashes the model, the formatted liked-history and the candidate ids, so
+a user whose history and pgvector candidates did not change gets the previous
+ranking back without a Groq call. Entries expire after a TTL and the least
+recently used ones are evicted beyond max_entries.
+
+    RERANK_CACHE=memory      "memory" (per worker, default), "sqlite" (cache/rerank_cache.sqlite,
+                             shared by the workers and kept across restarts) or "off"
+    RERANK_CACHE_TTL=3600    seconds
+    RERANK_CACHE_SIZE=1000   entries
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+from cache_store import CACHE_DIR
+
+RERANK_CACHE_DB_PATH = os.path.join(CACHE_DIR, "rerank_cache.sqlite")
+
+# Bump when the rerank prompt or the stored format changes
+RERANK_CACHE_VERSION = "2"
+
+
+def rerank_cache_key(model: str, history_text: str, candidate_ids: Iterable) -> str:
+    """Stable key: the candidate order does not matter, only the set"""
+    ids = ",".join(sorted(str(i) for i in candidate_ids))
+    payload = f"{RERANK_CACHE_VERSION}|{model}|{history_text}|{ids}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class RerankCache:
+    """TTL + LRU cache of reranked lists; backends implement _get / _set"""
+
+    def __init__(self, ttl: float = 3600, max_entries: int = 1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Callers mutate the candidate dicts: always hand out a fresh copy
+        return json.loads(value)
+
+    def set(self, key: str, reranked: List[Dict]):
+        self._set(key, json.dumps(reranked))
+
+    def stats(self) -> Dict:
+        return {'backend': self.backend, 'entries': len(self), 'hits': self.hits, 'misses': self.misses}
+
+
+class MemoryRerankCache(RerankCache):
+    backend = "memory"
+
+    def __init__(self, ttl: float = 3600, max_entries: int = 1000):
+        super().__init__(ttl, max_entries)
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, json)
+
+    def _get(self, key: str) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def _set(self, key: str, value: str):
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SqliteRerankCache(RerankCache):
+    backend = "sqlite"
+
+    def __init__(self, path: str = RERANK_CACHE_DB_PATH, ttl: float = 3600, max_entries: int = 1000):
+        super().__init__(ttl, max_entries)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS rerank_cache (
+                key        TEXT PRIMARY KEY,
+                value      TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                used_at    REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS rerank_cache_used_at ON rerank_cache (used_at)")
+        self.conn.commit()
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, expires_at FROM rerank_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            expired = row[1] < now
+            if expired:
+                self.conn.execute("DELETE FROM rerank_cache WHERE key = ?", (key,))
+            else:
+                self.conn.execute("UPDATE rerank_cache SET used_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+        return None if expired else row[0]
+
+    def _set(self, key: str, value: str):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO rerank_cache VALUES (?, ?, ?, ?)", (key, value, now + self.ttl, now)
+            )
+            self.conn.execute("DELETE FROM rerank_cache WHERE expires_at < ?", (now,))
+            # LRU: keep only the max_entries most recently used
+            self.conn.execute("""
+                DELETE FROM rerank_cache WHERE key IN (
+                    SELECT key FROM rerank_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+            self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM rerank_cache").fetchone()[0]
+
+
+def build_rerank_cache() -> Optional[RerankCache]:
+    """Backend chosen by RERANK_CACHE (None when "off")"""
+    backend = os.getenv("RERANK_CACHE", "memory").lower()
+    ttl = float(os.getenv("RERANK_CACHE_TTL", "3600"))
+    max_entries = int(os.getenv("RERANK_CACHE_SIZE", "1000"))
+    if backend == "off":
+        return None
+    if backend == "sqlite":
+        return SqliteRerankCache(ttl=ttl, max_entries=max_entries)
+    if backend != "memory":
+        raise ValueError(f"Unknown RERANK_CACHE backend: {backend} (use memory, sqlite or off)")
+    return MemoryRerankCache(ttl=ttl, max_entries=max_entries)
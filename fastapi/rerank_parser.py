@@ -0,0 +1,94 @@
+"""
+Tolerant parsing of the reranker's answer.
+
+The rerank call asks for JSON mode ({"recommendations": [...]}), so the fast
+path is a single json.loads. When that fails (the answer was cut by max_tokens,
+has trailing text, or comes from a model without JSON mode), the array is
+walked element by element with JSONDecoder.raw_decode. Every object that was
+complete before the first broken one is kept, instead of throwing the whole
+LLM answer away.
+"""
+import re
+import json
+from typing import Any, List, Optional, Tuple
+
+OK = "ok"
+SALVAGED = "salvaged"
+FAILED = "failed"
+
+_decoder = json.JSONDecoder()
+_RECOMMENDATIONS_ARRAY = re.compile(r'"recommendations"\s*:\s*\[')
+
+
+def _decisions_of(data: Any) -> Optional[List]:
+    if isinstance(data, dict) and isinstance(data.get('recommendations'), list):
+        return data['recommendations']
+    if isinstance(data, list):
+        return data
+    return None
+
+
+def _strip_line_comments(text: str) -> str:
+    """Drops // comments outside of strings (old free-form answers sometimes carry them)"""
+    lines = []
+    for line in text.split('\n'):
+        in_string = escaped = False
+        for i, ch in enumerate(line):
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = in_string
+            elif ch == '"':
+                in_string = not in_string
+            elif ch == '/' and not in_string and line[i + 1:i + 2] == '/':
+                line = line[:i]
+                break
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def _array_start(text: str) -> Optional[int]:
+    match = _RECOMMENDATIONS_ARRAY.search(text)
+    if match:
+        return match.end() - 1
+    start = text.find('[')
+    return start if start >= 0 else None
+
+
+def salvage_array(text: str, start: int) -> List:
+    """Complete elements of the JSON array opening at text[start], up to the first one that does not parse"""
+    items = []
+    pos = start + 1
+    while True:
+        while pos < len(text) and text[pos] in ' \t\r\n,':
+            pos += 1
+        if pos >= len(text) or text[pos] == ']':
+            return items
+        try:
+            item, pos = _decoder.raw_decode(text, pos)
+        except ValueError:
+            return items  # truncated / malformed element: keep what was complete before it
+        items.append(item)
+
+
+def parse_rerank_decisions(text: str) -> Tuple[List[Any], str]:
+    """(decisions, outcome): outcome is OK (whole answer parsed), SALVAGED or FAILED"""
+    if not text or not text.strip():
+        return [], FAILED
+
+    try:
+        decisions = _decisions_of(json.loads(text))
+    except ValueError:
+        decisions = None
+    if decisions is not None:
+        return decisions, OK
+
+    # A // comment between elements stops the raw walk early: keep whichever variant yields more
+    best = []
+    for variant in (_strip_line_comments(text), text):
+        start = _array_start(variant)
+        if start is not None:
+            items = salvage_array(variant, start)
+            if len(items) > len(best):
+                best = items
+    return (best, SALVAGED) if best else ([], FAILED)
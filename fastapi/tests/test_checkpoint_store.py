@@ -0,0 +1,39 @@
+import numpy as np
+
+from checkpoint_store import EmbeddingCheckpoint, read_log_lines
+
+
+def _crash(checkpoint, log_path):
+    """Simulates a crash in the middle of a log append: a torn last line, no close()"""
+    with open(log_path, 'a', encoding='utf-8') as f:
+        f.write('{"rows": [9, 1')
+    del checkpoint
+
+
+def test_resume_after_repeated_crashes_keeps_every_batch(tmp_path):
+    data_path, log_path = str(tmp_path / "partial.npy"), str(tmp_path / "partial.log")
+    checkpoint = EmbeddingCheckpoint.create(data_path, log_path, (6, 2), "job")
+    checkpoint.write([0, 1], np.ones((2, 2)), ["a", "b"])
+    _crash(checkpoint, log_path)
+
+    checkpoint = EmbeddingCheckpoint.resume(data_path, log_path, "job")
+    assert checkpoint.done == {0: "a", 1: "b"}
+    checkpoint.write([2, 3], np.full((2, 2), 2.0), ["c", "d"])
+    _crash(checkpoint, log_path)
+
+    checkpoint = EmbeddingCheckpoint.resume(data_path, log_path, "job")
+    assert checkpoint.done == {0: "a", 1: "b", 2: "c", 3: "d"}
+    assert checkpoint.matrix[3].tolist() == [2.0, 2.0]
+
+
+def test_resume_rejects_another_job(tmp_path):
+    data_path, log_path = str(tmp_path / "partial.npy"), str(tmp_path / "partial.log")
+    EmbeddingCheckpoint.create(data_path, log_path, (2, 2), "job")
+    assert EmbeddingCheckpoint.resume(data_path, log_path, "other job") is None
+
+
+def test_read_log_lines_truncates_torn_tail(tmp_path):
+    path = tmp_path / "log.jsonl"
+    path.write_text('{"a": 1}\n{"b": 2}\n{"c"')
+    assert read_log_lines(str(path)) == ['{"a": 1}', '{"b": 2}']
+    assert path.read_text() == '{"a": 1}\n{"b": 2}\n'
@@ -0,0 +1,27 @@
+from rerank_parser import FAILED, OK, SALVAGED, parse_rerank_decisions
+
+
+def test_json_mode_answer():
+    assert parse_rerank_decisions('{"recommendations": [{"index": 1}]}') == ([{"index": 1}], OK)
+
+
+def test_truncated_answer_keeps_complete_items():
+    text = '{"recommendations": [{"index": 0, "reason": "a"}, {"index": 2, "rea'
+    assert parse_rerank_decisions(text) == ([{"index": 0, "reason": "a"}], SALVAGED)
+
+
+def test_line_comments_between_items():
+    text = 'Sure! [ {"index": 0}, // c\n {"index": 3} ]'
+    assert parse_rerank_decisions(text) == ([{"index": 0}, {"index": 3}], SALVAGED)
+
+
+def test_slashes_inside_strings_are_kept():
+    text = 'Here: [{"index": 0, "reason": "see http://x.y"}, // note\n {"index": 1}'
+    decisions, outcome = parse_rerank_decisions(text)
+    assert outcome == SALVAGED
+    assert decisions == [{"index": 0, "reason": "see http://x.y"}, {"index": 1}]
+
+
+def test_unusable_answer():
+    assert parse_rerank_decisions("") == ([], FAILED)
+    assert parse_rerank_decisions("no idea") == ([], FAILED)
@@ -0,0 +1,133 @@
+"""
+Shared TMDB client for the ingestion scripts (populate_tmdb.py, regenerate_embeddings.py).
+
+- One requests.Session with a connection pool sized for the worker threads
+- One token bucket shared by every thread, so the scripts run right at the
+  API limit instead of far below it with fixed sleeps
+- Retries on 429/5xx / connection errors honouring Retry-After. Every attempt,
+  retries included, takes a token, so retries never push past the limit
+
+TMDB_BASE_URL can point to a local fake server (see debug/fake_tmdb_server.py),
+TMDB_MAX_CALLS changes the budget per 10s window.
+"""
+import os
+import time
+import random
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+from requests.adapters import HTTPAdapter
+
+TMDB_BASE_URL = os.getenv("TMDB_BASE_URL", "https://api.themoviedb.org/3")
+TMDB_MAX_CALLS = int(os.getenv("TMDB_MAX_CALLS", "38"))  # per 10 seconds (+2 burst = 40)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: refills max_calls tokens per period, holds at most `burst`.
+    Any window of `period` seconds sees at most max_calls + burst calls (38 + 2 = 40 / 10s by default).
+    """
+    def __init__(self, max_calls: int = TMDB_MAX_CALLS, period: float = 10.0, burst: int = 2):
+        self.rate = max_calls / period
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.total_calls = 0
+        self.total_waits = 0
+        self.total_wait_time = 0.0
+
+    def acquire(self):
+        """Takes one token, sleeping (outside the lock) until it is available"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Reserve the token now; a negative balance is the queue of waiting callers
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.total_calls += 1
+            if wait > 0:
+                self.total_waits += 1
+                self.total_wait_time += wait
+        if wait > 0:
+            time.sleep(wait)
+
+    def get_stats(self):
+        return {
+            'total_calls': self.total_calls,
+            'total_waits': self.total_waits,
+            'total_wait_time': self.total_wait_time,
+        }
+
+
+class TMDBClient:
+    """Pooled, rate-limited TMDB client with a bounded thread pool for concurrent fetches"""
+
+    def __init__(self, api_key: str, base_url: str = TMDB_BASE_URL,
+                 limiter: Optional[TokenBucket] = None, max_workers: int = 8, timeout: float = 10,
+                 max_retries: int = 3, backoff: float = 1.0, max_retry_after: float = 60.0):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.limiter = limiter or TokenBucket()
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_retry_after = max_retry_after
+        self.retries = 0
+
+        # No urllib3 retries: they would bypass the token bucket, get_response retries instead
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _retry_delay(self, attempt: int, retry_after: Optional[str]) -> float:
+        try:
+            return min(max(0.0, float(retry_after)), self.max_retry_after)
+        except (TypeError, ValueError):
+            # Exponential backoff with jitter, so the workers that failed together do not retry together
+            return self.backoff * 2 ** attempt * random.uniform(0.5, 1.0)
+
+    def get_response(self, path: str, **params) -> requests.Response:
+        """
+        Rate-limited GET returning the raw response. 429/5xx and connection
+        errors are retried up to max_retries times, each attempt through the
+        token bucket; the last response (or error) is returned / raised.
+        """
+        params['api_key'] = self.api_key
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except requests.ConnectionError:
+                if attempt == self.max_retries:
+                    raise
+                retry_after = None
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    return response
+                retry_after = response.headers.get("Retry-After")
+            self.retries += 1
+            time.sleep(self._retry_delay(attempt, retry_after))
+
+    def get(self, path: str, **params) -> Dict[str, Any]:
+        """Rate-limited GET returning the JSON body (raises on HTTP errors)"""
+        response = self.get_response(path, **params)
+        response.raise_for_status()
+        return response.json()
+
+    def map(self, fn: Callable, items: Iterable) -> Iterator:
+        """
+        Runs fn(item) for every item on the worker pool, yielding results in input order.
+        All calls share the session pool and the token bucket.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            yield from executor.map(fn, items)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,121 @@
+"""
+Shared, pooled async HTTP clients for the request path (main.py, rag_service.py).
+
+Every upstream (PostgREST, Groq) gets one httpx.AsyncClient, so connections and
+TLS sessions are reused across requests, plus an asyncio.Semaphore. A request
+that finds the upstream at its concurrency limit waits as a coroutine, without
+holding a threadpool thread, so a slow Groq round trip can no longer starve
+/health or the other endpoints.
+
+The client and the semaphore are created lazily on the running event loop and
+dropped by aclose() (called on app shutdown).
+
+    POSTGREST_MAX_CONCURRENCY   in-flight PostgREST calls per worker (default 20)
+    GROQ_MAX_CONCURRENCY        in-flight Groq calls per worker (default 8)
+"""
+import asyncio
+import httpx
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+
+
+class Upstream:
+    def __init__(self, name: str, base_url: str, headers: Optional[Dict[str, str]] = None,
+                 max_concurrency: int = 10, timeout: float = 30.0):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.headers = headers or {}
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.total_calls = 0
+
+    def _ensure(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client, self._semaphore
+
+    @asynccontextmanager
+    async def _slot(self) -> AsyncIterator[httpx.AsyncClient]:
+        client, semaphore = self._ensure()
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.total_calls += 1
+        try:
+            yield client
+        finally:
+            self.in_flight -= 1
+            semaphore.release()
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """One call through the pool, waiting for a free slot when the upstream is saturated"""
+        async with self._slot() as client:
+            return await client.request(method, path, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, path: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """Streaming call: the slot is held until the response body has been consumed"""
+        async with self._slot() as client:
+            async with client.stream(method, path, **kwargs) as response:
+                yield response
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+        self._client = None
+        self._semaphore = None
+
+    def stats(self) -> Dict:
+        return {
+            'max_concurrency': self.max_concurrency,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'total_calls': self.total_calls,
+        }
+
+
+def eq(value) -> str:
+    return f"eq.{value}"
+
+
+def in_(values: Iterable) -> str:
+    return f"in.({','.join(str(v) for v in values)})"
+
+
+class PostgrestClient(Upstream):
+    """Minimal async PostgREST client: the table reads and RPCs used by the endpoints"""
+
+    def __init__(self, supabase_url: str, key: str, max_concurrency: int = 20, timeout: float = 30.0):
+        super().__init__(
+            'postgrest',
+            f"{supabase_url.rstrip('/')}/rest/v1",
+            headers={'apikey': key, 'Authorization': f"Bearer {key}"},
+            max_concurrency=max_concurrency,
+            timeout=timeout,
+        )
+
+    async def select(self, table: str, columns: str, **filters: str) -> List[Dict]:
+        """GET /table?select=columns&<column>=<filter>, e.g. select('movies', 'id', id=in_([1, 2]))"""
+        params = {'select': columns.replace(' ', ''), **filters}
+        response = await self.request('GET', f"/{table}", params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def rpc(self, function: str, params: Dict):
+        response = await self.request('POST', f"/rpc/{function}", json=params)
+        response.raise_for_status()
+        return response.json()
@@ -0,0 +1,87 @@
+import asyncio
+from typing import Dict, List
+from supabase import Client
+from upstreams import PostgrestClient, eq, in_
+
+# PostgREST sends .in_() filters in the URL, so very large histories are
+# fetched in a few bulk chunks instead of a single oversized request
+IN_FILTER_CHUNK = 500
+
+HISTORY_MOVIE_COLUMNS = 'id, series_title, genre, released_year'
+
+
+class UserHistory:
+    """
+    A user's ratings hydrated with movie metadata, loaded once per request.
+    Shared by the user vector, the seen-id exclusion list and the RAG context.
+    """
+    def __init__(self, user_id: str, ratings: List[Dict], movies: List[Dict]):
+        self.user_id = user_id
+        self.ratings = ratings
+        self.movie_map = {m['id']: m for m in movies}
+
+    def __len__(self):
+        return len(self.ratings)
+
+    @property
+    def seen_ids(self) -> List[int]:
+        return [r['movie_id'] for r in self.ratings]
+
+    def rag_ratings(self) -> List[Dict]:
+        """Ratings in the format expected by RagService (title, rating, genre, year)"""
+        ratings = []
+        for item in self.ratings:
+            movie = self.movie_map.get(item['movie_id'])
+            if movie:
+                ratings.append({
+                    'title': movie['series_title'],
+                    'rating': item['rating'],
+                    'genre': movie.get('genre', ''),
+                    'year': movie.get('released_year', '')
+                })
+        return ratings
+
+
+def fetch_movies_by_ids(client: Client, movie_ids: List[int], columns: str) -> List[Dict]:
+    """Bulk-fetches movie rows with .in_() lookups (one call per chunk of ids)"""
+    movies = []
+    unique_ids = list(dict.fromkeys(movie_ids))
+    for i in range(0, len(unique_ids), IN_FILTER_CHUNK):
+        chunk = unique_ids[i:i + IN_FILTER_CHUNK]
+        response = client.table('movies')\
+            .select(columns)\
+            .in_('id', chunk)\
+            .execute()
+        if response.data:
+            movies.extend(response.data)
+    return movies
+
+
+def load_user_history(client: Client, user_id: str) -> UserHistory:
+    """Fetches user_movies once and all the needed movie metadata in bulk"""
+    response = client.table('user_movies')\
+        .select('movie_id, rating')\
+        .eq('user_id', user_id)\
+        .execute()
+    ratings = response.data or []
+
+    movies = fetch_movies_by_ids(client, [r['movie_id'] for r in ratings], HISTORY_MOVIE_COLUMNS) if ratings else []
+
+    return UserHistory(user_id, ratings, movies)
+
+
+async def afetch_movies_by_ids(postgrest: PostgrestClient, movie_ids: List[int], columns: str) -> List[Dict]:
+    """Async fetch_movies_by_ids: the chunks go out concurrently through the shared pool"""
+    unique_ids = list(dict.fromkeys(movie_ids))
+    chunks = [unique_ids[i:i + IN_FILTER_CHUNK] for i in range(0, len(unique_ids), IN_FILTER_CHUNK)]
+    pages = await asyncio.gather(*(postgrest.select('movies', columns, id=in_(chunk)) for chunk in chunks))
+    return [movie for page in pages for movie in page]
+
+
+async def aload_user_history(postgrest: PostgrestClient, user_id: str) -> UserHistory:
+    """Async load_user_history for the request path"""
+    ratings = await postgrest.select('user_movies', 'movie_id, rating', user_id=eq(user_id))
+
+    movies = await afetch_movies_by_ids(postgrest, [r['movie_id'] for r in ratings], HISTORY_MOVIE_COLUMNS) if ratings else []
+
+    return UserHistory(user_id, ratings, movies)
@@ -0,0 +1,161 @@
+"""
+Persistent per-user taste vectors (cache/user_vectors.sqlite).
+
+For every user the store keeps the running weighted sum of the rated movies'
+embeddings, the total weight and the ratings snapshot they were built from.
+A request diffs the current ratings against that snapshot and applies only
+the added / changed / removed ratings (O(d) each), so only the embeddings of
+those movies are looked up. A user is rebuilt from scratch when they have no
+entry yet or when the embeddings version changed (new cache / regenerated
+embeddings, see embedding_version()).
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+import numpy as np
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from cache_store import CACHE_DIR, embeddings_fingerprint
+
+USER_VECTORS_DB_PATH = os.path.join(CACHE_DIR, "user_vectors.sqlite")
+
+# movie_ids -> (ids that have an embedding, float32 matrix with one row per id)
+EmbeddingLookup = Callable[[List[int]], Tuple[List[int], np.ndarray]]
+
+
+def embedding_version() -> str:
+    """
+    Identifies the embeddings the vectors were built from. EMBEDDING_VERSION
+    overrides it; otherwise the local cache file is used when present. Without
+    one (pgvector only) the version is constant: regenerate_embeddings.py
+    --upload calls invalidate_movies() for what it re-embedded, and a server
+    whose store it cannot reach needs EMBEDDING_VERSION bumped instead.
+    """
+    override = os.getenv("EMBEDDING_VERSION")
+    if override:
+        return override
+    fingerprint = embeddings_fingerprint()
+    if fingerprint:
+        return f"cache:{fingerprint}"
+    return "pgvector"
+
+
+class UserVectorStore:
+    def __init__(self, path: str = USER_VECTORS_DB_PATH, version: str = None):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.version = version or embedding_version()
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_vectors (
+                user_id      TEXT PRIMARY KEY,
+                version      TEXT NOT NULL,
+                vector_sum   BLOB NOT NULL,
+                total_weight REAL NOT NULL,
+                ratings      TEXT NOT NULL,
+                updated_at   REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def _load(self, user_id: str):
+        row = self.conn.execute(
+            "SELECT version, vector_sum, total_weight, ratings FROM user_vectors WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+        if row is None or row[0] != self.version:
+            return None
+        snapshot = {int(movie_id): weight for movie_id, weight in json.loads(row[3]).items()}
+        return np.frombuffer(row[1], dtype=np.float64).copy(), row[2], snapshot
+
+    def _save(self, user_id: str, vector_sum: np.ndarray, total_weight: float, snapshot: Dict[int, float]):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO user_vectors VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, self.version, vector_sum.astype(np.float64).tobytes(), float(total_weight),
+             json.dumps(snapshot), time.time())
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def _current_weights(ratings: Iterable[Dict]) -> Dict[int, float]:
+        return {int(r['movie_id']): float(r['rating'] or 0) for r in ratings}
+
+    def _rebuild(self, weights: Dict[int, float], lookup: EmbeddingLookup):
+        ids, matrix = lookup(list(weights))
+        snapshot = {movie_id: weights[movie_id] for movie_id in ids}
+        w = np.fromiter(snapshot.values(), dtype=np.float64, count=len(snapshot))
+        vector_sum = w @ matrix.astype(np.float64) if len(ids) else None
+        return vector_sum, float(w.sum()), snapshot
+
+    def user_vector(self, user_id: str, ratings: List[Dict], lookup: EmbeddingLookup) -> Optional[np.ndarray]:
+        """
+        Weighted mean (weight = rating) of the user's rated movies, kept up to
+        date incrementally. Movies without an embedding are skipped (and looked
+        up again next time). Returns None when no rated movie has an embedding.
+        """
+        weights = self._current_weights(ratings)
+
+        with self.lock:
+            state = self._load(user_id)
+
+        if state is None:
+            vector_sum, total_weight, snapshot = self._rebuild(weights, lookup)
+            mode = "rebuilt"
+        else:
+            vector_sum, total_weight, snapshot = state
+            # Delta per movie: new weight - weight already folded into the sum
+            deltas = {
+                movie_id: weights.get(movie_id, 0.0) - snapshot.get(movie_id, 0.0)
+                for movie_id in set(weights) | set(snapshot)
+            }
+            deltas = {
+                movie_id: delta for movie_id, delta in deltas.items()
+                if delta != 0 or (movie_id in weights and movie_id not in snapshot)
+            }
+            ids, matrix = lookup(list(deltas)) if deltas else ([], None)
+            if set(deltas) - set(ids) & set(snapshot):
+                # A movie already in the sum lost its embedding: it cannot be subtracted
+                vector_sum, total_weight, snapshot = self._rebuild(weights, lookup)
+                mode = "rebuilt"
+            elif deltas:
+                if len(ids):
+                    d = np.fromiter((deltas[m] for m in ids), dtype=np.float64, count=len(ids))
+                    vector_sum = vector_sum + d @ matrix.astype(np.float64)
+                    total_weight += float(d.sum())
+                for movie_id in ids:
+                    snapshot[movie_id] = weights.get(movie_id, 0.0)
+                for movie_id in deltas:
+                    if movie_id not in weights:
+                        snapshot.pop(movie_id, None)
+                mode = f"{len(deltas)} incremental updates"
+            else:
+                mode = "cached"
+
+        if vector_sum is None or total_weight <= 0 or not snapshot:
+            return None
+
+        if mode != "cached":
+            with self.lock:
+                self._save(user_id, vector_sum, total_weight, snapshot)
+        print(f"🧮 User vector for {user_id}: {mode} ({len(snapshot)} ratings)")
+
+        return (vector_sum / total_weight).astype(np.float32)
+
+    def invalidate(self, user_id: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM user_vectors WHERE user_id = ?", (user_id,))
+            self.conn.commit()
+
+    def invalidate_movies(self, movie_ids: Iterable[int]) -> int:
+        """Drops every user whose sum includes one of these movies (their embedding changed). Returns the count"""
+        movie_ids = {int(m) for m in movie_ids}
+        with self.lock:
+            stale = [
+                (user_id,) for user_id, ratings in self.conn.execute("SELECT user_id, ratings FROM user_vectors")
+                if movie_ids.intersection(int(m) for m in json.loads(ratings))
+            ]
+            self.conn.executemany("DELETE FROM user_vectors WHERE user_id = ?", stale)
+            self.conn.commit()
+        return len(stale)
@@ -0,0 +1,73 @@
+import json
+import numpy as np
+from typing import Dict, List, Optional
+
+
+def decode_embeddings(raw_embeddings: List) -> np.ndarray:
+    """
+    Decodes a list of embeddings straight into one float32 matrix.
+    Supabase returns pgvector columns as text ('[0.1,0.2,...]'), so the
+    common case is parsed in a single C-level pass instead of one json.loads per row.
+    """
+    if not raw_embeddings:
+        return np.empty((0, 0), dtype=np.float32)
+
+    if all(isinstance(e, str) for e in raw_embeddings):
+        body = ','.join(e.strip()[1:-1] for e in raw_embeddings)
+        flat = np.fromstring(body, dtype=np.float32, sep=',')
+        return flat.reshape(len(raw_embeddings), -1)
+
+    return np.array(
+        [json.loads(e) if isinstance(e, str) else e for e in raw_embeddings],
+        dtype=np.float32
+    )
+
+
+def weighted_mean_from_matrix(ratings: List[Dict], row_of: Dict[int, int], matrix: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Weighted average (weight = rating) of the rows of matrix that belong to the rated movies.
+    row_of maps movie_id -> row in matrix; ratings without a row are skipped.
+
+    Ratings are folded into one weight per matrix row, so the mean is a
+    single matrix-vector product no matter how many ratings the user has.
+    Returns None when no rated movie has a row.
+    """
+    rows = np.fromiter(
+        (row_of.get(r['movie_id'], -1) for r in ratings),
+        dtype=np.int64, count=len(ratings)
+    )
+    weights = np.fromiter(
+        (r['rating'] or 0 for r in ratings),
+        dtype=np.float64, count=len(ratings)
+    )
+
+    found = rows >= 0
+    if not found.any():
+        return None
+
+    # Only touch the rows that were rated (the matrix may be the full catalogue)
+    used_rows, inverse = np.unique(rows[found], return_inverse=True)
+    per_row_weight = np.bincount(inverse, weights=weights[found], minlength=len(used_rows))
+    total_weight = per_row_weight.sum()
+
+    if total_weight <= 0:
+        return None
+
+    return (per_row_weight.astype(np.float32) @ matrix[used_rows]) / np.float32(total_weight)
+
+
+def weighted_mean_vector(ratings: List[Dict], embedding_rows: List[Dict]) -> Optional[np.ndarray]:
+    """
+    Weighted average of the rated movies' embeddings (weight = rating).
+
+    ratings: rows with 'movie_id' and 'rating' (as returned by user_movies)
+    embedding_rows: rows with 'id' and 'embedding' (as returned by movies)
+    """
+    rows_with_embedding = [m for m in embedding_rows if m.get('embedding')]
+    if not rows_with_embedding:
+        return None
+
+    matrix = decode_embeddings([m['embedding'] for m in rows_with_embedding])
+    row_of = {m['id']: i for i, m in enumerate(rows_with_embedding)}
+
+    return weighted_mean_from_matrix(ratings, row_of, matrix)
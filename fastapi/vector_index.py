@@ -0,0 +1,277 @@
+"""
+In-process similarity search over the local cache (cache/embeddings.npy).
+
+Drop-in alternative to the match_movies pgvector RPC: search() applies the
+same semantics (cosine similarity > match_threshold, excluded_ids removed,
+best match_count first) and returns the same {'id', 'similarity'} rows.
+
+With quantized=(compact, scale) (build_quantized.py) the scan runs over an
+int8 copy of the unit-normalised rows (4x smaller) and only the best `rescore`
+candidates are re-scored against the full-precision matrix. This trades
+memory, not speed: numpy has no int8 matrix-vector kernel, so the scan widens
+blocks to float32 and is no faster than the exact one, but the float32 file can
+stay memory-mapped and mostly on disk while the shared int8 file stays hot.
+
+With reduced=(matrix, projection) (build_reduced.py) the coarse selection runs
+on 128-256 dim PCA / truncated rows instead, and the best `rescore` candidates
+(500 by default) are ranked with the full vectors. Quantization is then not
+used, since the int8 copy would never be scanned.
+"""
+import time
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Tuple
+
+QUANTIZATION_BLOCK = 2048
+DEFAULT_RESCORE = 300
+DEFAULT_COARSE = 500
+
+
+def quantize_embeddings(embeddings: np.ndarray, inv_norms: np.ndarray, out: np.ndarray = None,
+                        block_size: int = QUANTIZATION_BLOCK) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    int8 copy of the unit-normalised rows, built block by block into `out`
+    (e.g. a np.lib.format.open_memmap) or a new array.
+    Returns (int8 matrix, float32 per-dimension scale): row ≈ q * scale
+    """
+    n, dim = embeddings.shape
+    max_abs = np.zeros(dim, dtype=np.float32)
+    for start in range(0, n, block_size):
+        end = start + block_size
+        unit = np.abs(embeddings[start:end] * inv_norms[start:end, None])
+        np.maximum(max_abs, unit.max(axis=0), out=max_abs)
+    scale = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+
+    compact = np.empty((n, dim), dtype=np.int8) if out is None else out
+    for start in range(0, n, block_size):
+        end = start + block_size
+        unit = embeddings[start:end] * inv_norms[start:end, None]
+        compact[start:end] = np.clip(np.rint(unit / scale), -127, 127)
+    return compact, scale
+
+
+class ExactIndex:
+    """Brute-force cosine search over every movie (exact unless a coarse tier is set)."""
+
+    def __init__(self, movie_ids: Iterable[int], embeddings: np.ndarray,
+                 quantized: Tuple[np.ndarray, np.ndarray] = None, reduced: Tuple[np.ndarray, np.ndarray] = None,
+                 rescore: int = None):
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        self.embeddings = embeddings
+        self.id_to_row = {int(movie_id): i for i, movie_id in enumerate(self.movie_ids)}
+
+        # Norms are kept aside so the matrix itself is never copied or rewritten
+        norms = np.sqrt(np.einsum('ij,ij->i', embeddings, embeddings)).astype(np.float32)
+        self.valid = norms > 0
+        self.inv_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=self.valid)
+
+        self.reduced, self.projection = reduced if reduced is not None else (None, None)
+        if self.reduced is not None and len(self.reduced) != len(self.movie_ids):
+            raise ValueError(f"Reduced tier has {len(self.reduced)} rows, catalogue has {len(self.movie_ids)}: "
+                             "run build_reduced.py again")
+
+        self.compact, self.scale = quantized if quantized is not None else (None, None)
+        if self.compact is not None and self.reduced is not None:
+            # The reduced tier does the coarse scan and the rescore reads the float32 rows: the int8 copy would never be read
+            print("⚠️  Quantized copy ignored: the reduced tier already does the coarse scan")
+            self.compact, self.scale = None, None
+        if self.compact is not None and len(self.compact) != len(self.movie_ids):
+            raise ValueError(f"Quantized copy has {len(self.compact)} rows, catalogue has {len(self.movie_ids)}: "
+                             "run build_quantized.py again")
+        self.rescore = rescore or (DEFAULT_COARSE if self.reduced is not None else DEFAULT_RESCORE)
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    @property
+    def dim(self) -> int:
+        return self.embeddings.shape[1]
+
+    def _excluded_mask(self, excluded_ids: Iterable[int]) -> np.ndarray:
+        """Boolean mask over rows: excluded movies + movies without embedding"""
+        mask = ~self.valid
+        rows = [self.id_to_row[int(m)] for m in excluded_ids if int(m) in self.id_to_row]
+        if rows:
+            mask = mask.copy()
+            mask[rows] = True
+        return mask
+
+    def _score(self, query: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        """Cosine similarity between a unit query and the given rows (all rows if None)"""
+        if rows is None:
+            return (self.embeddings @ query) * self.inv_norms
+        return (self.embeddings[rows] @ query) * self.inv_norms[rows]
+
+    @property
+    def approximate(self) -> bool:
+        return self.reduced is not None or self.compact is not None
+
+    def _approx_score(self, query: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Coarse score used to pick the rows worth re-scoring.
+        Reduced tier: dot product in the R-dim space (the mean term of PCA is
+        the same for every row, so ranking is unaffected).
+        int8 matrix: numpy has no int8 matrix-vector kernel, so blocks are
+        widened into a reused float32 buffer.
+        """
+        if self.reduced is not None:
+            reduced_query = query @ self.projection
+            return (self.reduced if rows is None else self.reduced[rows]) @ reduced_query
+
+        query = query * self.scale
+        if rows is not None:
+            return self.compact[rows].astype(np.float32) @ query
+
+        n = len(self.compact)
+        out = np.empty(n, dtype=np.float32)
+        buffer = np.empty((min(n, QUANTIZATION_BLOCK), self.dim), dtype=np.float32)
+        for start in range(0, n, QUANTIZATION_BLOCK):
+            block = self.compact[start:start + QUANTIZATION_BLOCK]
+            widened = buffer[:len(block)]
+            widened[...] = block
+            out[start:start + len(block)] = widened @ query
+        return out
+
+    def _scored_rows(self, query: np.ndarray, rows: Optional[np.ndarray], excluded: np.ndarray,
+                     match_count: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rows to consider (all if None) with their full-precision similarity.
+        With a coarse tier only the best max(rescore, match_count) approximate rows are kept.
+        """
+        if not self.approximate:
+            return (np.arange(len(self)) if rows is None else rows), self._score(query, rows)
+
+        approx = self._approx_score(query, rows)
+        rows = np.arange(len(self)) if rows is None else rows
+        approx[excluded[rows]] = -np.inf
+
+        keep = min(len(rows), max(self.rescore, match_count))
+        if keep < len(rows):
+            rows = np.sort(rows[np.argpartition(-approx, keep - 1)[:keep]])
+        return rows, self._score(query, rows)
+
+    def _select(self, rows: np.ndarray, sims: np.ndarray, excluded: np.ndarray,
+                match_threshold: float, match_count: int) -> List[Dict]:
+        """Applies threshold + exclusions and returns the best match_count rows"""
+        keep = (sims > match_threshold) & ~excluded[rows]
+        rows, sims = rows[keep], sims[keep]
+
+        if len(sims) > match_count:
+            top = np.argpartition(-sims, match_count - 1)[:match_count]
+            rows, sims = rows[top], sims[top]
+
+        order = np.argsort(-sims, kind='stable')
+        return [
+            {'id': int(self.movie_ids[r]), 'similarity': float(s)}
+            for r, s in zip(rows[order], sims[order])
+        ]
+
+    @staticmethod
+    def _unit(query_embedding) -> np.ndarray:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        return query / norm if norm > 0 else query
+
+    def search(self, query_embedding, match_threshold: float = 0.5,
+               match_count: int = 50, excluded_ids: Iterable[int] = ()) -> List[Dict]:
+        """Same contract as supabase.rpc('match_movies', ...).data"""
+        query = self._unit(query_embedding)
+        excluded = self._excluded_mask(excluded_ids)
+        rows, sims = self._scored_rows(query, None, excluded, match_count)
+        return self._select(rows, sims, excluded, match_threshold, match_count)
+
+
+class IVFIndex(ExactIndex):
+    """
+    Inverted-file index: spherical k-means splits the catalogue into nlist
+    clusters and a query only scores the rows of its nprobe closest clusters.
+    Falls back to the exact scan when the probed clusters hold fewer than
+    match_count candidates (a threshold that filters results out does not).
+    """
+
+    def __init__(self, movie_ids: Iterable[int], embeddings: np.ndarray,
+                 nlist: int = None, nprobe: int = None, n_iter: int = 10, seed: int = 0, **kwargs):
+        super().__init__(movie_ids, embeddings, **kwargs)
+
+        n = len(self)
+        # k-means seeds every list with a distinct valid row
+        valid_count = int(np.count_nonzero(self.valid))
+        self.nlist = max(1, min(valid_count, nlist or int(4 * np.sqrt(n))))
+        self.nprobe = min(self.nlist, nprobe or max(1, self.nlist // 16))
+
+        start = time.time()
+        self.centroids = self._train(n_iter, np.random.default_rng(seed))
+        assign = self._assign(self.embeddings)
+
+        # Inverted lists stored CSR-style: rows of cluster c are list_rows[offsets[c]:offsets[c+1]]
+        self.list_rows = np.argsort(assign, kind='stable')
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=self.nlist))])
+
+        print(f"✅ IVF index built: {n} movies, {self.nlist} lists, "
+              f"nprobe={self.nprobe} ({time.time() - start:.1f}s)")
+
+    def _assign(self, matrix: np.ndarray, block_size: int = 4096) -> np.ndarray:
+        """Closest centroid for every row (row norms do not change the argmax)"""
+        assign = np.empty(len(matrix), dtype=np.int64)
+        for start in range(0, len(matrix), block_size):
+            block = matrix[start:start + block_size]
+            assign[start:start + block_size] = np.argmax(block @ self.centroids.T, axis=1)
+        return assign
+
+    def _train(self, n_iter: int, rng) -> np.ndarray:
+        """Spherical k-means on a sample of the valid rows"""
+        valid_rows = np.flatnonzero(self.valid)
+        if len(valid_rows) == 0:
+            return np.zeros((self.nlist, self.dim), dtype=np.float32)
+        sample_size = min(len(valid_rows), self.nlist * 32)
+        sample = np.sort(rng.choice(valid_rows, size=sample_size, replace=False))
+        points = self.embeddings[sample] * self.inv_norms[sample, None]
+
+        centroids = points[rng.choice(len(points), size=self.nlist, replace=False)].copy()
+        for _ in range(n_iter):
+            self.centroids = centroids
+            assign = self._assign(points)
+
+            order = np.argsort(assign, kind='stable')
+            counts = np.bincount(assign, minlength=self.nlist)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            non_empty = counts > 0
+            sums = np.add.reduceat(points[order], starts[non_empty], axis=0)
+
+            centroids = centroids.copy()
+            centroids[non_empty] = sums
+            # Empty clusters are re-seeded with random sample points
+            empty = np.flatnonzero(~non_empty)
+            if len(empty):
+                centroids[empty] = points[rng.choice(len(points), size=len(empty), replace=False)]
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-12
+
+        return centroids.astype(np.float32)
+
+    def search(self, query_embedding, match_threshold: float = 0.5,
+               match_count: int = 50, excluded_ids: Iterable[int] = ()) -> List[Dict]:
+        query = self._unit(query_embedding)
+        excluded = self._excluded_mask(excluded_ids)
+
+        centroid_sims = self.centroids @ query
+        probe = np.argpartition(-centroid_sims, self.nprobe - 1)[:self.nprobe]
+        rows = np.sort(np.concatenate([
+            self.list_rows[self.offsets[c]:self.offsets[c + 1]] for c in probe
+        ]))
+        if np.count_nonzero(~excluded[rows]) < match_count:
+            # The probed clusters cannot fill match_count even before the threshold: answer exactly
+            return super().search(query, match_threshold, match_count, excluded_ids)
+
+        rows, sims = self._scored_rows(query, rows, excluded, match_count)
+        return self._select(rows, sims, excluded, match_threshold, match_count)
+
+
+def build_index(movie_ids: Iterable[int], embeddings: np.ndarray, kind: str = "ivf", **kwargs) -> ExactIndex:
+    """Factory for the local serving index ('ivf' or 'exact')"""
+    if kind == "exact":
+        # IVF-only settings do not apply to the brute-force scan
+        for key in ('nlist', 'nprobe', 'n_iter', 'seed'):
+            kwargs.pop(key, None)
+        return ExactIndex(movie_ids, embeddings, **kwargs)
+    if kind == "ivf":
+        return IVFIndex(movie_ids, embeddings, **kwargs)
+    raise ValueError(f"Unknown local index type: {kind}")
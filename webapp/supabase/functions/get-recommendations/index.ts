@@ -150,7 +150,7 @@ Deno.serve(async (req) => {
         .from("user_recommendations")
         .select("movie_id")
         .eq("user_id", userId)
-        .order("generated_at", { ascending: false })
+        .order("position", { ascending: true })
         .range(page * ITEMS_PER_PAGE, (page + 1) * ITEMS_PER_PAGE - 1);
 
     if (recommendationError) {
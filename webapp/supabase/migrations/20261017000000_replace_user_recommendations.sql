@@ -0,0 +1,61 @@
+-- Atomic, diff-based replacement of user recommendation sets.
+-- Used by the FastAPI backend (recommendation_store.py) instead of
+-- delete-all-then-insert. One call swaps the sets of one or more users inside a
+-- single transaction. Readers never see an empty set, and rows whose position
+-- and score did not change are left untouched (readers order by position).
+
+-- One row per (user, movie): keep the first copy of any duplicate
+delete from public.user_recommendations a
+using public.user_recommendations b
+where a.user_id = b.user_id
+  and a.movie_id = b.movie_id
+  and a.ctid > b.ctid;
+
+create unique index if not exists user_recommendations_user_movie_key
+  on public.user_recommendations (user_id, movie_id);
+
+-- p_user_ids: users whose set is replaced (Clerk ids, text like user_recommendations.user_id)
+-- p_rows:     [{user_id, movie_id, predicted_score, position}, ...] new sets
+create or replace function public.replace_user_recommendations(p_user_ids text[], p_rows jsonb)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+  v_deleted integer;
+  v_written integer;
+begin
+  -- Movies that left a user's set
+  delete from user_recommendations ur
+  where ur.user_id = any(p_user_ids)
+    and not exists (
+      select 1
+      from jsonb_to_recordset(p_rows) as r(user_id text, movie_id bigint)
+      where r.user_id = ur.user_id and r.movie_id = ur.movie_id
+    );
+  get diagnostics v_deleted = row_count;
+
+  -- New movies are inserted; existing ones are only rewritten when they moved or changed score
+  insert into user_recommendations (user_id, movie_id, predicted_score, position, generated_at)
+  select r.user_id, r.movie_id, r.predicted_score, r.position, now()
+  from jsonb_to_recordset(p_rows)
+    as r(user_id text, movie_id bigint, predicted_score double precision, position integer)
+  on conflict (user_id, movie_id) do update
+    set predicted_score = excluded.predicted_score,
+        position = excluded.position,
+        generated_at = excluded.generated_at
+    where (user_recommendations.position, user_recommendations.predicted_score)
+          is distinct from (excluded.position, excluded.predicted_score);
+  get diagnostics v_written = row_count;
+
+  return jsonb_build_object(
+    'deleted', v_deleted,
+    'written', v_written,
+    'unchanged', jsonb_array_length(p_rows) - v_written
+  );
+end;
+$$;
+
+revoke all on function public.replace_user_recommendations(text[], jsonb) from public, anon, authenticated;
+grant execute on function public.replace_user_recommendations(text[], jsonb) to service_role;